@@ -0,0 +1,161 @@
+"""
+Benchmark the effect of overload protection.
+
+The benchmark creates a throwaway test database with a few open polls
+and voters, then runs readers reloading the index and results pages and
+voters submitting votes in threads of this process, once without and
+once with a concurrency limit, and prints a table comparing the two.
+The configured database itself is never touched.
+
+Usage::
+
+    python benchmarks/load_test.py --readers 16 --voters 2 --limit 4
+"""
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mysite.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.contrib.auth.models import User  # noqa: E402
+from django.db import connection, connections  # noqa: E402
+from django.test import Client, override_settings  # noqa: E402
+from django.urls import reverse  # noqa: E402
+
+from polls.models import Choice, Question  # noqa: E402
+
+
+def populate(polls, voters):
+    """Create open polls with four choices each and the voters."""
+    Question.objects.bulk_create(
+        [Question(question_text=f'Benchmark poll {n}') for n in range(polls)])
+    questions = list(Question.objects.order_by('id'))
+    Choice.objects.bulk_create(
+        [Choice(question=question, choice_text=f'Choice {n}')
+         for question in questions for n in range(4)])
+    User.objects.bulk_create(
+        [User(username=f'bench{n}', password='!') for n in range(voters)])
+    return (list(Question.objects.order_by('id').prefetch_related('choice_set')),
+            list(User.objects.order_by('id')))
+
+
+def request(results, backoff, method, *args):
+    """Send one request and record its status and latency."""
+    start = time.perf_counter()
+    response = method(*args)
+    results.append((response.status_code, time.perf_counter() - start))
+    if response.status_code == 503:
+        time.sleep(backoff)
+
+
+def read(number, questions, stop, results, backoff):
+    """Reload the index and results pages until ``stop`` is set."""
+    client = Client(raise_request_exception=False)
+    urls = [reverse('polls:index')] + [
+        reverse('polls:results', args=(question.id,)) for question in questions]
+    try:
+        while not stop.is_set():
+            url = urls[(number + len(results)) % len(urls)]
+            request(results, backoff, client.get, url)
+    finally:
+        connections.close_all()
+
+
+def vote(number, user, questions, stop, results, backoff):
+    """Vote in the polls as ``user`` until ``stop`` is set."""
+    client = Client(raise_request_exception=False)
+    client.force_login(user)
+    try:
+        while not stop.is_set():
+            question = questions[(number + len(results)) % len(questions)]
+            choices = list(question.choice_set.all())
+            choice = choices[len(results) % len(choices)]
+            request(results, backoff, client.post,
+                    reverse('polls:vote', args=(question.id,)),
+                    {'choice': choice.id})
+    finally:
+        connections.close_all()
+
+
+def run_phase(readers, voters, questions, duration, backoff):
+    """Run the clients for ``duration`` seconds and collect their results."""
+    results = {'read': [], 'vote': []}
+    stop = threading.Event()
+    threads = [threading.Thread(target=read, args=(
+        n, questions, stop, results['read'], backoff)) for n in range(readers)]
+    threads += [threading.Thread(target=vote, args=(
+        n, user, questions, stop, results['vote'], backoff))
+        for n, user in enumerate(voters)]
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def report(phase, kind, results):
+    """Print one row of the results table."""
+    ok = [seconds * 1000 for status, seconds in results if status < 400]
+    shed = sum(1 for status, _ in results if status == 503)
+    errors = len(results) - len(ok) - shed
+    if len(ok) >= 2:
+        p50 = statistics.median(ok)
+        p95 = statistics.quantiles(ok, n=20)[-1]
+    else:
+        p50 = p95 = ok[0] if ok else 0
+    print(f"{phase:<10} {kind:<7} {len(results):>8} {len(ok):>6} {shed:>6} "
+          f"{errors:>6} {p50:>8.1f} {p95:>8.1f}")
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--readers', type=int, default=16)
+    parser.add_argument('--voters', type=int, default=2)
+    parser.add_argument('--polls', type=int, default=20)
+    parser.add_argument('--duration', type=float, default=10.0,
+                        help="Seconds to run each phase.")
+    parser.add_argument('--limit', type=int, default=4,
+                        help="POLLS_MAX_CONCURRENT_REQUESTS of the limited "
+                             "phase.")
+    parser.add_argument('--backoff', type=float, default=0.05,
+                        help="Seconds a client waits after a 503.")
+    args = parser.parse_args()
+
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True,
+                                       serialize=False)
+    try:
+        questions, voters = populate(args.polls, args.voters)
+        print(f"{'phase':<10} {'class':<7} {'requests':>8} {'ok':>6} "
+              f"{'503':>6} {'errors':>6} {'p50 ms':>8} {'p95 ms':>8}")
+        for phase, limit in (('unlimited', 0), ('limited', args.limit)):
+            # The test client's host must be allowed, and the vote rate
+            # limits are lifted: every voter votes all the time.
+            with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS,
+                                                  'testserver'],
+                                   POLLS_MAX_CONCURRENT_REQUESTS=limit,
+                                   POLLS_VOTE_RATE_LIMIT=10 ** 9,
+                                   POLLS_VOTE_IP_RATE_LIMIT=10 ** 9):
+                results = run_phase(args.readers, voters, questions,
+                                    args.duration, args.backoff)
+            for kind in ('read', 'vote'):
+                report(phase, kind, results[kind])
+    finally:
+        connections.close_all()
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""
+Benchmark the restore command against loaddata.
+
+The benchmark creates a throwaway test database, fills it with synthetic
+users, polls and votes, and then times loading the same data with
+``loaddata`` (from an indented ``dumpdata`` fixture, like the ones in
+``data/``) and with ``restore`` (from a ``snapshot``).  The configured
+database itself is never touched.
+
+Usage::
+
+    python benchmarks/restore_vs_loaddata.py --users 2000 --polls 200
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mysite.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.contrib.auth.hashers import make_password  # noqa: E402
+from django.contrib.auth.models import User  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+from django.db import connection  # noqa: E402
+
+from polls.models import Choice, Question, Vote  # noqa: E402
+from polls.reconcile import repair_drift  # noqa: E402
+
+
+def populate(users, polls, votes_per_user, seed):
+    """Fill the database with synthetic users, polls and votes."""
+    rng = random.Random(seed)
+    password = make_password('benchmark')
+    User.objects.bulk_create(
+        [User(username=f'bench{n}', password=password) for n in range(users)],
+        batch_size=5000)
+    Question.objects.bulk_create(
+        [Question(question_text=f'Benchmark poll {n}') for n in range(polls)])
+    questions = list(Question.objects.values_list('id', flat=True))
+    Choice.objects.bulk_create(
+        [Choice(question_id=q, choice_text=f'Choice {n}')
+         for q in questions for n in range(4)], batch_size=5000)
+    choices = {}
+    for pk, question_id in Choice.objects.values_list('id', 'question_id'):
+        choices.setdefault(question_id, []).append(pk)
+    votes = [
+        Vote(user_id=user_id, choice_id=rng.choice(choices[question_id]))
+        for user_id in User.objects.values_list('id', flat=True)
+        for question_id in rng.sample(questions, min(votes_per_user, len(questions)))
+    ]
+    Vote.objects.bulk_create(votes, batch_size=5000)
+    repair_drift()
+    return len(votes)
+
+
+def timed(label, function, *args, **kwargs):
+    """Run ``function`` and print how long it took."""
+    start = time.perf_counter()
+    function(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<12}{elapsed:>10.2f}s")
+    return elapsed
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--polls', type=int, default=200)
+    parser.add_argument('--votes-per-user', type=int, default=25)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True,
+                                       serialize=False)
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            votes = populate(args.users, args.polls, args.votes_per_user,
+                             args.seed)
+            print(f"{connection.vendor}: {args.users} users, {args.polls} "
+                  f"polls, {votes} votes")
+            fixture = os.path.join(directory, 'fixture.json')
+            snapshot = os.path.join(directory, 'snapshot.zip')
+            call_command('dumpdata', 'auth.user', 'polls.question',
+                         'polls.choice', 'polls.vote', indent=2,
+                         output=fixture, verbosity=0)
+            call_command('snapshot', snapshot, stdout=open(os.devnull, 'w'))
+            print(f"{'fixture':<12}{os.path.getsize(fixture) / 1e6:>10.1f}MB")
+            print(f"{'snapshot':<12}{os.path.getsize(snapshot) / 1e6:>10.1f}MB")
+
+            call_command('flush', interactive=False, verbosity=0)
+            loaddata = timed('loaddata', call_command, 'loaddata', fixture,
+                             verbosity=0)
+            call_command('flush', interactive=False, verbosity=0)
+            restore = timed('restore', call_command, 'restore', snapshot,
+                            stdout=open(os.devnull, 'w'))
+            print(f"{'speedup':<12}{loaddata / restore:>10.1f}x")
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+Benchmark counting a large ranked-choice poll end to end.
+
+The benchmark creates a throwaway test database, casts ``--ballots``
+ranked ballots in one poll, and times ``tally_question`` with an empty
+cache: reading the ballots from the database and the instant-runoff
+count.  The configured database itself is never touched.
+
+Usage::
+
+    python benchmarks/tally_ranked.py --ballots 100000 --choices 8
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mysite.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.contrib.auth.models import User  # noqa: E402
+from django.core.cache import cache  # noqa: E402
+from django.db import connection  # noqa: E402
+
+from polls.models import Ballot, BallotChoice, Choice, Question  # noqa: E402
+from polls.tally import instant_runoff, load_ballots, tally_question  # noqa: E402
+
+
+def populate(ballots, choices, ranked, seed):
+    """Create one ranked poll with ``ballots`` ballots of ``ranked`` choices."""
+    rng = random.Random(seed)
+    question = Question.objects.create(question_text='Benchmark poll',
+                                       poll_type=Question.PollType.RANKED)
+    Choice.objects.bulk_create([Choice(question=question, choice_text=f'Choice {n}')
+                                for n in range(choices)])
+    choice_ids = list(question.choice_set.order_by('id').values_list('id', flat=True))
+    # Skewed preferences, so the count takes several rounds.
+    weights = [1 / (n + 1) for n in range(choices)]
+    User.objects.bulk_create(
+        [User(username=f'bench{n}', password='!') for n in range(ballots)],
+        batch_size=5000)
+    Ballot.objects.bulk_create(
+        [Ballot(question=question, user_id=user_id)
+         for user_id in User.objects.values_list('id', flat=True)],
+        batch_size=5000)
+    selections = []
+    for ballot_id in Ballot.objects.values_list('id', flat=True).iterator():
+        picked = []
+        while len(picked) < ranked:
+            choice_id = rng.choices(choice_ids, weights)[0]
+            if choice_id not in picked:
+                picked.append(choice_id)
+        selections += [BallotChoice(ballot_id=ballot_id, choice_id=choice_id,
+                                    rank=rank)
+                       for rank, choice_id in enumerate(picked, start=1)]
+        if len(selections) >= 50000:
+            BallotChoice.objects.bulk_create(selections)
+            selections = []
+    BallotChoice.objects.bulk_create(selections)
+    return question
+
+
+def timed(label, function, *args):
+    """Run ``function``, print how long it took and return its result."""
+    start = time.perf_counter()
+    result = function(*args)
+    print(f"{label:<16}{time.perf_counter() - start:>10.3f}s")
+    return result
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--ballots', type=int, default=100000)
+    parser.add_argument('--choices', type=int, default=8)
+    parser.add_argument('--ranked', type=int, default=5,
+                        help="Choices ranked on every ballot.")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True,
+                                       serialize=False)
+    try:
+        question = populate(args.ballots, args.choices, args.ranked, args.seed)
+        print(f"{connection.vendor}: {args.ballots} ballots, "
+              f"{BallotChoice.objects.count()} preferences")
+        candidates = list(question.choice_set.order_by('id').values_list(
+            'id', flat=True))
+        offsets, prefs = timed('load_ballots', load_ballots, question.id,
+                               candidates)
+        timed('instant_runoff', instant_runoff, len(candidates), offsets, prefs)
+        cache.clear()
+        result = timed('tally_question', tally_question, question)
+        print(f"{len(result['rounds'])} rounds, winner {result['winner']}")
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == '__main__':
+    main()
@@ -45,11 +45,15 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'polls.overload.OverloadMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'polls.slowlog.SlowQueryMiddleware',
+    'polls.profiling.ProfilingMiddleware',
+    'polls.bus.InvalidationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -112,6 +116,78 @@ AUTHENTICATION_BACKENDS = [
     'django.contrib.auth.backends.ModelBackend',
 ]
 
+# Cache used for rate limiting and metrics. Use a shared cache such as
+# Redis or Memcached when running more than one worker process.
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND',
+                          default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default='ku-polls'),
+    }
+}
+
+# Vote rate limits: votes per user per question and per client IP,
+# refilled every POLLS_VOTE_RATE_PERIOD seconds.
+POLLS_VOTE_RATE_LIMIT = config('POLLS_VOTE_RATE_LIMIT', default=10, cast=int)
+POLLS_VOTE_IP_RATE_LIMIT = config('POLLS_VOTE_IP_RATE_LIMIT', default=300, cast=int)
+POLLS_VOTE_RATE_PERIOD = config('POLLS_VOTE_RATE_PERIOD', default=60, cast=int)
+
+# Request profiling: staff trigger it with the X-Profile header or a
+# ?profile query parameter; POLLS_PROFILE_SAMPLE_RATE = N also profiles
+# one in N requests (0 disables sampling).
+POLLS_PROFILE_SAMPLE_RATE = config('POLLS_PROFILE_SAMPLE_RATE', default=0, cast=int)
+POLLS_PROFILE_DIR = config('POLLS_PROFILE_DIR', default=str(BASE_DIR / 'profiles'))
+POLLS_PROFILE_KEEP = config('POLLS_PROFILE_KEEP', default=50, cast=int)
+# Store the SQL of profiled requests as executed, with its parameters;
+# they can hold session keys and password hashes, so they are left out by
+# default.
+POLLS_PROFILE_LOG_PARAMS = config('POLLS_PROFILE_LOG_PARAMS', default=False, cast=bool)
+
+# Queue votes in PendingVote and let the ingest_votes worker apply them
+# in batches instead of writing them during the request.
+POLLS_VOTE_QUEUE = config('POLLS_VOTE_QUEUE', default=False, cast=bool)
+POLLS_VOTE_QUEUE_BATCH_SIZE = config('POLLS_VOTE_QUEUE_BATCH_SIZE', default=500, cast=int)
+
+# How workers tell each other to drop cached poll data: 'postgres'
+# (LISTEN/NOTIFY), 'table' (polling a table) or empty when running a
+# single process.
+POLLS_INVALIDATION_TRANSPORT = config('POLLS_INVALIDATION_TRANSPORT', default='')
+POLLS_INVALIDATION_POLL_INTERVAL = config('POLLS_INVALIDATION_POLL_INTERVAL', default=1.0, cast=float)
+
+# Log SQL statements slower than POLLS_SLOW_QUERY_MS milliseconds (0
+# disables the log), keeping the POLLS_SLOW_QUERY_KEEP most recent kinds.
+POLLS_SLOW_QUERY_MS = config('POLLS_SLOW_QUERY_MS', default=0, cast=float)
+POLLS_SLOW_QUERY_KEEP = config('POLLS_SLOW_QUERY_KEEP', default=200, cast=int)
+# Store the parameters of slow queries as well; they can hold password
+# hashes, session keys and e-mail addresses, so they are left out by default.
+POLLS_SLOW_QUERY_LOG_PARAMS = config('POLLS_SLOW_QUERY_LOG_PARAMS', default=False, cast=bool)
+
+# Overload protection: at most POLLS_MAX_CONCURRENT_REQUESTS requests run
+# at once per worker (0 disables the cap); others wait up to
+# POLLS_OVERLOAD_QUEUE_TIMEOUT seconds or get a 503.  When the worker is
+# full, low priority GETs are shed at once and high priority requests get
+# free slots first.  POLLS_REQUEST_LIMITS caps single URL names.
+POLLS_MAX_CONCURRENT_REQUESTS = config('POLLS_MAX_CONCURRENT_REQUESTS', default=0, cast=int)
+POLLS_OVERLOAD_QUEUE_TIMEOUT = config('POLLS_OVERLOAD_QUEUE_TIMEOUT', default=0.5, cast=float)
+POLLS_OVERLOAD_RETRY_AFTER = config('POLLS_OVERLOAD_RETRY_AFTER', default=5, cast=int)
+POLLS_REQUEST_PRIORITIES = {
+    'polls:vote': 'high',
+    'polls:retract': 'high',
+    'login': 'high',
+    'logout': 'high',
+    'polls:signup': 'high',
+    'polls:index': 'low',
+    'polls:results': 'low',
+}
+POLLS_REQUEST_LIMITS = {}
+
+# Anonymous polls: the Bloom filter of the devices that voted is sized for
+# POLLS_ANONYMOUS_VOTERS voters at POLLS_ANONYMOUS_FALSE_POSITIVE_RATE, and
+# each worker saves it every POLLS_ANONYMOUS_FILTER_SYNC_EVERY votes.
+POLLS_ANONYMOUS_VOTERS = config('POLLS_ANONYMOUS_VOTERS', default=5000, cast=int)
+POLLS_ANONYMOUS_FALSE_POSITIVE_RATE = config('POLLS_ANONYMOUS_FALSE_POSITIVE_RATE', default=0.01, cast=float)
+POLLS_ANONYMOUS_FILTER_SYNC_EVERY = config('POLLS_ANONYMOUS_FILTER_SYNC_EVERY', default=20, cast=int)
+
 LOGIN_REDIRECT_URL = 'polls:index'  # after login, show list of polls
 LOGOUT_REDIRECT_URL = 'login'       # after logout, return to login page
 
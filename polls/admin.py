@@ -1,11 +1,11 @@
 """
 Admin interface for the polls app.
 
-This module registers the Question and Choice models with the Django admin
-site.
+This module registers the Question and Choice models and the slow-query
+log with the Django admin site.
 """
 from django.contrib import admin
-from .models import Choice, Question
+from .models import Choice, Question, SlowQuery
 
 
 class ChoiceInline(admin.TabularInline):
@@ -19,14 +19,36 @@ class QuestionAdmin(admin.ModelAdmin):
     """Admin interface for the Question model."""
 
     fieldsets = [
-        (None, {'fields': ['question_text']}),
+        (None, {'fields': ['question_text', 'poll_type', 'anonymous_voting']}),
         ('Date information', {'fields': ['pub_date', 'end_date'], 'classes': ['collapse']}),
+        ('Rate limiting', {'fields': ['vote_rate_limit'], 'classes': ['collapse']}),
     ]
     inlines = [ChoiceInline]
-    list_display = ('question_text', 'id', 'pub_date', 'end_date',
+    list_display = ('question_text', 'id', 'poll_type', 'pub_date', 'end_date',
                     'is_published', 'was_published_recently')
     list_filter = ['pub_date']
     search_fields = ['question_text']
 
 
+class SlowQueryAdmin(admin.ModelAdmin):
+    """Read-only admin interface for the slow-query log."""
+
+    list_display = ('__str__', 'view_name', 'count', 'total_ms', 'average_ms',
+                    'max_ms', 'last_seen')
+    list_filter = ['view_name']
+    search_fields = ['normalized_sql']
+    fields = ['normalized_sql', 'sql', 'params', 'view_name', 'plan', 'count',
+              'total_ms', 'average_ms', 'max_ms', 'first_seen', 'last_seen']
+    readonly_fields = fields
+
+    def has_add_permission(self, request):
+        """Disallow adding; slow queries are recorded by polls.slowlog."""
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        """Disallow editing; slow queries can be viewed and deleted."""
+        return False
+
+
 admin.site.register(Question, QuestionAdmin)
+admin.site.register(SlowQuery, SlowQueryAdmin)
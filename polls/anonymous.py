@@ -0,0 +1,222 @@
+"""
+Anonymous voting.
+
+In a poll with ``anonymous_voting`` on, nobody has to log in.  Each
+browser gets a random device token in a signed cookie, and the vote is
+stored as a ``Vote`` without a user whose ``device`` is a keyed hash of
+the poll and the token.  A device can vote once per poll.
+
+Checking for a duplicate vote would take a ``Vote`` lookup per vote.
+Instead each worker keeps a Bloom filter per poll of the devices that
+voted, about 10 bits per voter for a 1% false positive rate:
+
+- a device the filter has not seen votes straight away;
+- a device it may have seen is looked up in ``Vote``, which settles
+  false positives;
+- the unique ``Vote.device`` column rejects anything the filter missed,
+  such as a vote through another worker.
+
+A worker merges its additions into the poll's ``AnonymousVoterFilter``
+row every ``POLLS_ANONYMOUS_FILTER_SYNC_EVERY`` votes, and a worker that
+starts loads the merged filter from there.  New filters are sized for
+``POLLS_ANONYMOUS_VOTERS`` voters at ``POLLS_ANONYMOUS_FALSE_POSITIVE_RATE``;
+past that the false positive rate grows, which costs lookups but never
+lets a duplicate through.
+"""
+import hashlib
+import math
+import secrets
+import threading
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from django.utils.crypto import salted_hmac
+
+from polls import metrics
+from polls.models import AnonymousVoterFilter, Choice, Question, Vote
+from polls.reconcile import mark_dirty
+
+DEVICE_COOKIE = 'polls_device'
+DEVICE_SALT = 'polls.anonymous.device'
+# Device cookies last for a year.
+DEVICE_MAX_AGE = 365 * 24 * 60 * 60
+
+_filters = {}
+_lock = threading.Lock()
+
+
+class BloomFilter:
+    """A fixed-size Bloom filter of strings."""
+
+    def __init__(self, bits, hashes):
+        """
+        Wrap a bit array.
+
+        Args:
+            bits (bytes): The bit array, all zeros for an empty filter.
+            hashes (int): The number of bits set per key.
+        """
+        self.bits = bytearray(bits)
+        self.size = len(self.bits) * 8
+        self.hashes = hashes
+
+    @classmethod
+    def for_capacity(cls, capacity, error_rate):
+        """Return an empty filter for ``capacity`` keys at ``error_rate``."""
+        size = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        hashes = max(1, round(size / capacity * math.log(2)))
+        return cls(bytes(math.ceil(size / 8)), hashes)
+
+    def positions(self, key):
+        """Return the bit positions of a key, by double hashing."""
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'big')
+        second = int.from_bytes(digest[8:], 'big') | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        """Add a key."""
+        for position in self.positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        """Return False if the key was never added, True if it may have been."""
+        return all(self.bits[position >> 3] & (1 << (position & 7))
+                   for position in self.positions(key))
+
+    def merge(self, bits):
+        """Add the keys of another filter of the same size."""
+        self.bits = bytearray(a | b for a, b in zip(self.bits, bits))
+
+
+def device_token(request):
+    """
+    Return the device token of the request.
+
+    Returns:
+        tuple: The token and whether it is new and has to be set as a
+               cookie with ``set_device_cookie``.
+    """
+    token = request.get_signed_cookie(DEVICE_COOKIE, default=None,
+                                      salt=DEVICE_SALT)
+    if token:
+        return token, False
+    return secrets.token_urlsafe(16), True
+
+
+def set_device_cookie(response, token):
+    """Store a device token in the browser."""
+    response.set_signed_cookie(DEVICE_COOKIE, token, salt=DEVICE_SALT,
+                               max_age=DEVICE_MAX_AGE, httponly=True,
+                               samesite='Lax')
+
+
+def voter_key(question_id, token):
+    """Return the ``Vote.device`` of a device token in a poll."""
+    return salted_hmac(DEVICE_SALT, f'{question_id}:{token}',
+                       algorithm='sha256').hexdigest()
+
+
+def voter_filter(question_id):
+    """
+    Return this worker's filter of a poll, loading it if needed.
+
+    Returns:
+        list: The ``BloomFilter`` and the number of keys added since it
+              was last merged into the database.
+    """
+    with _lock:
+        entry = _filters.get(question_id)
+    if entry is not None:
+        return entry
+    stored = AnonymousVoterFilter.objects.filter(question_id=question_id).first()
+    if stored is None:
+        bloom = BloomFilter.for_capacity(
+            settings.POLLS_ANONYMOUS_VOTERS,
+            settings.POLLS_ANONYMOUS_FALSE_POSITIVE_RATE)
+    else:
+        bloom = BloomFilter(stored.bits, stored.hashes)
+    with _lock:
+        return _filters.setdefault(question_id, [bloom, 0])
+
+
+def sync_filter(question_id):
+    """Merge this worker's filter of a poll with the stored one."""
+    entry = voter_filter(question_id)
+    bloom = entry[0]
+    with transaction.atomic():
+        stored, created = AnonymousVoterFilter.objects.select_for_update(
+        ).get_or_create(question_id=question_id, defaults={
+            'bits': bytes(bloom.bits), 'hashes': bloom.hashes})
+        with _lock:
+            added, entry[1] = entry[1], 0
+            if not created and len(stored.bits) * 8 == bloom.size:
+                bloom.merge(stored.bits)
+            stored.bits = bytes(bloom.bits)
+        stored.voters = F('voters') + added
+        stored.save()
+    metrics.incr('anonymous_filter_syncs')
+
+
+def forget_filters():
+    """Drop the filters held in memory, as a restarted worker would."""
+    with _lock:
+        _filters.clear()
+
+
+def has_voted(question_id, key):
+    """Return True if the device ``key`` already voted in a poll."""
+    bloom = voter_filter(question_id)[0]
+    with _lock:
+        maybe = key in bloom
+    if not maybe:
+        return False
+    # Either a repeat vote or a false positive of the filter.
+    metrics.incr('anonymous_exact_checks')
+    return Vote.objects.filter(device=key).exists()
+
+
+def remember_voter(question_id, key):
+    """Add a device that voted to the filter of a poll."""
+    entry = voter_filter(question_id)
+    with _lock:
+        entry[0].add(key)
+        entry[1] += 1
+        due = entry[1] >= settings.POLLS_ANONYMOUS_FILTER_SYNC_EVERY
+    if due:
+        sync_filter(question_id)
+
+
+def cast_anonymous_vote(question, choice, key):
+    """
+    Record the vote of a device unless it voted in the poll before.
+
+    Returns:
+        bool: True if the vote was recorded, False for a duplicate.
+    """
+    if has_voted(question.id, key):
+        metrics.incr('anonymous_duplicates')
+        return False
+    try:
+        with transaction.atomic():
+            Vote.objects.create(device=key, choice=choice)
+            Choice.objects.filter(pk=choice.pk).update(
+                vote_count=F('vote_count') + 1)
+            mark_dirty(question.id)
+    except IntegrityError:
+        # Voted through another worker, or before the filter was merged.
+        metrics.incr('anonymous_duplicates')
+        remember_voter(question.id, key)
+        return False
+    remember_voter(question.id, key)
+    return True
+
+
+@receiver(post_delete, sender=Question)
+def forget_question_filter(sender, instance, **kwargs):
+    """Drop the filter of a deleted poll."""
+    with _lock:
+        _filters.pop(instance.pk, None)
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class PollsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'polls'
+
+    def ready(self):
+        """Connect the signal handlers that keep derived data up to date."""
+        from polls import anonymous, finalize, ratelimit, search, slowlog, tally  # noqa: F401
@@ -0,0 +1,243 @@
+"""
+Cross-worker cache invalidation.
+
+Caches such as the tally and rate limit caches may live in each worker's
+memory (the default ``LocMemCache``).  When one worker changes a poll,
+the other workers have to drop their copies as well.
+
+Code that changes a poll, its choices or its votes calls ``publish`` with
+the question id.  ``publish`` sends a message through the transport named
+by ``POLLS_INVALIDATION_TRANSPORT``:
+
+- ``postgres``: ``NOTIFY`` on a channel every worker ``LISTEN``s to.
+  Messages arrive as soon as the writing transaction commits.
+- ``table``: a row in ``InvalidationEvent`` that every worker polls for
+  every ``POLLS_INVALIDATION_POLL_INTERVAL`` seconds.  It works on any
+  database, SQLite included.
+- the dotted path of a class with the same ``publish(message)`` and
+  ``listen(stop, ready, interval)`` methods.
+- empty, the default, turns the bus off for single-process deployments.
+
+Both built-in transports publish in the writer's transaction, so a
+rolled-back change sends nothing.  ``InvalidationMiddleware`` starts one
+listener thread per worker process.  The thread passes each message from
+another process to the functions registered with ``on_invalidate``, and
+records the delivery lag in ``polls.metrics``.
+"""
+import datetime
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, connection, connections
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from polls import metrics
+from polls.models import Choice, InvalidationEvent, Question
+
+CHANNEL = 'polls_invalidate'
+# How far back the table transport looks for rows committed late.
+TABLE_GRACE = datetime.timedelta(seconds=5)
+# How long published rows are kept in the table.
+TABLE_RETENTION = datetime.timedelta(minutes=5)
+
+logger = logging.getLogger('polls')
+_handlers = []
+_listener = None
+
+
+def on_invalidate(handler):
+    """Register ``handler(question_id)`` to run when another worker publishes."""
+    _handlers.append(handler)
+    return handler
+
+
+def origin():
+    """Return the name of this worker process."""
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def get_transport():
+    """Return the configured transport, or None when the bus is off."""
+    name = settings.POLLS_INVALIDATION_TRANSPORT
+    if not name:
+        return None
+    transport_class = TRANSPORTS.get(name) or import_string(name)
+    return transport_class()
+
+
+def publish(question_id):
+    """Tell the other workers that a question and its results changed."""
+    transport = get_transport()
+    if transport is None:
+        return
+    transport.publish({'question_id': question_id, 'origin': origin(),
+                       'sent_at': time.time()})
+    metrics.incr('bus_published')
+
+
+def deliver(message):
+    """Run the handlers for a message received from the transport."""
+    if message['origin'] == origin():
+        # The publishing worker already dropped its own entries.
+        return
+    lag_ms = max(0, round((time.time() - message['sent_at']) * 1000))
+    metrics.incr('bus_delivered')
+    metrics.incr('bus_delivery_lag_ms_total', lag_ms)
+    metrics.set_gauge('bus_delivery_lag_ms', lag_ms)
+    for handler in _handlers:
+        handler(message['question_id'])
+
+
+class PostgresTransport:
+    """Send messages with ``NOTIFY`` and receive them with ``LISTEN``."""
+
+    def publish(self, message):
+        """Notify the channel; delivered when the transaction commits."""
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_notify(%s, %s)",
+                           [CHANNEL, json.dumps(message)])
+
+    def listen(self, stop, ready, interval):
+        """Deliver notifications until ``stop`` is set, reconnecting on errors."""
+        import psycopg
+
+        params = connection.get_connection_params()
+        while not stop.is_set():
+            try:
+                with psycopg.connect(**params, autocommit=True) as listener:
+                    listener.execute(f"LISTEN {CHANNEL}")
+                    ready.set()
+                    while not stop.is_set():
+                        for notify in listener.notifies(timeout=interval):
+                            deliver(json.loads(notify.payload))
+            except psycopg.Error:
+                logger.exception("Invalidation listener lost its connection")
+                stop.wait(interval)
+
+
+class TableTransport:
+    """Send messages as ``InvalidationEvent`` rows that workers poll for."""
+
+    def publish(self, message):
+        """Insert the message; visible when the transaction commits."""
+        InvalidationEvent.objects.create(payload=message)
+
+    def listen(self, stop, ready, interval):
+        """Poll for new rows until ``stop`` is set."""
+        since = timezone.now()
+        ready.set()
+        seen = {}
+        last_cleanup = time.monotonic()
+        try:
+            while not stop.wait(interval):
+                now = timezone.now()
+                # Rows are read again for a while, because a transaction
+                # that started earlier may commit a row with an older
+                # created_at after the previous poll.
+                window = min(since, now - TABLE_GRACE)
+                try:
+                    events = list(InvalidationEvent.objects.filter(
+                        created_at__gte=window).order_by('id'))
+                    if (time.monotonic() - last_cleanup
+                            > TABLE_RETENTION.total_seconds()):
+                        InvalidationEvent.objects.filter(
+                            created_at__lt=now - TABLE_RETENTION).delete()
+                        last_cleanup = time.monotonic()
+                except DatabaseError:
+                    logger.exception("Invalidation listener failed to poll")
+                    connections.close_all()
+                    continue
+                for event in events:
+                    if event.id not in seen:
+                        seen[event.id] = event.created_at
+                        deliver(event.payload)
+                seen = {event_id: created_at
+                        for event_id, created_at in seen.items()
+                        if created_at >= window}
+                since = now
+        finally:
+            connections.close_all()
+
+
+TRANSPORTS = {'postgres': PostgresTransport, 'table': TableTransport}
+
+
+class Listener:
+    """A daemon thread that receives invalidation messages."""
+
+    def __init__(self, transport, interval):
+        """Start listening on ``transport``."""
+        self.stop_event = threading.Event()
+        # Set once messages published from now on will be received.
+        self.ready = threading.Event()
+        self.pid = os.getpid()
+        self.thread = threading.Thread(
+            target=transport.listen,
+            args=(self.stop_event, self.ready, interval),
+            name='polls-invalidation', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop the thread and wait for it to finish."""
+        self.stop_event.set()
+        self.thread.join()
+
+
+def start_listener():
+    """
+    Start this process's listener unless it runs already or the bus is off.
+
+    Returns:
+        Listener: The running listener, or None.
+    """
+    global _listener
+    if _listener is not None and _listener.pid == os.getpid():
+        return _listener
+    transport = get_transport()
+    if transport is None:
+        return None
+    _listener = Listener(transport, settings.POLLS_INVALIDATION_POLL_INTERVAL)
+    return _listener
+
+
+def stop_listener():
+    """Stop this process's listener, if it runs."""
+    global _listener
+    if _listener is not None and _listener.pid == os.getpid():
+        _listener.stop()
+    _listener = None
+
+
+class InvalidationMiddleware:
+    """Start the invalidation listener when a worker loads the app."""
+
+    def __init__(self, get_response):
+        """Start the listener of this worker process."""
+        self.get_response = get_response
+        start_listener()
+
+    def __call__(self, request):
+        """Pass the request through."""
+        return self.get_response(request)
+
+
+@receiver(post_save, sender=Question)
+@receiver(post_delete, sender=Question)
+def publish_question(sender, instance, **kwargs):
+    """Publish changes to questions."""
+    publish(instance.pk)
+
+
+@receiver(post_save, sender=Choice)
+@receiver(post_delete, sender=Choice)
+def publish_choice(sender, instance, **kwargs):
+    """Publish changes to the choices of a question."""
+    publish(instance.question_id)
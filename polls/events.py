@@ -0,0 +1,179 @@
+"""
+The append-only history of votes.
+
+Every code path that creates, moves or deletes a ``Vote`` records a
+``VoteEvent`` in the same transaction, so the events always agree with
+the votes.  From them:
+
+- ``replay`` rebuilds the ``Vote`` rows and ``Choice.vote_count`` of one
+  poll or of all polls.  Each poll starts from its ``VoteCheckpoint``
+  rows, and its remaining events are streamed in chunks.
+- ``compact_events`` folds events older than a cutoff into the
+  checkpoints and deletes them, so a replay never scans the whole
+  history.
+
+Votes that existed before the event log were recorded as checkpoints by
+the migration that created it.  Anonymous votes have no user and are not
+part of the history; replaying leaves them alone.
+"""
+import operator
+from functools import reduce
+
+from django.db import transaction
+from django.db.models import Max, Q
+from django.utils import timezone
+
+from polls import bus
+from polls.models import Question, Vote, VoteCheckpoint, VoteEvent
+from polls.reconcile import repair_drift
+from polls.utils import upsert
+
+CHUNK_SIZE = 5000
+
+
+def record_event(kind, user_id, question_id, choice_id, created_at=None):
+    """Append one event; call inside the transaction that changes the vote."""
+    return VoteEvent.objects.create(
+        kind=kind, user_id=user_id, question_id=question_id,
+        choice_id=choice_id, created_at=created_at or timezone.now())
+
+
+def replayed_votes(question_id, chunk_size=CHUNK_SIZE):
+    """
+    Return the votes of a poll according to its checkpoints and events.
+
+    Returns:
+        dict: The chosen choice id, keyed by user id.
+    """
+    state = dict(VoteCheckpoint.objects.filter(question_id=question_id)
+                 .values_list('user_id', 'choice_id'))
+    events = VoteEvent.objects.filter(question_id=question_id).order_by(
+        'id').values_list('kind', 'user_id', 'choice_id')
+    for kind, user_id, choice_id in events.iterator(chunk_size=chunk_size):
+        if kind == VoteEvent.Kind.RETRACTED:
+            state.pop(user_id, None)
+        else:
+            state[user_id] = choice_id
+    return state
+
+
+def replay_question(question_id, dry_run=False, chunk_size=CHUNK_SIZE):
+    """
+    Make the votes of a poll match its history.
+
+    Votes that already match keep their row and id; others are moved,
+    created or deleted, and the vote counts are recomputed.
+
+    Returns:
+        dict: The number of votes ``created``, ``changed`` and ``deleted``,
+              and the number of choices whose count was ``repaired``.
+    """
+    with transaction.atomic():
+        state = replayed_votes(question_id, chunk_size)
+        votes = Vote.objects.filter(choice__question_id=question_id,
+                                    user__isnull=False).only(
+            'id', 'user_id', 'choice_id').order_by('id')
+        changed = []
+        deleted = []
+        for vote in votes.iterator(chunk_size=chunk_size):
+            choice_id = state.pop(vote.user_id, None)
+            if choice_id is None:
+                # Not in the history, or a duplicate vote of the same user.
+                deleted.append(vote.id)
+            elif choice_id != vote.choice_id:
+                vote.choice_id = choice_id
+                changed.append(vote)
+        created = [Vote(user_id=user_id, choice_id=choice_id)
+                   for user_id, choice_id in state.items()]
+        result = {'created': len(created), 'changed': len(changed),
+                  'deleted': len(deleted), 'repaired': 0}
+        if dry_run:
+            return result
+        for start in range(0, len(deleted), chunk_size):
+            Vote.objects.filter(id__in=deleted[start:start + chunk_size]).delete()
+        Vote.objects.bulk_update(changed, ['choice'], batch_size=chunk_size)
+        Vote.objects.bulk_create(created, batch_size=chunk_size)
+        result['repaired'] = repair_drift(question_ids=[question_id])
+        if any(result.values()):
+            bus.publish(question_id)
+    return result
+
+
+def replay(question_ids=None, dry_run=False, chunk_size=CHUNK_SIZE):
+    """
+    Rebuild the votes of the given polls, or of every poll, from history.
+
+    Each poll is replayed in its own transaction.
+
+    Returns:
+        dict: The totals of ``replay_question`` over all polls, and the
+              number of ``questions`` replayed.
+    """
+    if question_ids is None:
+        question_ids = Question.objects.order_by('id').values_list('id',
+                                                                   flat=True)
+    totals = {'questions': 0, 'created': 0, 'changed': 0, 'deleted': 0,
+              'repaired': 0}
+    for question_id in list(question_ids):
+        result = replay_question(question_id, dry_run, chunk_size)
+        totals['questions'] += 1
+        for key, value in result.items():
+            totals[key] += value
+    return totals
+
+
+def compact_events(before, chunk_size=CHUNK_SIZE):
+    """
+    Fold the events older than ``before`` into checkpoints.
+
+    The newest old event of every (question, user) pair replaces that
+    pair's checkpoint, or deletes it if the vote was retracted.  Then the
+    events up to the folded one of every pair are deleted; an event that
+    commits while the fold runs is kept for the next compaction.
+
+    Returns:
+        int: The number of events compacted.
+    """
+    compacted = 0
+    with transaction.atomic():
+        cutoff = VoteEvent.objects.filter(created_at__lt=before).aggregate(
+            last=Max('id'))['last']
+        if cutoff is None:
+            return 0
+        newest = VoteEvent.objects.filter(id__lte=cutoff).values(
+            'question_id', 'user_id').annotate(last=Max('id')).values('last')
+        events = VoteEvent.objects.filter(id__in=newest).order_by('id').values_list(
+            'id', 'kind', 'question_id', 'user_id', 'choice_id', 'created_at')
+
+        folded = []
+        checkpoints = []
+        retracted = []
+        for pk, kind, question_id, user_id, choice_id, created_at in events.iterator(
+                chunk_size=chunk_size):
+            folded.append(Q(question_id=question_id, user_id=user_id, id__lte=pk))
+            if kind == VoteEvent.Kind.RETRACTED:
+                retracted.append((question_id, user_id))
+            else:
+                checkpoints.append(VoteCheckpoint(
+                    question_id=question_id, user_id=user_id,
+                    choice_id=choice_id, as_of=created_at))
+            if len(folded) >= chunk_size:
+                compacted += _save_chunk(folded, checkpoints, retracted)
+                folded, checkpoints, retracted = [], [], []
+        compacted += _save_chunk(folded, checkpoints, retracted)
+    return compacted
+
+
+def _save_chunk(folded, checkpoints, retracted):
+    """Write the checkpoints of a chunk and delete the events it folded."""
+    upsert(VoteCheckpoint, checkpoints, unique_fields=['question', 'user'],
+           update_fields=['choice', 'as_of'])
+    by_question = {}
+    for question_id, user_id in retracted:
+        by_question.setdefault(question_id, []).append(user_id)
+    for question_id, user_ids in by_question.items():
+        VoteCheckpoint.objects.filter(question_id=question_id,
+                                      user_id__in=user_ids).delete()
+    if not folded:
+        return 0
+    return VoteEvent.objects.filter(reduce(operator.or_, folded)).delete()[0]
@@ -0,0 +1,118 @@
+"""
+Freezing the results of closed polls.
+
+Once a poll's end_date has passed its results can no longer change, so
+``finalize_question`` counts them one last time into ``FinalResult`` rows
+and stamps ``Question.finalized_at``.  The results and index pages read
+those rows instead of counting the votes again.
+
+The ``finalize_polls`` management command finalizes every poll that has
+closed since its last run and is meant to be run from cron.  A closed
+poll that has not been finalized yet is finalized the first time its
+results are viewed.
+
+Votes still waiting in the ingestion queue are applied before the
+results are counted, and the count reads the votes and ballots rather
+than the cached tally, so the frozen results miss nothing.
+
+Moving a finalized poll's end_date back into the future, or clearing it,
+reopens the poll and deletes its frozen results.
+"""
+from django.db import transaction
+from django.db.models import Count
+from django.db.models.signals import pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from polls.ingest import apply_batch
+from polls.models import FinalResult, Question
+from polls.tally import count_tally
+
+# Queued votes applied per transaction while draining a poll's queue.
+DRAIN_BATCH_SIZE = 1000
+
+
+def closed_questions(now=None):
+    """Return the closed questions whose results are not frozen yet."""
+    return Question.objects.filter(end_date__lt=now or timezone.now(),
+                                   finalized_at__isnull=True)
+
+
+def count_results(question):
+    """
+    Count the results of a poll.
+
+    Returns:
+        list: Unsaved ``FinalResult`` rows, one per choice.
+    """
+    if question.poll_type == Question.PollType.RANKED:
+        tally = count_tally(question)
+        return [
+            FinalResult(question=question, choice=row['choice'],
+                        choice_text=row['choice'].choice_text,
+                        votes=[c for c in row['counts'] if c is not None][-1],
+                        rounds=row['counts'],
+                        winner=row['choice'] == tally['winner'])
+            for row in tally['rows']
+        ]
+
+    if question.poll_type == Question.PollType.APPROVAL:
+        counts = [(row['choice'], row['count'])
+                  for row in count_tally(question)['rows']]
+    else:
+        counts = [(choice, choice.num_votes) for choice in
+                  question.choice_set.annotate(num_votes=Count('vote'))
+                  .order_by('id')]
+    top = max((votes for choice, votes in counts), default=0)
+    return [FinalResult(question=question, choice=choice,
+                        choice_text=choice.choice_text, votes=votes,
+                        winner=0 < top == votes)
+            for choice, votes in counts]
+
+
+def finalize_question(question, now=None):
+    """
+    Freeze the results of a closed poll.
+
+    The votes still queued in the poll are applied first.  The poll is
+    then claimed with a conditional UPDATE of ``finalized_at``, so when
+    the command and a results page race, only one of them writes the
+    results.
+
+    Returns:
+        bool: True if this call froze the results, False if the poll was
+              already finalized.
+    """
+    now = now or timezone.now()
+    while apply_batch(DRAIN_BATCH_SIZE, question_id=question.pk):
+        pass
+    with transaction.atomic():
+        claimed = Question.objects.filter(
+            pk=question.pk, finalized_at__isnull=True).update(finalized_at=now)
+        if not claimed:
+            return False
+        FinalResult.objects.bulk_create(count_results(question))
+    question.finalized_at = now
+    return True
+
+
+def finalize_closed(now=None):
+    """
+    Freeze the results of every poll that closed and is not finalized.
+
+    Returns:
+        int: The number of polls finalized.
+    """
+    now = now or timezone.now()
+    finalized = 0
+    for question in list(closed_questions(now)):
+        finalized += finalize_question(question, now)
+    return finalized
+
+
+@receiver(pre_save, sender=Question)
+def reopen_question(sender, instance, **kwargs):
+    """Delete the frozen results of a finalized poll that was reopened."""
+    if instance.finalized_at is not None and not instance.is_closed():
+        FinalResult.objects.filter(question_id=instance.pk).delete()
+        instance.finalized_at = None
@@ -0,0 +1,157 @@
+"""
+Batched ingestion of queued votes.
+
+With ``POLLS_VOTE_QUEUE`` on, ``vote()`` validates the vote, appends a
+``PendingVote`` row and returns.  The ``ingest_votes`` worker then calls
+``apply_batch`` in a loop.  Each batch:
+
+- drops the votes queued in polls that were finalized, or after their
+  end_date, counting them as ``vote_queue_rejected``;
+- keeps only the newest queued vote of every (user, question) pair, so
+  the last write wins;
+- moves existing ``Vote`` rows with one bulk UPDATE and inserts the new
+  ones with one bulk INSERT;
+- adjusts ``Choice.vote_count`` by the net change of every affected
+  choice in a single ``UPDATE ... CASE``;
+- records a ``VoteEvent`` for every vote cast or changed;
+- deletes the consumed queue rows in the same transaction.
+
+Run one worker per database: batches are applied in queue order, which is
+what makes the last write win across batches.
+
+Until the worker gets to it, ``pending_choices`` lets the pages that show
+a user's own vote show the queued one instead.
+"""
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+
+from polls import bus, metrics
+from polls.models import Choice, PendingVote, Question, Vote, VoteEvent
+from polls.reconcile import mark_dirty
+
+
+def enqueue_vote(user, question, choice):
+    """Append a vote to the queue."""
+    pending = PendingVote.objects.create(user=user, question=question,
+                                         choice=choice)
+    metrics.incr('vote_queue_enqueued')
+    return pending
+
+
+def pending_choices(user, question_ids):
+    """
+    Return the user's queued votes that have not been applied yet.
+
+    Returns:
+        dict: ``(choice_id, choice_text)`` of the newest queued vote,
+              keyed by question id.
+    """
+    return {question_id: (choice_id, choice_text)
+            for question_id, choice_id, choice_text in PendingVote.objects.filter(
+                user=user, question_id__in=question_ids,
+            ).order_by('id').values_list('question_id', 'choice_id',
+                                         'choice__choice_text')}
+
+
+def accepts_vote(question, queued_at):
+    """Return True if a vote queued at ``queued_at`` still counts in a poll."""
+    if question.finalized_at is not None:
+        return False
+    return question.end_date is None or queued_at < question.end_date
+
+
+def apply_batch(batch_size, question_id=None):
+    """
+    Apply the oldest ``batch_size`` queued votes.
+
+    Args:
+        batch_size (int): The number of queue rows to consume at most.
+        question_id (int): Only apply the votes queued in this poll.
+
+    Returns:
+        int: The number of queue rows consumed, 0 once the queue is empty.
+    """
+    queue = PendingVote.objects.select_for_update().order_by('id')
+    if question_id is not None:
+        queue = queue.filter(question_id=question_id)
+    with transaction.atomic():
+        batch = list(queue.values('id', 'user_id', 'question_id', 'choice_id',
+                                  'queued_at')[:batch_size])
+        if not batch:
+            return 0
+        # Locking the polls keeps finalize_question from counting them
+        # while their votes are applied.
+        polls = Question.objects.select_for_update().in_bulk(
+            {row['question_id'] for row in batch})
+        accepted = [row for row in batch if accepts_vote(
+            polls[row['question_id']], row['queued_at'])]
+        latest = {(row['user_id'], row['question_id']): row
+                  for row in accepted}
+
+        existing = (
+            Vote.objects
+            .filter(user_id__in={user_id for user_id, _ in latest},
+                    choice__question_id__in={question_id
+                                             for _, question_id in latest})
+            .annotate(question_id=F('choice__question_id'))
+            .only('id', 'user_id', 'choice_id')
+        )
+        votes = {(vote.user_id, vote.question_id): vote for vote in existing}
+
+        deltas = Counter()
+        changed = []
+        created = []
+        events = []
+        for (user_id, question_id), row in latest.items():
+            choice_id = row['choice_id']
+            vote = votes.get((user_id, question_id))
+            if vote is None:
+                created.append(Vote(user_id=user_id, choice_id=choice_id))
+                kind = VoteEvent.Kind.CAST
+            elif vote.choice_id != choice_id:
+                deltas[vote.choice_id] -= 1
+                vote.choice_id = choice_id
+                changed.append(vote)
+                kind = VoteEvent.Kind.CHANGED
+            else:
+                continue
+            deltas[choice_id] += 1
+            events.append(VoteEvent(kind=kind, user_id=user_id,
+                                    question_id=question_id,
+                                    choice_id=choice_id,
+                                    created_at=row['queued_at']))
+
+        Vote.objects.bulk_update(changed, ['choice'])
+        Vote.objects.bulk_create(created)
+        VoteEvent.objects.bulk_create(events)
+        deltas = {choice_id: delta for choice_id, delta in deltas.items()
+                  if delta}
+        if deltas:
+            Choice.objects.filter(id__in=deltas).update(
+                vote_count=F('vote_count') + Case(
+                    *[When(id=choice_id, then=Value(delta))
+                      for choice_id, delta in deltas.items()],
+                    default=Value(0)))
+            question_ids = {question_id for _, question_id in latest}
+            mark_dirty(*question_ids)
+            for question_id in question_ids:
+                bus.publish(question_id)
+        PendingVote.objects.filter(id__in=[row['id'] for row in batch]).delete()
+
+    metrics.incr('vote_queue_applied', len(latest))
+    metrics.incr('vote_queue_superseded', len(accepted) - len(latest))
+    metrics.incr('vote_queue_rejected', len(batch) - len(accepted))
+    lag = timezone.now() - min(row['queued_at'] for row in batch)
+    metrics.set_gauge('vote_queue_apply_lag_seconds',
+                      round(lag.total_seconds(), 3))
+    return len(batch)
+
+
+def update_queue_depth():
+    """Record the number of queued votes and return it."""
+    depth = PendingVote.objects.count()
+    metrics.set_gauge('vote_queue_depth', depth)
+    return depth
@@ -0,0 +1,29 @@
+"""Management command that compacts old vote events into checkpoints."""
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from polls.events import compact_events
+
+
+class Command(BaseCommand):
+    """Fold old vote events into checkpoints."""
+
+    help = ("Fold vote events older than --days into one checkpoint per "
+            "user and poll, and delete them.")
+
+    def add_arguments(self, parser):
+        """Add the command line options."""
+        parser.add_argument('--days', type=float, default=30,
+                            help="Keep the events of the last DAYS days.")
+
+    def handle(self, *args, **options):
+        """Compact the events and report how many there were."""
+        if options['days'] < 0:
+            raise CommandError("--days cannot be negative.")
+        before = timezone.now() - datetime.timedelta(days=options['days'])
+        compacted = compact_events(before)
+        self.stdout.write(self.style.SUCCESS(
+            f"Compacted {compacted} event(s) older than "
+            f"{before:%Y-%m-%d %H:%M}."))
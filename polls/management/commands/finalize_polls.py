@@ -0,0 +1,34 @@
+"""Management command that freezes the results of closed polls."""
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from polls.finalize import closed_questions, finalize_closed
+
+
+class Command(BaseCommand):
+    """Finalize every poll whose end_date has passed."""
+
+    help = ("Count the results of every poll that has closed since the last "
+            "run into frozen FinalResult rows. Meant to be run from cron, "
+            "e.g. every five minutes.")
+
+    def add_arguments(self, parser):
+        """Add the command line options."""
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help="List the polls that would be finalized.")
+
+    def handle(self, *args, **options):
+        """Finalize the closed polls and report how many there were."""
+        now = timezone.now()
+        if options['dry_run']:
+            questions = closed_questions(now).order_by('end_date')
+            for question in questions:
+                self.stdout.write(f"Question {question.id} closed "
+                                  f"{question.end_date:%Y-%m-%d %H:%M}: "
+                                  f"{question.question_text}")
+            self.stdout.write(f"{len(questions)} poll(s) to finalize.")
+            return
+
+        finalized = finalize_closed(now)
+        self.stdout.write(self.style.SUCCESS(f"Finalized {finalized} poll(s)."))
@@ -0,0 +1,202 @@
+"""Management command that generates synthetic data for load testing."""
+import datetime
+import random
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from polls.models import Choice, Question, Vote, VoteEvent
+from polls.reconcile import repair_drift
+from polls.search import index_questions
+from polls.utils import batched
+
+
+def zipf_weights(count, skew, rng):
+    """
+    Return ``count`` Zipf-like weights in random order.
+
+    The item at rank ``r`` gets weight ``1 / r ** skew``, so a skew of 0
+    gives equal weights and larger skews concentrate more weight on the
+    first few items.
+    """
+    weights = [1 / rank ** skew for rank in range(1, count + 1)]
+    rng.shuffle(weights)
+    return weights
+
+
+class Command(BaseCommand):
+    """Generate users, polls and votes at production scale."""
+
+    help = ("Generate synthetic users, polls and votes with bulk inserts. "
+            "Every user votes at most once per poll; the same seed always "
+            "produces the same data.")
+
+    def add_arguments(self, parser):
+        """Add the command line options."""
+        parser.add_argument('--users', type=int, default=10000)
+        parser.add_argument('--polls', type=int, default=1000)
+        parser.add_argument('--votes', type=int, default=100000,
+                            help="Approximate total number of votes.")
+        parser.add_argument('--min-choices', type=int, default=2)
+        parser.add_argument('--max-choices', type=int, default=6)
+        parser.add_argument(
+            '--hot-skew', type=float, default=1.0,
+            help="Zipf exponent of poll popularity; 0 spreads votes evenly.")
+        parser.add_argument(
+            '--choice-skew', type=float, default=1.0,
+            help="Zipf exponent of choice popularity within a poll.")
+        parser.add_argument(
+            '--closed-fraction', type=float, default=0.3,
+            help="Fraction of polls whose end_date has passed.")
+        parser.add_argument(
+            '--future-fraction', type=float, default=0.05,
+            help="Fraction of polls not published yet; they get no votes.")
+        parser.add_argument(
+            '--open-ended-fraction', type=float, default=0.3,
+            help="Fraction of polls without an end_date.")
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--prefix', default='loadtest',
+                            help="Prefix of the generated usernames.")
+        parser.add_argument('--password', default='loadtest')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        """Generate the data and report how long each step took."""
+        if User.objects.filter(username__startswith=options['prefix']).exists():
+            raise CommandError(f"Users named {options['prefix']}* already "
+                               f"exist; use another --prefix.")
+        if options['min_choices'] < 1 or options['max_choices'] < options['min_choices']:
+            raise CommandError("Need 1 <= --min-choices <= --max-choices.")
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+
+        user_ids = self.step("users", self.create_users, options)
+        question_ids, open_ids = self.step("polls", self.create_polls, options)
+        choice_ids = self.step("choices", self.create_choices,
+                               question_ids, options)
+        votes = self.step("votes", self.create_votes, open_ids, choice_ids,
+                          user_ids, options)
+        self.step("vote counts", repair_drift)
+        self.step("search index", self.index, question_ids)
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated {len(user_ids)} users, {len(question_ids)} polls "
+            f"and {votes} votes."))
+
+    def step(self, label, function, *args):
+        """Run one generation step and report its duration."""
+        start = time.perf_counter()
+        result = function(*args)
+        self.stdout.write(f"{label}: {time.perf_counter() - start:.2f}s")
+        return result
+
+    def create_users(self, options):
+        """
+        Create the users and return their ids.
+
+        Every user shares one password hash: hashing is deliberately slow,
+        and doing it once per user would dominate the run.
+        """
+        password = make_password(options['password'])
+        prefix = options['prefix']
+        users = (User(username=f'{prefix}{n}', password=password)
+                 for n in range(options['users']))
+        user_ids = []
+        for batch in batched(users, self.batch_size):
+            user_ids += [user.id for user in User.objects.bulk_create(batch)]
+        return user_ids
+
+    def poll_dates(self, options, now):
+        """Pick the pub_date and end_date of a poll."""
+        day = datetime.timedelta(days=1)
+        kind = self.rng.random()
+        if kind < options['future_fraction']:
+            return now + self.rng.uniform(1, 30) * day, None
+        kind -= options['future_fraction']
+        if kind < options['closed_fraction']:
+            pub_date = now - self.rng.uniform(30, 365) * day
+            return pub_date, now - self.rng.uniform(1, 29) * day
+        pub_date = now - self.rng.uniform(0, 30) * day
+        if self.rng.random() < options['open_ended_fraction']:
+            return pub_date, None
+        return pub_date, now + self.rng.uniform(1, 30) * day
+
+    def create_polls(self, options):
+        """
+        Create the polls.
+
+        Returns:
+            tuple: The ids of all polls and of the published ones.
+        """
+        now = timezone.now()
+        question_ids = []
+        published_ids = []
+        questions = (Question(question_text=f'Load test poll {n}',
+                              pub_date=pub_date, end_date=end_date)
+                     for n, (pub_date, end_date) in enumerate(
+                         self.poll_dates(options, now)
+                         for _ in range(options['polls'])))
+        for batch in batched(questions, self.batch_size):
+            for question in Question.objects.bulk_create(batch):
+                question_ids.append(question.id)
+                if question.pub_date <= now:
+                    published_ids.append(question.id)
+        return question_ids, published_ids
+
+    def create_choices(self, question_ids, options):
+        """Create the choices and return their ids grouped by poll."""
+        choices = (Choice(question_id=question_id, choice_text=f'Option {n}')
+                   for question_id in question_ids
+                   for n in range(self.rng.randint(options['min_choices'],
+                                                   options['max_choices'])))
+        choice_ids = {}
+        for batch in batched(choices, self.batch_size):
+            for choice in Choice.objects.bulk_create(batch):
+                choice_ids.setdefault(choice.question_id, []).append(choice.id)
+        return choice_ids
+
+    def create_votes(self, question_ids, choice_ids, user_ids, options):
+        """
+        Create the votes, with their events, and return how many were made.
+
+        Each poll gets a share of the votes proportional to its popularity
+        and picks that many distinct voters, so nobody votes twice in one
+        poll.
+        """
+        if not question_ids or not user_ids:
+            return 0
+        weights = zipf_weights(len(question_ids), options['hot_skew'], self.rng)
+        total_weight = sum(weights)
+
+        def votes():
+            for question_id, weight in zip(question_ids, weights):
+                voters = min(len(user_ids),
+                             round(options['votes'] * weight / total_weight))
+                choices = choice_ids[question_id]
+                picks = self.rng.choices(
+                    choices, zipf_weights(len(choices), options['choice_skew'],
+                                          self.rng), k=voters)
+                for user_id, choice_id in zip(
+                        self.rng.sample(user_ids, voters), picks):
+                    yield Vote(user_id=user_id, choice_id=choice_id)
+
+        question_of = {choice_id: question_id
+                       for question_id, choices in choice_ids.items()
+                       for choice_id in choices}
+        count = 0
+        for batch in batched(votes(), self.batch_size):
+            Vote.objects.bulk_create(batch)
+            VoteEvent.objects.bulk_create(
+                VoteEvent(kind=VoteEvent.Kind.CAST, user_id=vote.user_id,
+                          question_id=question_of[vote.choice_id],
+                          choice_id=vote.choice_id)
+                for vote in batch)
+            count += len(batch)
+        return count
+
+    def index(self, question_ids):
+        """Add the generated polls to the search index."""
+        for batch in batched(question_ids, self.batch_size):
+            index_questions(batch)
@@ -0,0 +1,44 @@
+"""Management command that applies the queued votes."""
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from polls.ingest import apply_batch, update_queue_depth
+
+
+class Command(BaseCommand):
+    """Drain the vote ingestion queue in batches."""
+
+    help = ("Apply votes queued by vote() when POLLS_VOTE_QUEUE is on. Runs "
+            "until interrupted; run exactly one worker per database.")
+
+    def add_arguments(self, parser):
+        """Add the command line options."""
+        parser.add_argument(
+            '--batch-size', type=int,
+            default=settings.POLLS_VOTE_QUEUE_BATCH_SIZE,
+            help="Queued votes applied per transaction.")
+        parser.add_argument(
+            '--interval', type=float, default=0.5,
+            help="Seconds to wait when the queue is empty.")
+        parser.add_argument(
+            '--once', action='store_true',
+            help="Exit once the queue is empty.")
+
+    def handle(self, *args, **options):
+        """Apply batches until the queue is empty or the worker is stopped."""
+        applied = 0
+        try:
+            while True:
+                consumed = apply_batch(options['batch_size'])
+                applied += consumed
+                update_queue_depth()
+                if not consumed:
+                    if options['once']:
+                        break
+                    time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(
+            f"Applied {applied} queued vote(s)."))
@@ -0,0 +1,41 @@
+"""Management command that repairs drifted ``Choice.vote_count`` values."""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from polls.reconcile import clear_dirty, find_drift, repair_drift
+
+
+class Command(BaseCommand):
+    """Make every ``vote_count`` equal to the number of its ``Vote`` rows."""
+
+    help = ("Find choices whose vote_count disagrees with their Vote rows "
+            "and fix them with a single set-based UPDATE.")
+
+    def add_arguments(self, parser):
+        """Add the command line options."""
+        parser.add_argument(
+            '--dirty-only', action='store_true',
+            help="Only check questions voted on since the last run.")
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help="Report the discrepancies without fixing them.")
+
+    def handle(self, *args, **options):
+        """Report and repair the drifted choices."""
+        dirty_before = timezone.now() if options['dirty_only'] else None
+
+        if options['dry_run']:
+            drift = find_drift(dirty_before=dirty_before)
+            for question_id, choice_id, vote_count, votes in drift:
+                self.stdout.write(
+                    f"Question {question_id} choice {choice_id}: "
+                    f"vote_count={vote_count} votes={votes}")
+            self.stdout.write(f"{len(drift)} choice(s) out of sync.")
+            return
+
+        with transaction.atomic():
+            fixed = repair_drift(dirty_before=dirty_before)
+            if dirty_before is not None:
+                clear_dirty(dirty_before)
+        self.stdout.write(self.style.SUCCESS(f"Fixed {fixed} choice(s)."))
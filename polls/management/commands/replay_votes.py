@@ -0,0 +1,33 @@
+"""Management command that rebuilds votes from the vote event log."""
+from django.core.management.base import BaseCommand
+
+from polls.events import CHUNK_SIZE, replay
+
+
+class Command(BaseCommand):
+    """Make the votes and vote counts match the vote history."""
+
+    help = ("Rebuild Vote rows and Choice.vote_count from the vote "
+            "checkpoints and events, for the given polls or for all polls.")
+
+    def add_arguments(self, parser):
+        """Add the command line options."""
+        parser.add_argument('question_ids', nargs='*', type=int,
+                            help="The polls to replay; all polls by default.")
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help="Report what would change without changing it.")
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                            help="Events read per database round trip.")
+
+    def handle(self, *args, **options):
+        """Replay the polls and report what changed."""
+        totals = replay(options['question_ids'] or None,
+                        dry_run=options['dry_run'],
+                        chunk_size=options['chunk_size'])
+        verb = "Would replay" if options['dry_run'] else "Replayed"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {totals['questions']} poll(s): {totals['created']} "
+            f"vote(s) created, {totals['changed']} changed, "
+            f"{totals['deleted']} deleted, {totals['repaired']} count(s) "
+            f"repaired."))
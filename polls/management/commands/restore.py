@@ -0,0 +1,45 @@
+"""Management command that loads a snapshot written by ``snapshot``."""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from polls.snapshot import restore_snapshot
+
+
+class Command(BaseCommand):
+    """Replace the polls and auth tables with the contents of a snapshot."""
+
+    help = ("Replace the polls and auth tables with a snapshot, reset the "
+            "sequences and check that vote counts match the votes.")
+
+    def add_arguments(self, parser):
+        """Add the command line arguments."""
+        parser.add_argument('path', help="The snapshot file to load.")
+        parser.add_argument(
+            '--repair-counts', action='store_true',
+            help="Fix vote counts that disagree with the votes instead of "
+                 "aborting the restore.")
+
+    def handle(self, *args, **options):
+        """Load the snapshot and report the row counts."""
+        start = time.perf_counter()
+        try:
+            manifest = restore_snapshot(options['path'],
+                                        repair_counts=options['repair_counts'])
+        except (OSError, KeyError, ValueError) as error:
+            raise CommandError(f"Restore failed: {error}") from error
+        for table in manifest['tables'] + manifest['permissions']:
+            self.stdout.write(f"{table['model']}: {table['rows']} row(s)")
+        if not manifest['permissions']:
+            self.stdout.write(self.style.WARNING(
+                "The snapshot has no permissions: no user or group has any "
+                "permission now."))
+        if manifest['missing_permissions']:
+            self.stdout.write(self.style.WARNING(
+                f"Skipped {manifest['missing_permissions']} permission(s) "
+                f"this database does not have."))
+        if manifest['repaired']:
+            self.stdout.write(self.style.WARNING(
+                f"Repaired the vote count of {manifest['repaired']} choice(s)."))
+        self.stdout.write(self.style.SUCCESS(
+            f"Restored {options['path']} in {time.perf_counter() - start:.2f}s."))
@@ -0,0 +1,32 @@
+"""
+Application metrics for the polls app.
+
+Counters and gauges are kept in the configured cache so that every worker
+process contributes to the same values.  Counters use the cache's atomic
+``incr`` so concurrent updates are not lost.
+"""
+from django.core.cache import cache
+
+PREFIX = 'polls:metrics:'
+
+
+def incr(name, amount=1):
+    """Add ``amount`` to the counter ``name``."""
+    key = PREFIX + name
+    if cache.add(key, amount, timeout=None):
+        return
+    try:
+        cache.incr(key, amount)
+    except ValueError:
+        # The key was evicted between add() and incr().
+        cache.add(key, amount, timeout=None)
+
+
+def set_gauge(name, value):
+    """Set the gauge ``name`` to ``value``."""
+    cache.set(PREFIX + name, value, timeout=None)
+
+
+def get(name, default=0):
+    """Return the current value of a counter or gauge."""
+    return cache.get(PREFIX + name, default)
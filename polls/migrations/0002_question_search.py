@@ -0,0 +1,82 @@
+# Generated by Django 5.1.15 on 2026-10-19 09:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+DOCUMENT_TABLE = 'polls_questionsearchdocument'
+FTS_TABLE = 'polls_questionsearch_fts'
+
+POSTGRES_INDEX_SQL = [
+    f"ALTER TABLE {DOCUMENT_TABLE} ADD COLUMN search_vector tsvector "
+    f"GENERATED ALWAYS AS (to_tsvector('english', document)) STORED",
+    f"CREATE INDEX polls_question_search_gin ON {DOCUMENT_TABLE} "
+    f"USING GIN (search_vector)",
+]
+
+SQLITE_INDEX_SQL = [
+    f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+    f"document, content='{DOCUMENT_TABLE}', content_rowid='question_id', "
+    f"tokenize='porter unicode61')",
+    f"CREATE TRIGGER {FTS_TABLE}_ai AFTER INSERT ON {DOCUMENT_TABLE} BEGIN "
+    f"INSERT INTO {FTS_TABLE}(rowid, document) "
+    f"VALUES (new.question_id, new.document); END",
+    f"CREATE TRIGGER {FTS_TABLE}_ad AFTER DELETE ON {DOCUMENT_TABLE} BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, document) "
+    f"VALUES ('delete', old.question_id, old.document); END",
+    f"CREATE TRIGGER {FTS_TABLE}_au AFTER UPDATE ON {DOCUMENT_TABLE} BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, document) "
+    f"VALUES ('delete', old.question_id, old.document); "
+    f"INSERT INTO {FTS_TABLE}(rowid, document) "
+    f"VALUES (new.question_id, new.document); END",
+]
+
+
+def create_search_index(apps, schema_editor):
+    """Create the full-text index and index the existing questions."""
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        statements = POSTGRES_INDEX_SQL
+    elif vendor == 'sqlite':
+        statements = SQLITE_INDEX_SQL
+    else:
+        statements = []
+    for statement in statements:
+        schema_editor.execute(statement)
+
+    Question = apps.get_model('polls', 'Question')
+    Choice = apps.get_model('polls', 'Choice')
+    QuestionSearchDocument = apps.get_model('polls', 'QuestionSearchDocument')
+    documents = {pk: [text] for pk, text in
+                 Question.objects.values_list('pk', 'question_text')}
+    for question_id, text in Choice.objects.order_by('id').values_list(
+            'question_id', 'choice_text'):
+        documents[question_id].append(text)
+    QuestionSearchDocument.objects.bulk_create(
+        [QuestionSearchDocument(question_id=pk, document='\n'.join(parts))
+         for pk, parts in documents.items()],
+        batch_size=1000,
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    """Drop the SQLite FTS5 table; PostgreSQL drops with the table."""
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuestionSearchDocument',
+            fields=[
+                ('question', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to='polls.question')),
+                ('document', models.TextField(blank=True, default='')),
+            ],
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
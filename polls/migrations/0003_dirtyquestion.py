@@ -0,0 +1,22 @@
+# Generated by Django 5.1.15 on 2026-10-19 09:19
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0002_question_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DirtyQuestion',
+            fields=[
+                ('question', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='polls.question')),
+                ('marked_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
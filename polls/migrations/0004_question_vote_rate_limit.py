@@ -0,0 +1,18 @@
+# Generated by Django 5.1.15 on 2026-10-19 09:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0003_dirtyquestion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='vote_rate_limit',
+            field=models.PositiveIntegerField(blank=True, help_text='Votes a user may submit per period. Leave blank to use the site default.', null=True),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.15 on 2026-10-19 09:22
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0004_question_vote_rate_limit'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='vote',
+            index=models.Index(fields=['user', 'id'], name='polls_vote_user_id_idx'),
+        ),
+    ]
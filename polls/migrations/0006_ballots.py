@@ -0,0 +1,52 @@
+# Generated by Django 5.1.15 on 2026-10-19 09:32
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0005_vote_user_id_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='poll_type',
+            field=models.CharField(choices=[('plurality', 'Single choice'), ('approval', 'Approval (pick any number)'), ('ranked', 'Ranked choice (instant runoff)')], default='plurality', max_length=10),
+        ),
+        migrations.CreateModel(
+            name='Ballot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cast_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='polls.question')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='BallotChoice',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('ballot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='selections', to='polls.ballot')),
+                ('choice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='polls.choice')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='ballot',
+            constraint=models.UniqueConstraint(fields=('question', 'user'), name='polls_ballot_one_per_user'),
+        ),
+        migrations.AddConstraint(
+            model_name='ballotchoice',
+            constraint=models.UniqueConstraint(fields=('ballot', 'rank'), name='polls_ballotchoice_unique_rank'),
+        ),
+        migrations.AddConstraint(
+            model_name='ballotchoice',
+            constraint=models.UniqueConstraint(fields=('ballot', 'choice'), name='polls_ballotchoice_unique_choice'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.1.15 on 2026-10-19 09:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0006_ballots'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='finalized_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.CreateModel(
+            name='FinalResult',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('choice_text', models.CharField(max_length=200)),
+                ('votes', models.PositiveIntegerField()),
+                ('rounds', models.JSONField(blank=True, null=True)),
+                ('winner', models.BooleanField(default=False)),
+                ('choice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='polls.choice')),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='final_results', to='polls.question')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('question', 'choice'), name='polls_finalresult_one_per_choice')],
+            },
+        ),
+    ]
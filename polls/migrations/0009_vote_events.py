@@ -0,0 +1,62 @@
+# Generated by Django 5.1.15 on 2026-10-19 09:48
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+CHECKPOINT_SEED_SQL = (
+    "INSERT INTO polls_votecheckpoint (question_id, user_id, choice_id, as_of) "
+    "SELECT c.question_id, v.user_id, v.choice_id, %s "
+    "FROM polls_vote v JOIN polls_choice c ON c.id = v.choice_id "
+    "WHERE v.id IN (SELECT MAX(v2.id) FROM polls_vote v2 "
+    "JOIN polls_choice c2 ON c2.id = v2.choice_id "
+    "GROUP BY c2.question_id, v2.user_id)"
+)
+
+
+def seed_checkpoints(apps, schema_editor):
+    """Record the existing votes, which have no events, as checkpoints."""
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        cursor.execute(CHECKPOINT_SEED_SQL, [
+            connection.ops.adapt_datetimefield_value(django.utils.timezone.now())])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0008_pendingvote'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VoteCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('as_of', models.DateTimeField(default=django.utils.timezone.now)),
+                ('choice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='polls.choice')),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='polls.question')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('question', 'user'), name='polls_votecheckpoint_one_per_user')],
+            },
+        ),
+        migrations.CreateModel(
+            name='VoteEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('cast', 'Cast'), ('changed', 'Changed'), ('retracted', 'Retracted')], max_length=10)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('choice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='polls.choice')),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='polls.question')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['question', 'id'], name='polls_voteevent_replay_idx')],
+            },
+        ),
+        migrations.RunPython(seed_checkpoints, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.1.15 on 2026-10-19 10:10
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0011_slowquery'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnonymousVoterFilter',
+            fields=[
+                ('question', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='voter_filter', serialize=False, to='polls.question')),
+                ('bits', models.BinaryField()),
+                ('hashes', models.PositiveSmallIntegerField()),
+                ('voters', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='anonymous_voting',
+            field=models.BooleanField(default=False, help_text='Let anyone vote once per device without logging in. Only single choice polls can be anonymous.'),
+        ),
+        migrations.AddField(
+            model_name='vote',
+            name='device',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='vote',
+            name='user',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -5,6 +5,18 @@ This module includes the following models:
 - Question: Represents a poll question.
 - Choice: Represents a choice for a specific poll question.
 - Vote: Represents a vote by a user for a choice in a poll.
+- QuestionSearchDocument: The full-text searchable text of a question.
+- DirtyQuestion: Marks a question whose vote counts may have drifted.
+- Ballot: A user's ballot in an approval or ranked-choice poll.
+- BallotChoice: One choice selected on a ballot, with its rank.
+- FinalResult: The frozen result of one choice of a closed poll.
+- PendingVote: A vote waiting in the ingestion queue.
+- VoteEvent: One entry of the append-only history of votes.
+- VoteCheckpoint: The compacted state of old vote events.
+- InvalidationEvent: A cache invalidation message between worker processes.
+- SlowQuery: The statistics and plan of one kind of slow SQL statement.
+- AnonymousVoterFilter: The Bloom filter of the devices that voted in an
+  anonymous poll.
 """
 
 import datetime
@@ -22,11 +34,39 @@ class Question(models.Model):
         question_text (str): The text of the question.
         pub_date (datetime): The date and time when the question was published.
         end_date (datetime): The date and time when the question will be ended.
+        vote_rate_limit (int): Votes a user may submit per rate limit period,
+                               or None to use POLLS_VOTE_RATE_LIMIT.
+        poll_type (str): How voters answer: one choice (plurality), any
+                         number of choices (approval), or a ranking of the
+                         choices counted by instant runoff (ranked).
+        finalized_at (datetime): When the results of the closed poll were
+                                 frozen into ``FinalResult`` rows, or None.
+        anonymous_voting (bool): Whether voters are identified by a device
+                                 token instead of their account.  Only
+                                 single choice polls can be anonymous.
     """
 
+    class PollType(models.TextChoices):
+        """The ways a poll can be voted on and counted."""
+
+        PLURALITY = 'plurality', 'Single choice'
+        APPROVAL = 'approval', 'Approval (pick any number)'
+        RANKED = 'ranked', 'Ranked choice (instant runoff)'
+
     question_text = models.CharField(max_length=200)
     pub_date = models.DateTimeField('date published', default=timezone.now)
     end_date = models.DateTimeField('date ended', null=True, blank=True)
+    vote_rate_limit = models.PositiveIntegerField(
+        null=True, blank=True,
+        help_text="Votes a user may submit per period. "
+                  "Leave blank to use the site default.")
+    poll_type = models.CharField(max_length=10, choices=PollType.choices,
+                                 default=PollType.PLURALITY)
+    finalized_at = models.DateTimeField(null=True, blank=True, editable=False)
+    anonymous_voting = models.BooleanField(
+        default=False,
+        help_text="Let anyone vote once per device without logging in. "
+                  "Only single choice polls can be anonymous.")
 
     def is_published(self):
         """Return True if the current date is on or after the pub_date."""
@@ -37,6 +77,14 @@ class Question(models.Model):
         now = timezone.now()
         return self.pub_date <= now and (self.end_date is None or now <= self.end_date)
 
+    def is_closed(self):
+        """Return True if the end_date has passed."""
+        return self.end_date is not None and self.end_date < timezone.now()
+
+    def is_anonymous(self):
+        """Return True if votes are cast anonymously, one per device."""
+        return self.anonymous_voting and self.poll_type == self.PollType.PLURALITY
+
     def __str__(self) -> str:
         """Return the string of the question."""
         return str(self.question_text)
@@ -83,7 +131,352 @@ class Choice(models.Model):
 
 
 class Vote(models.Model):
-    """A vote by a user for a choice in a poll."""
+    """
+    A vote by a user for a choice in a poll.
+
+    Votes in anonymous polls have no user.  Their ``device`` is a keyed
+    hash of the poll and the voter's device token, so a device votes once
+    per poll and its votes in different polls cannot be linked.
+    """
+
+    choice = models.ForeignKey(Choice, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
+    device = models.CharField(max_length=64, null=True, blank=True, unique=True)
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of a user's voting history.
+            models.Index(fields=['user', 'id'], name='polls_vote_user_id_idx'),
+        ]
+
+
+class QuestionSearchDocument(models.Model):
+    """
+    The searchable text of a question and its choices.
+
+    The database keeps a full-text index over ``document``: a generated
+    ``tsvector`` column with a GIN index on PostgreSQL and an FTS5 table
+    kept in sync by triggers on SQLite (see ``polls.search``).
+
+    Attributes:
+        question (Question): The question this document indexes.
+        document (str): The question text followed by its choice texts.
+    """
+
+    question = models.OneToOneField(Question, on_delete=models.CASCADE,
+                                    primary_key=True,
+                                    related_name='search_document')
+    document = models.TextField(blank=True, default='')
+
+    def __str__(self) -> str:
+        """Return the indexed text."""
+        return str(self.document)
+
+
+class DirtyQuestion(models.Model):
+    """
+    Marks a question whose vote counts may need reconciling.
+
+    ``vote()`` records a marker every time it changes ``vote_count`` so the
+    ``reconcile_votes --dirty-only`` command only has to look at those
+    questions.
+
+    Attributes:
+        question (Question): The question whose choices changed.
+        marked_at (datetime): When the question was last marked.
+    """
+
+    question = models.OneToOneField(Question, on_delete=models.CASCADE,
+                                    primary_key=True)
+    marked_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self) -> str:
+        """Return the id of the marked question."""
+        return f"Question {self.question_id}"
+
+
+class Ballot(models.Model):
+    """
+    A user's ballot in an approval or ranked-choice poll.
+
+    Attributes:
+        question (Question): The poll the ballot was cast in.
+        user (User): The voter.
+        cast_at (datetime): When the ballot was last cast or changed.
+    """
+
+    question = models.ForeignKey(Question, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    cast_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['question', 'user'],
+                                    name='polls_ballot_one_per_user'),
+        ]
+
+    def __str__(self) -> str:
+        """Return who cast the ballot in which poll."""
+        return f"{self.user} in {self.question}"
+
+
+class BallotChoice(models.Model):
+    """
+    One choice selected on a ballot.
+
+    Attributes:
+        ballot (Ballot): The ballot the selection is on.
+        choice (Choice): The selected choice.
+        rank (int): 1 for the first preference, 2 for the second, and so
+                    on. Approval ballots number their choices in order.
+    """
+
+    ballot = models.ForeignKey(Ballot, on_delete=models.CASCADE,
+                               related_name='selections')
+    choice = models.ForeignKey(Choice, on_delete=models.CASCADE)
+    rank = models.PositiveSmallIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['ballot', 'rank'],
+                                    name='polls_ballotchoice_unique_rank'),
+            models.UniqueConstraint(fields=['ballot', 'choice'],
+                                    name='polls_ballotchoice_unique_choice'),
+        ]
+
+    def __str__(self) -> str:
+        """Return the rank and the choice."""
+        return f"{self.rank}. {self.choice}"
+
+
+class FinalResult(models.Model):
+    """
+    The frozen result of one choice of a closed poll.
+
+    Written once by ``polls.finalize`` after the poll's end_date has passed
+    and never updated; reopening the poll deletes them.
+
+    Attributes:
+        question (Question): The closed poll.
+        choice (Choice): The choice this row is the result of.
+        choice_text (str): The text of the choice when the poll closed.
+        votes (int): Votes for plurality polls, approvals for approval
+                     polls, and the count in the last round the choice
+                     took part in for ranked polls.
+        rounds (list): The count of every instant-runoff round, None once
+                       the choice is eliminated. Only for ranked polls.
+        winner (bool): Whether the choice won or tied for first place.
+    """
+
+    question = models.ForeignKey(Question, on_delete=models.CASCADE,
+                                 related_name='final_results')
+    choice = models.ForeignKey(Choice, on_delete=models.CASCADE)
+    choice_text = models.CharField(max_length=200)
+    votes = models.PositiveIntegerField()
+    rounds = models.JSONField(null=True, blank=True)
+    winner = models.BooleanField(default=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['question', 'choice'],
+                                    name='polls_finalresult_one_per_choice'),
+        ]
+
+    def __str__(self) -> str:
+        """Return the choice and its final count."""
+        return f"{self.choice_text}: {self.votes}"
+
+
+class PendingVote(models.Model):
+    """
+    A vote waiting in the ingestion queue.
 
+    When ``POLLS_VOTE_QUEUE`` is on, ``vote()`` only appends a row here and
+    the ``ingest_votes`` worker applies the queue in batches (see
+    ``polls.ingest``).  Rows are applied in id order, so of several queued
+    votes by one user in one poll the last one wins.
+
+    Attributes:
+        user (User): The voter.
+        question (Question): The poll voted in.
+        choice (Choice): The selected choice.
+        queued_at (datetime): When the vote was cast.
+    """
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    question = models.ForeignKey(Question, on_delete=models.CASCADE)
     choice = models.ForeignKey(Choice, on_delete=models.CASCADE)
+    queued_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self) -> str:
+        """Return who voted for what."""
+        return f"{self.user} for {self.choice}"
+
+
+class VoteEvent(models.Model):
+    """
+    One entry of the append-only history of votes.
+
+    Every change to a ``Vote`` writes an event in the same transaction.
+    Events are never updated; ``polls.events`` replays them to rebuild the
+    votes and compacts old ones into ``VoteCheckpoint`` rows.
+
+    Attributes:
+        kind (str): Whether the vote was cast, changed or retracted.
+        question (Question): The poll.
+        user (User): The voter.
+        choice (Choice): The chosen choice, or the one that was retracted.
+        created_at (datetime): When it happened.
+    """
+
+    class Kind(models.TextChoices):
+        """What happened to the vote."""
+
+        CAST = 'cast', 'Cast'
+        CHANGED = 'changed', 'Changed'
+        RETRACTED = 'retracted', 'Retracted'
+
+    kind = models.CharField(max_length=10, choices=Kind.choices)
+    question = models.ForeignKey(Question, on_delete=models.CASCADE)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
+    choice = models.ForeignKey(Choice, on_delete=models.CASCADE)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # Replaying one poll reads its events in id order.
+            models.Index(fields=['question', 'id'],
+                         name='polls_voteevent_replay_idx'),
+        ]
+
+    def __str__(self) -> str:
+        """Return who did what."""
+        return f"{self.user} {self.kind} {self.choice}"
+
+
+class VoteCheckpoint(models.Model):
+    """
+    The vote of a user in a poll as of the last compaction.
+
+    Replaying a poll starts from its checkpoints and applies only the
+    events that have not been compacted yet.
+
+    Attributes:
+        question (Question): The poll.
+        user (User): The voter.
+        choice (Choice): The choice voted for.
+        as_of (datetime): The time of the last event folded into the row.
+    """
+
+    question = models.ForeignKey(Question, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    choice = models.ForeignKey(Choice, on_delete=models.CASCADE)
+    as_of = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['question', 'user'],
+                                    name='polls_votecheckpoint_one_per_user'),
+        ]
+
+    def __str__(self) -> str:
+        """Return who voted for what."""
+        return f"{self.user} for {self.choice}"
+
+
+class InvalidationEvent(models.Model):
+    """
+    A cache invalidation message between worker processes.
+
+    Used by the ``table`` transport of ``polls.bus``; rows are deleted a
+    few minutes after they are written.
+
+    Attributes:
+        payload (dict): The message.
+        created_at (datetime): When it was published.
+    """
+
+    payload = models.JSONField()
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self) -> str:
+        """Return the message."""
+        return str(self.payload)
+
+
+class SlowQuery(models.Model):
+    """
+    The statistics and plan of one kind of slow SQL statement.
+
+    Statements that differ only in their literal values share a
+    fingerprint and are counted together; see ``polls.slowlog``.
+
+    Attributes:
+        fingerprint (str): The SHA-1 of the normalized statement.
+        normalized_sql (str): The statement with its values replaced by ``?``.
+        sql (str): The latest slow statement of this kind, normalized
+                   unless ``POLLS_SLOW_QUERY_LOG_PARAMS`` is on.
+        params (str): The parameters of the latest statement, empty unless
+                      ``POLLS_SLOW_QUERY_LOG_PARAMS`` is on.
+        view_name (str): The URL name of the view that ran it, if any.
+        plan (str): The ``EXPLAIN`` output for the first statement recorded.
+        count (int): How many times a statement of this kind was slow.
+        total_ms (float): Their total execution time.
+        max_ms (float): The slowest execution.
+        first_seen (datetime): When the first one was recorded.
+        last_seen (datetime): When the latest one was recorded.
+    """
+
+    fingerprint = models.CharField(max_length=40, unique=True)
+    normalized_sql = models.TextField()
+    sql = models.TextField()
+    params = models.TextField(blank=True)
+    view_name = models.CharField(max_length=200, blank=True)
+    plan = models.TextField(blank=True)
+    count = models.PositiveIntegerField(default=1)
+    total_ms = models.FloatField()
+    max_ms = models.FloatField()
+    first_seen = models.DateTimeField(default=timezone.now)
+    last_seen = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        # Slowest in total first.
+        ordering = ['-total_ms']
+        verbose_name_plural = 'slow queries'
+
+    def __str__(self) -> str:
+        """Return the start of the normalized statement."""
+        return self.normalized_sql[:80]
+
+    @admin.display(description='Avg (ms)', ordering='total_ms')
+    def average_ms(self):
+        """Return the average execution time in milliseconds."""
+        return round(self.total_ms / self.count, 2)
+
+
+class AnonymousVoterFilter(models.Model):
+    """
+    The Bloom filter of the devices that voted in an anonymous poll.
+
+    Workers keep the filter in memory and merge their additions into this
+    row from time to time; see ``polls.anonymous``.
+
+    Attributes:
+        question (Question): The anonymous poll.
+        bits (bytes): The bit array of the filter.
+        hashes (int): The number of bits set per device.
+        voters (int): Roughly how many devices were added.
+        updated_at (datetime): When the row was last merged into.
+    """
+
+    question = models.OneToOneField(Question, on_delete=models.CASCADE,
+                                    primary_key=True,
+                                    related_name='voter_filter')
+    bits = models.BinaryField()
+    hashes = models.PositiveSmallIntegerField()
+    voters = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self) -> str:
+        """Return the poll and the size of the filter."""
+        return f"{self.question_id}: {len(self.bits) * 8} bits"
@@ -0,0 +1,182 @@
+"""
+Overload protection.
+
+``OverloadMiddleware`` caps the number of requests a worker process runs
+at once at ``POLLS_MAX_CONCURRENT_REQUESTS`` (0, the default, turns it
+off).  The cap only matters for workers that run requests in threads,
+such as ``gunicorn --threads`` or ``runserver``.
+
+Every request gets a priority from the URL name it resolves to, looked up
+in ``POLLS_REQUEST_PRIORITIES``; other URLs are ``normal``.  Requests
+other than GET and HEAD are never ``low``.  When the worker is full:
+
+- ``low`` requests (results and index page reloads) are shed at once;
+- ``normal`` and ``high`` requests wait up to
+  ``POLLS_OVERLOAD_QUEUE_TIMEOUT`` seconds, and free slots go to the
+  ``high`` ones (vote submissions, login) first, then to the oldest;
+- requests that are still waiting at the deadline are shed.
+
+``POLLS_REQUEST_LIMITS`` can also cap the concurrent requests of single
+URL names, so a flood of one page cannot fill every slot.  Shed requests
+get ``503 Service Unavailable`` with a ``Retry-After`` header.
+
+Only requests that had to wait or were shed touch ``polls.metrics``:
+``overload_queued``, ``overload_queue_wait_ms_total`` and
+``overload_queue_wait_ms`` for waits, and ``overload_shed`` with one
+counter per priority and per URL name for shed requests.
+"""
+import itertools
+import logging
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.urls import Resolver404, resolve
+
+from polls import metrics
+
+HIGH, NORMAL, LOW = 'high', 'normal', 'low'
+# The order free slots are handed out in.
+RANKS = {HIGH: 0, NORMAL: 1, LOW: 2}
+
+logger = logging.getLogger('polls')
+
+
+class ConcurrencyLimiter:
+    """Count the requests running in this process and admit new ones."""
+
+    def __init__(self):
+        """Start with no requests running."""
+        self.condition = threading.Condition()
+        self.running = 0
+        self.running_by_name = Counter()
+        self.waiting = []
+        self.tickets = itertools.count()
+
+    def has_room(self, name):
+        """Return True if a request for URL ``name`` may start now."""
+        limit = settings.POLLS_MAX_CONCURRENT_REQUESTS
+        name_limit = settings.POLLS_REQUEST_LIMITS.get(name)
+        return ((not limit or self.running < limit)
+                and (not name_limit or self.running_by_name[name] < name_limit))
+
+    def next_waiter(self):
+        """Return the best waiting request that may start now, or None."""
+        for waiter in sorted(self.waiting):
+            if self.has_room(waiter[2]):
+                return waiter
+        return None
+
+    def acquire(self, name, priority, timeout):
+        """
+        Wait for a slot for a request.
+
+        Args:
+            name (str): The URL name of the request.
+            priority (str): ``high``, ``normal`` or ``low``.
+            timeout (float): The longest time to wait in seconds.
+
+        Returns:
+            float: The seconds waited if the request may run, after which
+                   it must call ``release``; None if it is to be shed.
+        """
+        with self.condition:
+            if self.has_room(name) and self.next_waiter() is None:
+                self.start(name)
+                return 0.0
+            if priority == LOW:
+                return None
+            waiter = (RANKS[priority], next(self.tickets), name)
+            self.waiting.append(waiter)
+            start = time.monotonic()
+            deadline = start + timeout
+            while self.next_waiter() is not waiter:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.waiting.remove(waiter)
+                    # A request further back may fit now.
+                    self.condition.notify_all()
+                    return None
+                self.condition.wait(remaining)
+            self.waiting.remove(waiter)
+            self.start(name)
+            self.condition.notify_all()
+            return time.monotonic() - start
+
+    def start(self, name):
+        """Count a request as running."""
+        self.running += 1
+        self.running_by_name[name] += 1
+
+    def release(self, name):
+        """Count a request as finished and wake up the waiting ones."""
+        with self.condition:
+            self.running -= 1
+            self.running_by_name[name] -= 1
+            self.condition.notify_all()
+
+
+limiter = ConcurrencyLimiter()
+
+
+def request_priority(request, name):
+    """Return the priority of a request for URL ``name``."""
+    priority = settings.POLLS_REQUEST_PRIORITIES.get(name, NORMAL)
+    if priority == LOW and request.method not in ('GET', 'HEAD'):
+        return NORMAL
+    return priority
+
+
+def url_name(request):
+    """Return the URL name of a request, such as ``polls:vote``, or ''."""
+    try:
+        return resolve(request.path_info).view_name
+    except Resolver404:
+        return ''
+
+
+def shed(name, priority):
+    """Count a shed request and return its 503 response."""
+    metrics.incr('overload_shed')
+    metrics.incr(f'overload_shed_{priority}')
+    metrics.incr(f'overload_shed:{name}')
+    logger.warning(f"Shed a {priority} priority request for {name or 'unknown URL'}")
+    response = HttpResponse("The server is busy. Please try again shortly.",
+                            status=503)
+    response['Retry-After'] = str(settings.POLLS_OVERLOAD_RETRY_AFTER)
+    return response
+
+
+class OverloadMiddleware:
+    """
+    Limit the requests running at once and shed the rest by priority.
+
+    Should come first, so shed requests cost as little as possible.
+    """
+
+    def __init__(self, get_response):
+        """Store the next handler."""
+        self.get_response = get_response
+
+    def __call__(self, request):
+        """Run the request once a slot is free, or shed it."""
+        if not (settings.POLLS_MAX_CONCURRENT_REQUESTS
+                or settings.POLLS_REQUEST_LIMITS):
+            return self.get_response(request)
+        name = url_name(request)
+        priority = request_priority(request, name)
+        waited = limiter.acquire(name, priority,
+                                 settings.POLLS_OVERLOAD_QUEUE_TIMEOUT)
+        if waited is None:
+            return shed(name, priority)
+        if waited:
+            waited_ms = round(waited * 1000)
+            metrics.incr('overload_queued')
+            metrics.incr('overload_queue_wait_ms_total', waited_ms)
+            metrics.set_gauge('overload_queue_wait_ms', waited_ms)
+        try:
+            return self.get_response(request)
+        finally:
+            limiter.release(name)
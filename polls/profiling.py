@@ -0,0 +1,133 @@
+"""
+On-demand request profiling.
+
+``ProfilingMiddleware`` runs a request under ``cProfile`` and records the
+SQL it executed when:
+
+- a staff user sends the ``X-Profile`` header or a ``profile`` query
+  parameter, or
+- the request is picked by sampling one in ``POLLS_PROFILE_SAMPLE_RATE``
+  requests (0 turns sampling off).
+
+Other requests pass straight through.  Profiles are written to
+``POLLS_PROFILE_DIR`` and only the newest ``POLLS_PROFILE_KEEP`` are kept.
+Each profile is a ``<id>.prof`` pstats file and a ``<id>.json`` file with
+the request details and its SQL.
+
+Sampled requests can come from any user, so the SQL is stored normalized
+and without its parameters, which can hold session keys and password
+hashes, unless ``POLLS_PROFILE_LOG_PARAMS`` is on.
+"""
+import cProfile
+import json
+import random
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connection
+
+from polls.slowlog import fingerprint
+
+
+def profile_dir():
+    """Return the directory profiles are stored in."""
+    return Path(settings.POLLS_PROFILE_DIR)
+
+
+def list_profiles():
+    """Return the metadata of the stored profiles, newest first."""
+    profiles = []
+    for path in sorted(profile_dir().glob('*.json'), reverse=True):
+        try:
+            profiles.append(json.loads(path.read_text()))
+        except (OSError, ValueError):
+            # Removed or still being written by another worker.
+            continue
+    return profiles
+
+
+def profile_path(profile_id, suffix):
+    """Return the path of one file of a stored profile."""
+    return profile_dir() / f'{profile_id}{suffix}'
+
+
+def save_profile(profiler, queries, request, response, duration):
+    """Write a profile and drop the oldest ones beyond POLLS_PROFILE_KEEP."""
+    directory = profile_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    profile_id = time.time_ns()
+    profiler.dump_stats(profile_path(profile_id, '.prof'))
+    metadata = {
+        'id': profile_id,
+        'method': request.method,
+        'path': request.get_full_path(),
+        'status': response.status_code,
+        'duration_ms': round(duration * 1000, 2),
+        'sql_ms': round(sum(query['ms'] for query in queries), 2),
+        'queries': queries,
+    }
+    # Write the metadata last: list_profiles() only sees complete profiles.
+    profile_path(profile_id, '.json').write_text(json.dumps(metadata))
+
+    stored = sorted(directory.glob('*.json'))
+    for old in stored[:-settings.POLLS_PROFILE_KEEP]:
+        old.unlink(missing_ok=True)
+        old.with_suffix('.prof').unlink(missing_ok=True)
+
+
+class ProfilingMiddleware:
+    """
+    Profile requests that ask for it or are sampled.
+
+    Must come after ``AuthenticationMiddleware``, which provides the user
+    the staff check needs.
+    """
+
+    def __init__(self, get_response):
+        """Read the sampling rate once at startup."""
+        self.get_response = get_response
+        self.sample_rate = settings.POLLS_PROFILE_SAMPLE_RATE
+
+    def __call__(self, request):
+        """Run the request, profiled if it was triggered."""
+        if self.is_triggered(request):
+            return self.profile(request)
+        return self.get_response(request)
+
+    def is_triggered(self, request):
+        """Return True if this request should be profiled."""
+        if ('HTTP_X_PROFILE' in request.META
+                or ('profile' in request.META.get('QUERY_STRING', '')
+                    and 'profile' in request.GET)):
+            return request.user.is_staff
+        return bool(self.sample_rate) and random.randrange(self.sample_rate) == 0
+
+    def profile(self, request):
+        """Run the request under cProfile and store the result."""
+        queries = []
+        log_params = settings.POLLS_PROFILE_LOG_PARAMS
+
+        def record_query(execute, sql, params, many, context):
+            start = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                ms = round((time.perf_counter() - start) * 1000, 3)
+                if log_params:
+                    queries.append({'sql': sql, 'params': repr(params),
+                                    'ms': ms})
+                else:
+                    queries.append({'sql': fingerprint(sql)[1], 'ms': ms})
+
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        with connection.execute_wrapper(record_query):
+            profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+        save_profile(profiler, queries, request, response,
+                     time.perf_counter() - start)
+        return response
@@ -0,0 +1,149 @@
+"""
+Rate limiting of vote submissions.
+
+Each user gets a bucket of vote tokens per question and each client IP a
+bucket shared by all questions.  A bucket is a counter in the configured
+cache that is refilled at the start of every period; taking a token is a
+single atomic ``incr``.  Requests that find a bucket empty are rejected
+with ``429 Too Many Requests`` before the vote view touches the database.
+"""
+import logging
+import math
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.http import HttpResponse
+
+from polls import bus, metrics
+from polls.models import Question
+
+LIMIT_CACHE_TIMEOUT = 300
+
+
+def take_token(key, limit, period):
+    """
+    Take a token from the bucket ``key``.
+
+    Args:
+        key (str): Identifies the bucket.
+        limit (int): The number of tokens per period.
+        period (int): The refill period in seconds.
+
+    Returns:
+        int: 0 if a token was taken, otherwise the number of seconds until
+             the bucket is refilled.
+    """
+    now = time.time()
+    window = int(now // period)
+    bucket = f'polls:ratelimit:{key}:{window}'
+    cache.add(bucket, 0, timeout=period + 1)
+    try:
+        used = cache.incr(bucket)
+    except ValueError:
+        # The bucket expired between add() and incr().
+        cache.add(bucket, 1, timeout=period + 1)
+        used = 1
+    if used <= limit:
+        return 0
+    return max(1, math.ceil((window + 1) * period - now))
+
+
+def return_token(key, period):
+    """
+    Put back a token taken from the bucket ``key`` in this period.
+
+    Args:
+        key (str): Identifies the bucket.
+        period (int): The refill period in seconds.
+    """
+    bucket = f'polls:ratelimit:{key}:{int(time.time() // period)}'
+    try:
+        cache.decr(bucket)
+    except ValueError:
+        # The bucket has been refilled meanwhile.
+        pass
+
+
+def _limit_cache_key(question_id):
+    return f'polls:ratelimit:limit:{question_id}'
+
+
+def question_vote_limit(question_id):
+    """
+    Return the votes per user per period allowed on a question.
+
+    The per-poll override is cached so that rejected requests never reach
+    the database.
+    """
+    key = _limit_cache_key(question_id)
+    limit = cache.get(key)
+    if limit is None:
+        limit = Question.objects.filter(pk=question_id).values_list(
+            'vote_rate_limit', flat=True).first() or 0
+        cache.set(key, limit, timeout=LIMIT_CACHE_TIMEOUT)
+    return limit or settings.POLLS_VOTE_RATE_LIMIT
+
+
+@bus.on_invalidate
+def forget_question_limit(question_id):
+    """Drop the cached limit of a question."""
+    cache.delete(_limit_cache_key(question_id))
+
+
+@receiver(post_save, sender=Question)
+@receiver(post_delete, sender=Question)
+def forget_vote_limit(sender, instance, **kwargs):
+    """Drop the cached limit of a question when it changes."""
+    forget_question_limit(instance.pk)
+
+
+def check_vote_rate(request, question_id):
+    """
+    Take a token from the user's and the client IP's buckets.
+
+    The user's bucket is checked first, so a user over their own limit
+    does not use up the budget of everyone behind the same IP, and the
+    user's token is put back when the IP's bucket is empty.
+
+    Returns:
+        int: 0 if the vote may proceed, otherwise the ``Retry-After``
+             delay in seconds.
+    """
+    from polls.views import get_client_ip
+
+    period = settings.POLLS_VOTE_RATE_PERIOD
+    user_key = None
+    if request.user.is_authenticated:
+        user_key = f'user:{request.user.pk}:{question_id}'
+        retry_after = take_token(user_key, question_vote_limit(question_id),
+                                 period)
+        if retry_after:
+            return retry_after
+    retry_after = take_token(f'ip:{get_client_ip(request)}',
+                             settings.POLLS_VOTE_IP_RATE_LIMIT, period)
+    if retry_after and user_key:
+        return_token(user_key, period)
+    return retry_after
+
+
+def vote_rate_limited(view):
+    """Reject vote submissions that exceed the rate limits with 429."""
+    @wraps(view)
+    def wrapper(request, question_id, *args, **kwargs):
+        if request.method == 'POST':
+            retry_after = check_vote_rate(request, question_id)
+            if retry_after:
+                metrics.incr('vote_rate_limited')
+                logger = logging.getLogger('polls')
+                logger.warning(f"Rate limited vote on poll {question_id} "
+                               f"by {request.user.username or 'anonymous'}")
+                response = HttpResponse(
+                    "Too many votes. Please try again later.", status=429)
+                response['Retry-After'] = str(retry_after)
+                return response
+        return view(request, question_id, *args, **kwargs)
+    return wrapper
@@ -0,0 +1,130 @@
+"""
+Reconciliation of ``Choice.vote_count`` with the ``Vote`` rows.
+
+``vote_count`` is maintained incrementally by ``vote()`` while ``Vote``
+rows are the source of truth, so the two can drift apart.  The functions
+here find and repair drift with set-based SQL: one aggregate over the
+votes joined to the choices, and one ``UPDATE ... FROM`` that rewrites
+only the choices whose count is wrong.
+"""
+from django.db import connection, transaction
+from django.utils import timezone
+
+from polls.models import Choice, DirtyQuestion, Vote
+from polls.utils import upsert
+
+CHOICE_TABLE = Choice._meta.db_table
+VOTE_TABLE = Vote._meta.db_table
+DIRTY_TABLE = DirtyQuestion._meta.db_table
+
+
+def mark_dirty(*question_ids):
+    """Record that the vote counts of the given questions have changed."""
+    now = timezone.now()
+    upsert(DirtyQuestion,
+           [DirtyQuestion(question_id=question_id, marked_at=now)
+            for question_id in question_ids],
+           unique_fields=['question'], update_fields=['marked_at'])
+
+
+def _scope_sql(question_ids=None, dirty_before=None):
+    """
+    Return a WHERE clause selecting the choices ``c`` in scope.
+
+    Args:
+        question_ids (list): Only choices of these questions.
+        dirty_before (datetime): Only choices of questions marked dirty at
+                                 or before this time.
+
+    Returns:
+        tuple: ``(sql, params)``; ``sql`` is empty when every choice is in
+               scope.
+    """
+    where = []
+    params = []
+    if question_ids is not None:
+        question_ids = list(question_ids) or [None]
+        placeholders = ', '.join(['%s'] * len(question_ids))
+        where.append(f"c.question_id IN ({placeholders})")
+        params += question_ids
+    if dirty_before is not None:
+        where.append(f"c.question_id IN (SELECT question_id FROM {DIRTY_TABLE} "
+                     f"WHERE marked_at <= %s)")
+        params.append(connection.ops.adapt_datetimefield_value(dirty_before))
+    return (" WHERE " + " AND ".join(where) if where else ""), params
+
+
+def _tally_sql(question_ids=None, dirty_before=None):
+    """
+    Return SQL counting the votes of every choice in scope.
+
+    Takes the same scope arguments as ``_scope_sql``.
+
+    Returns:
+        tuple: ``(sql, params)`` selecting ``choice_id`` and ``votes``.
+    """
+    where, params = _scope_sql(question_ids, dirty_before)
+    sql = (f"SELECT c.id AS choice_id, COUNT(v.id) AS votes "
+           f"FROM {CHOICE_TABLE} c LEFT JOIN {VOTE_TABLE} v "
+           f"ON v.choice_id = c.id{where} GROUP BY c.id")
+    return sql, params
+
+
+def find_drift(question_ids=None, dirty_before=None):
+    """
+    List the choices whose ``vote_count`` disagrees with their votes.
+
+    Takes the same scope arguments as ``_scope_sql``.
+
+    Returns:
+        list: ``(question_id, choice_id, vote_count, votes)`` tuples.
+    """
+    tally_sql, params = _tally_sql(question_ids, dirty_before)
+    sql = (f"SELECT c.question_id, c.id, c.vote_count, tally.votes "
+           f"FROM {CHOICE_TABLE} c JOIN ({tally_sql}) tally "
+           f"ON tally.choice_id = c.id "
+           f"WHERE c.vote_count <> tally.votes "
+           f"ORDER BY c.question_id, c.id")
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def repair_drift(question_ids=None, dirty_before=None):
+    """
+    Set ``vote_count`` to the number of votes for every drifted choice.
+
+    Takes the same scope arguments as ``_scope_sql``.
+
+    The choices in scope are locked before the votes are counted.  A vote
+    that already changed one of their counts is waited for and counted;
+    one that has not waits until the repair commits and then adds to the
+    repaired count.  Without the lock, a count taken before a concurrent
+    vote committed would overwrite that vote's increment.
+
+    Returns:
+        int: The number of choices that were fixed.
+    """
+    tally_sql, params = _tally_sql(question_ids, dirty_before)
+    sql = (f"UPDATE {CHOICE_TABLE} SET vote_count = tally.votes "
+           f"FROM ({tally_sql}) tally "
+           f"WHERE {CHOICE_TABLE}.id = tally.choice_id "
+           f"AND {CHOICE_TABLE}.vote_count <> tally.votes")
+    with transaction.atomic(), connection.cursor() as cursor:
+        if connection.features.has_select_for_update:
+            # SQLite has no row locks; its writers never run concurrently.
+            where, lock_params = _scope_sql(question_ids, dirty_before)
+            cursor.execute(f"SELECT c.id FROM {CHOICE_TABLE} c{where} "
+                           f"ORDER BY c.id FOR UPDATE", lock_params)
+        cursor.execute(sql, params)
+        return cursor.rowcount
+
+
+def clear_dirty(marked_before):
+    """
+    Remove the markers recorded at or before ``marked_before``.
+
+    Questions voted on after that time keep their marker because
+    ``mark_dirty`` moves ``marked_at`` forward.
+    """
+    return DirtyQuestion.objects.filter(marked_at__lte=marked_before).delete()[0]
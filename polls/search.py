@@ -0,0 +1,203 @@
+"""
+Full-text search over poll questions and their choices.
+
+Every question has a ``QuestionSearchDocument`` row holding the question
+text followed by its choice texts.  The row is rewritten whenever the
+question or one of its choices is saved, so the index is maintained
+incrementally instead of being rebuilt.
+
+The database does the indexing itself:
+
+- PostgreSQL: a generated ``tsvector`` column with a GIN index.
+- SQLite: an external-content FTS5 table kept in sync by triggers.
+
+Results are ranked (``ts_rank`` / ``bm25``) and keyset-paginated on
+``(rank, question id)``, so fetching a later page costs the same as the
+first one.
+
+Other databases, such as MySQL, have no index: their search falls back to
+matching the documents with ``icontains``, newest first, every result
+with rank 0.
+"""
+import re
+
+from django.db import connection
+from django.db.models import Q, Subquery
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from polls.models import Choice, Question, QuestionSearchDocument
+from polls.utils import upsert
+
+PAGE_SIZE = 20
+
+DOCUMENT_TABLE = QuestionSearchDocument._meta.db_table
+QUESTION_TABLE = Question._meta.db_table
+# Created by migration 0002_question_search on SQLite.
+FTS_TABLE = 'polls_questionsearch_fts'
+
+
+def build_documents(question_ids):
+    """
+    Build the search text for the given questions.
+
+    Returns:
+        dict: Maps question id to its document text.
+    """
+    documents = {
+        pk: [text] for pk, text in Question.objects.filter(
+            pk__in=question_ids).values_list('pk', 'question_text')
+    }
+    choices = Choice.objects.filter(
+        question_id__in=documents).order_by('id').values_list(
+        'question_id', 'choice_text')
+    for question_id, choice_text in choices:
+        documents[question_id].append(choice_text)
+    return {pk: '\n'.join(parts) for pk, parts in documents.items()}
+
+
+def index_questions(question_ids):
+    """Create or refresh the search documents of the given questions."""
+    documents = build_documents(question_ids)
+    upsert(QuestionSearchDocument,
+           [QuestionSearchDocument(question_id=pk, document=text)
+            for pk, text in documents.items()],
+           unique_fields=['question'], update_fields=['document'])
+
+
+def refresh_question(question_id):
+    """
+    Rewrite the document of an already indexed question.
+
+    Unlike ``index_questions`` this never creates a row, so it is safe to
+    call while the question itself is being deleted.
+    """
+    text = build_documents([question_id]).get(question_id)
+    if text is not None:
+        QuestionSearchDocument.objects.filter(
+            question_id=question_id).update(document=text)
+
+
+@receiver(post_save, sender=Question)
+def index_saved_question(sender, instance, **kwargs):
+    """Index a question whenever it is saved, including by ``loaddata``."""
+    index_questions([instance.pk])
+
+
+@receiver(post_save, sender=Choice)
+@receiver(post_delete, sender=Choice)
+def index_changed_choice(sender, instance, **kwargs):
+    """Refresh the document of the question a choice belongs to."""
+    refresh_question(instance.question_id)
+
+
+def _fts5_query(query):
+    """Turn free text into an FTS5 query matching all of its words."""
+    return ' '.join(f'"{word}"' for word in re.findall(r'\w+', query))
+
+
+def parse_cursor(cursor):
+    """
+    Decode a cursor produced by ``search_questions``.
+
+    Returns:
+        tuple: ``(rank, question_id)``, or None if the cursor is invalid.
+    """
+    try:
+        rank, question_id = cursor.split('_')
+        return float(rank), int(question_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+def _text_matches(query, after, limit):
+    """
+    Find published questions whose document contains ``query``, without an index.
+
+    The cursor's question id stands for its publication date, so the pages
+    follow ``(pub_date, id)`` without changing the cursor format.
+
+    Returns:
+        list: ``(question_id, 0.0)`` rows, newest first.
+    """
+    questions = Question.objects.filter(
+        search_document__document__icontains=query,
+        pub_date__lte=timezone.now())
+    if after is not None:
+        pub_date = Subquery(Question.objects.filter(pk=after[1]).values('pub_date'))
+        questions = questions.filter(
+            Q(pub_date__lt=pub_date) | Q(pub_date=pub_date, id__lt=after[1]))
+    return [(pk, 0.0) for pk in questions.order_by(
+        '-pub_date', '-id').values_list('id', flat=True)[:limit]]
+
+
+def search_questions(query, cursor=None, limit=PAGE_SIZE):
+    """
+    Search the published questions.
+
+    Args:
+        query (str): The words to search for.
+        cursor (str): The ``next_cursor`` of the previous page, if any.
+        limit (int): The maximum number of questions to return.
+
+    Returns:
+        tuple: ``(questions, next_cursor)``.  Each question carries a
+               ``search_rank`` attribute; ``next_cursor`` is None on the
+               last page.
+    """
+    vendor = connection.vendor
+    if vendor == 'postgresql':
+        match = query.strip()
+        hits_sql = (
+            f"SELECT q.id AS id, ts_rank(d.search_vector, query)::float8 AS rank "
+            f"FROM {DOCUMENT_TABLE} d "
+            f"JOIN {QUESTION_TABLE} q ON q.id = d.question_id, "
+            f"websearch_to_tsquery('english', %s) query "
+            f"WHERE d.search_vector @@ query AND q.pub_date <= %s"
+        )
+    elif vendor == 'sqlite':
+        match = _fts5_query(query)
+        hits_sql = (
+            f"SELECT q.id AS id, -bm25({FTS_TABLE}) AS rank "
+            f"FROM {FTS_TABLE} JOIN {QUESTION_TABLE} q "
+            f"ON q.id = {FTS_TABLE}.rowid "
+            f"WHERE {FTS_TABLE} MATCH %s AND q.pub_date <= %s"
+        )
+    else:
+        match = query.strip()
+        hits_sql = None
+    if not match:
+        return [], None
+
+    after = parse_cursor(cursor) if cursor else None
+    if hits_sql is None:
+        rows = _text_matches(match, after, limit + 1)
+    else:
+        now = connection.ops.adapt_datetimefield_value(timezone.now())
+        params = [match, now]
+        sql = f"SELECT id, rank FROM ({hits_sql}) hits"
+        if after is not None:
+            sql += " WHERE rank < %s OR (rank = %s AND id < %s)"
+            params += [after[0], after[0], after[1]]
+        sql += " ORDER BY rank DESC, id DESC LIMIT %s"
+        params.append(limit + 1)
+
+        with connection.cursor() as db_cursor:
+            db_cursor.execute(sql, params)
+            rows = db_cursor.fetchall()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    questions = Question.objects.in_bulk([pk for pk, _ in rows])
+    results = []
+    for pk, rank in rows:
+        question = questions[pk]
+        question.search_rank = rank
+        results.append(question)
+
+    next_cursor = None
+    if has_more:
+        last_pk, last_rank = rows[-1]
+        next_cursor = f"{last_rank!r}_{last_pk}"
+    return results, next_cursor
@@ -0,0 +1,233 @@
+"""
+Slow-query log.
+
+Every database connection gets an execute wrapper when it is opened.
+The wrapper times each statement, and one that takes longer than
+``POLLS_SLOW_QUERY_MS`` milliseconds (0 turns the log off) is handed to a
+background thread together with its parameters and the URL name of the
+view that ran it, which ``SlowQueryMiddleware`` keeps track of.
+
+The background thread, on its own connection:
+
+- reduces the statement to a fingerprint by replacing its literal values
+  and parameter placeholders with ``?``;
+- adds the execution to the ``SlowQuery`` row of that fingerprint, so
+  repeated statements are counted and timed together;
+- runs ``EXPLAIN`` the first time a fingerprint is seen and stores the
+  plan;
+- stores the parameters and the statement as executed only when
+  ``POLLS_SLOW_QUERY_LOG_PARAMS`` is on.  Otherwise the statement is
+  stored normalized and string literals in the plan are replaced, since
+  the values can be password hashes, session keys or e-mail addresses;
+- keeps only the ``POLLS_SLOW_QUERY_KEEP`` most recently seen
+  fingerprints.
+
+The request never waits for any of this.  When the thread falls behind,
+slow queries are dropped and counted in the ``slow_queries_dropped``
+metric.  The rows can be browsed in the admin.
+"""
+import contextvars
+import hashlib
+import logging
+import os
+import queue
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, connections
+from django.db.backends.signals import connection_created
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.dispatch import receiver
+from django.utils import timezone
+
+from polls import metrics
+from polls.models import SlowQuery
+
+# Statements worth explaining; others (SAVEPOINT, DDL, ...) are only counted.
+EXPLAINABLE = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH')
+# Slow queries waiting for the background thread.
+QUEUE_SIZE = 1000
+# The longest parameter list stored.
+MAX_PARAMS_LENGTH = 2000
+
+logger = logging.getLogger('polls')
+current_view = contextvars.ContextVar('polls_slowlog_view', default='')
+_queue = queue.Queue(maxsize=QUEUE_SIZE)
+_local = threading.local()
+_worker = None
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'(?<![\w."])-?\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER = re.compile(r'%s|\?')
+_VALUE_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def fingerprint(sql):
+    """
+    Normalize a statement so that ones differing only in values match.
+
+    Returns:
+        tuple: The SHA-1 hex digest of the normalized statement and the
+               normalized statement.
+    """
+    normalized = _STRING.sub('?', sql)
+    normalized = _NUMBER.sub('?', normalized)
+    normalized = _PLACEHOLDER.sub('?', normalized)
+    # IN lists and multi-row VALUES of any length become one.
+    normalized = _VALUE_LIST.sub('(...)', normalized)
+    normalized = _WHITESPACE.sub(' ', normalized).strip()
+    return hashlib.sha1(normalized.encode()).hexdigest(), normalized
+
+
+def record_slow_query(execute, sql, params, many, context):
+    """Execute a statement and hand it to the worker if it was slow."""
+    threshold = settings.POLLS_SLOW_QUERY_MS
+    if not threshold or getattr(_local, 'ignore', False):
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        ms = (time.perf_counter() - start) * 1000
+        if ms >= threshold:
+            enqueue({
+                'alias': context['connection'].alias,
+                'sql': sql,
+                'params': params,
+                'many': many,
+                'ms': ms,
+                'view_name': current_view.get(),
+                'seen_at': timezone.now(),
+            })
+
+
+def enqueue(entry):
+    """Pass a slow query to the background thread, or drop it if it is busy."""
+    start_worker()
+    try:
+        _queue.put_nowait(entry)
+    except queue.Full:
+        metrics.incr('slow_queries_dropped')
+
+
+def explain(alias, sql, params):
+    """
+    Return the query plan of a statement, or '' if it cannot be explained.
+
+    The statement is explained on this thread's connection, so it sees
+    only committed data; the plan is normally the same.
+    """
+    if not sql.lstrip().upper().startswith(EXPLAINABLE):
+        return ''
+    connection = connections[alias]
+    prefix = connection.ops.explain_query_prefix()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f'{prefix} {sql}', params)
+            # PostgreSQL returns one column, SQLite's detail is the last.
+            return '\n'.join(str(row[-1]) for row in cursor.fetchall())
+    except DatabaseError as error:
+        return f'EXPLAIN failed: {error}'
+
+
+def save(entry):
+    """Add one slow query to the store."""
+    digest, normalized = fingerprint(entry['sql'])
+    log_params = settings.POLLS_SLOW_QUERY_LOG_PARAMS
+    if log_params:
+        sql, params = entry['sql'], repr(entry['params'])[:MAX_PARAMS_LENGTH]
+    else:
+        sql, params = normalized, ''
+    ms = round(entry['ms'], 3)
+    latest = {'sql': sql, 'params': params,
+              'view_name': entry['view_name'], 'last_seen': entry['seen_at']}
+    updated = SlowQuery.objects.filter(fingerprint=digest).update(
+        count=F('count') + 1, total_ms=F('total_ms') + ms,
+        max_ms=Greatest('max_ms', Value(ms)), **latest)
+    if updated:
+        return
+    plan = '' if entry['many'] else explain(entry['alias'], entry['sql'],
+                                            entry['params'])
+    if not log_params:
+        plan = _STRING.sub("'?'", plan)
+    try:
+        SlowQuery.objects.create(fingerprint=digest, normalized_sql=normalized,
+                                 plan=plan, total_ms=ms, max_ms=ms,
+                                 first_seen=entry['seen_at'], **latest)
+    except IntegrityError:
+        # Another process recorded the same fingerprint first.
+        SlowQuery.objects.filter(fingerprint=digest).update(
+            count=F('count') + 1, total_ms=F('total_ms') + ms,
+            max_ms=Greatest('max_ms', Value(ms)), **latest)
+        return
+    stale = list(SlowQuery.objects.order_by('-last_seen').values_list(
+        'id', flat=True)[settings.POLLS_SLOW_QUERY_KEEP:])
+    SlowQuery.objects.filter(id__in=stale).delete()
+
+
+def run_worker():
+    """Save queued slow queries until the process exits."""
+    # The worker's own statements must not be logged.
+    _local.ignore = True
+    while True:
+        entry = _queue.get()
+        try:
+            save(entry)
+            metrics.incr('slow_queries')
+        except Exception:
+            logger.exception("Could not record a slow query")
+        finally:
+            if _queue.empty():
+                # Slow queries are rare: don't hold a connection meanwhile.
+                connections.close_all()
+            _queue.task_done()
+
+
+def start_worker():
+    """Start this process's background thread unless it runs already."""
+    global _worker
+    if _worker is not None and _worker.pid == os.getpid():
+        return
+    thread = threading.Thread(target=run_worker, name='polls-slow-queries',
+                              daemon=True)
+    thread.pid = os.getpid()
+    thread.start()
+    _worker = thread
+
+
+def flush():
+    """Wait until every queued slow query is saved."""
+    _queue.join()
+
+
+class SlowQueryMiddleware:
+    """Remember the URL name of the view handling the request."""
+
+    def __init__(self, get_response):
+        """Store the next handler."""
+        self.get_response = get_response
+
+    def __call__(self, request):
+        """Run the request, forgetting the view name afterwards."""
+        token = current_view.set('')
+        try:
+            return self.get_response(request)
+        finally:
+            current_view.reset(token)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        """Record the resolved URL name, such as ``polls:detail``."""
+        current_view.set(request.resolver_match.view_name)
+
+
+@receiver(connection_created)
+def install_wrapper(sender, connection, **kwargs):
+    """Wrap the statements of every new connection."""
+    # The same connection object is reused after reconnecting.  Insert at
+    # the front: execute_wrapper() blocks remove the last wrapper on exit.
+    if record_slow_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, record_slow_query)
@@ -0,0 +1,310 @@
+"""
+Compact snapshots of the polls and auth tables.
+
+A snapshot is a zip archive with one deflate-compressed CSV file per table
+and a ``manifest.json`` listing the tables, their columns and row counts.
+NULL is written as a backslash followed by ``N``, like ``COPY`` does.
+
+The user and group permission links are stored separately, naming each
+permission by its app label and codename: permission ids are assigned by
+``migrate`` and differ between databases.
+
+Tables are streamed in both directions so memory use does not depend on
+the size of the data.  PostgreSQL uses ``COPY`` both ways; other databases
+read with a cursor and insert with batched ``executemany``.
+"""
+import csv
+import datetime
+import io
+import json
+import zipfile
+
+from django.apps import apps
+from django.contrib.auth.models import Group, Permission, User
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.utils import timezone
+
+from polls.reconcile import find_drift, repair_drift
+
+FORMAT_VERSION = 2
+# Version 1 snapshots have no permission links.
+SUPPORTED_VERSIONS = (1, 2)
+NULL = '\\N'
+BATCH_SIZE = 5000
+
+
+def snapshot_models():
+    """
+    Return the models stored in a snapshot, parents before children.
+
+    User and group permissions are left out because permission ids are
+    assigned by ``migrate`` and differ between databases; see
+    ``permission_links``.
+    """
+    candidates = [Group, User, User.groups.through]
+    candidates += list(apps.get_app_config('polls').get_models())
+    ordered = []
+    while candidates:
+        for model in candidates:
+            parents = {field.related_model for field in model._meta.concrete_fields
+                       if field.is_relation}
+            if not parents & (set(candidates) - {model}):
+                ordered.append(model)
+                candidates.remove(model)
+                break
+        else:
+            raise ValueError("The snapshot models have a foreign key cycle.")
+    return ordered
+
+
+def permission_links():
+    """Return the permission link models with the column naming their owner."""
+    return [(Group.permissions.through, 'group_id'),
+            (User.user_permissions.through, 'user_id')]
+
+
+def _columns(model):
+    return [field.column for field in model._meta.concrete_fields]
+
+
+def _copy_sql(model, columns, direction):
+    quote = connection.ops.quote_name
+    column_list = ', '.join(quote(column) for column in columns)
+    return (f"COPY {quote(model._meta.db_table)} ({column_list}) {direction} "
+            f"WITH (FORMAT csv, NULL '{NULL}')")
+
+
+def _dump_table(model, columns, out):
+    """Write the rows of a table as CSV to the binary stream ``out``."""
+    rows = 0
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            with cursor.cursor.copy(_copy_sql(model, columns, 'TO STDOUT')) as copy:
+                for data in copy:
+                    out.write(data)
+            return cursor.cursor.rowcount
+        quote = connection.ops.quote_name
+        cursor.execute(
+            f"SELECT {', '.join(quote(c) for c in columns)} "
+            f"FROM {quote(model._meta.db_table)} ORDER BY {quote(model._meta.pk.column)}")
+        text = io.TextIOWrapper(out, encoding='utf-8', newline='')
+        writer = csv.writer(text)
+        while batch := cursor.fetchmany(BATCH_SIZE):
+            writer.writerows([_to_csv(value) for value in row] for row in batch)
+            rows += len(batch)
+        text.flush()
+        text.detach()
+    return rows
+
+
+def _dump_permissions(model, owner, out):
+    """Write the permission links of a table as ``owner, app_label, codename``."""
+    rows = model.objects.order_by('pk').values_list(
+        owner, 'permission__content_type__app_label', 'permission__codename')
+    text = io.TextIOWrapper(out, encoding='utf-8', newline='')
+    writer = csv.writer(text)
+    count = 0
+    for row in rows.iterator(chunk_size=BATCH_SIZE):
+        writer.writerow(row)
+        count += 1
+    text.flush()
+    text.detach()
+    return count
+
+
+def write_snapshot(path):
+    """
+    Write a snapshot of the polls and auth tables to ``path``.
+
+    Returns:
+        dict: The manifest of the snapshot.
+    """
+    manifest = {'version': FORMAT_VERSION, 'tables': [], 'permissions': []}
+    repeatable_read = (connection.vendor == 'postgresql'
+                       and not connection.in_atomic_block)
+    with transaction.atomic(), zipfile.ZipFile(
+            path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        if repeatable_read:
+            # Read every table from the same database snapshot.
+            with connection.cursor() as cursor:
+                cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+        for model in snapshot_models():
+            columns = _columns(model)
+            name = f'{model._meta.db_table}.csv'
+            with archive.open(name, 'w', force_zip64=True) as out:
+                rows = _dump_table(model, columns, out)
+            manifest['tables'].append({
+                'model': model._meta.label, 'file': name,
+                'columns': columns, 'rows': rows,
+            })
+        for model, owner in permission_links():
+            name = f'{model._meta.db_table}.csv'
+            with archive.open(name, 'w', force_zip64=True) as out:
+                rows = _dump_permissions(model, owner, out)
+            manifest['permissions'].append({
+                'model': model._meta.label, 'file': name,
+                'columns': [owner, 'app_label', 'codename'], 'rows': rows,
+            })
+        archive.writestr('manifest.json', json.dumps(manifest, indent=2))
+    return manifest
+
+
+def _clear_tables(models):
+    """Delete every row of the snapshot tables and of tables referring to users."""
+    quote = connection.ops.quote_name
+    tables = [model._meta.db_table for model in models]
+    # The permission links go on every database, not only through CASCADE.
+    tables += [model._meta.db_table for model, _ in permission_links()]
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            # TRUNCATE refuses to run while deferred foreign key checks
+            # are pending, so run them first. CASCADE also empties tables
+            # such as django_admin_log.
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+            cursor.execute(f"TRUNCATE {', '.join(quote(t) for t in tables)} CASCADE")
+            cursor.execute("SET CONSTRAINTS ALL DEFERRED")
+            return
+        if apps.is_installed('django.contrib.admin'):
+            from django.contrib.admin.models import LogEntry
+            tables.append(LogEntry._meta.db_table)
+        for table in reversed(tables):
+            cursor.execute(f"DELETE FROM {quote(table)}")
+
+
+def _to_csv(value):
+    """Format a value the way PostgreSQL's ``COPY ... TO`` would."""
+    if value is None:
+        return NULL
+    if isinstance(value, (bytes, memoryview)):
+        return '\\x' + bytes(value).hex()
+    return value
+
+
+def _from_csv(field, value):
+    """Parse a CSV value written by ``_to_csv`` or ``COPY`` for ``field``."""
+    internal_type = field.get_internal_type()
+    if internal_type == 'BinaryField':
+        return bytes.fromhex(value[2:])
+    if internal_type == 'JSONField':
+        return json.loads(value)
+    value = field.to_python(value)
+    if internal_type == 'DateTimeField' and timezone.is_naive(value):
+        # Databases without time zone support store UTC.
+        value = timezone.make_aware(value, datetime.timezone.utc)
+    return value
+
+
+def _load_table(model, columns, source):
+    """Insert the CSV rows read from the binary stream ``source``."""
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            with cursor.cursor.copy(_copy_sql(model, columns, 'FROM STDIN')) as copy:
+                while data := source.read(1 << 16):
+                    copy.write(data)
+        return
+
+    # Convert through the model fields so that a snapshot taken on
+    # PostgreSQL loads on SQLite too.
+    fields = {field.column: field for field in model._meta.concrete_fields}
+    fields = [fields[column] for column in columns]
+    quote = connection.ops.quote_name
+    sql = (f"INSERT INTO {quote(model._meta.db_table)} "
+           f"({', '.join(quote(c) for c in columns)}) "
+           f"VALUES ({', '.join(['%s'] * len(columns))})")
+
+    def convert(row):
+        return [None if value == NULL else
+                field.get_db_prep_save(_from_csv(field, value), connection)
+                for field, value in zip(fields, row)]
+
+    reader = csv.reader(io.TextIOWrapper(source, encoding='utf-8', newline=''))
+    with connection.cursor() as cursor:
+        batch = []
+        for row in reader:
+            batch.append(convert(row))
+            if len(batch) >= BATCH_SIZE:
+                cursor.executemany(sql, batch)
+                batch = []
+        if batch:
+            cursor.executemany(sql, batch)
+
+
+def _load_permissions(model, owner, source):
+    """
+    Insert permission links, matching permissions by app label and codename.
+
+    Returns:
+        int: The number of links skipped because this database has no
+             such permission.
+    """
+    permissions = {(app_label, codename): pk for pk, app_label, codename in
+                   Permission.objects.values_list(
+                       'pk', 'content_type__app_label', 'codename')}
+    links = []
+    missing = 0
+    reader = csv.reader(io.TextIOWrapper(source, encoding='utf-8', newline=''))
+    for owner_id, app_label, codename in reader:
+        permission_id = permissions.get((app_label, codename))
+        if permission_id is None:
+            missing += 1
+            continue
+        links.append(model(**{owner: int(owner_id),
+                              'permission_id': permission_id}))
+    model.objects.bulk_create(links, batch_size=BATCH_SIZE)
+    return missing
+
+
+def restore_snapshot(path, repair_counts=False):
+    """
+    Replace the polls and auth tables with the contents of a snapshot.
+
+    Everything happens in one transaction. Sequences are reset afterwards
+    so new rows get fresh ids, and every ``Choice.vote_count`` is checked
+    against the restored ``Vote`` rows.  User and group permissions are
+    replaced by those of the snapshot; a version 1 snapshot has none, so
+    restoring one leaves no permissions assigned.
+
+    Args:
+        path (str): The snapshot file.
+        repair_counts (bool): Fix drifted vote counts instead of failing.
+
+    Returns:
+        dict: The manifest of the snapshot, with the number of repaired
+              choices under ``repaired`` and the number of permission
+              links this database has no permission for under
+              ``missing_permissions``.
+
+    Raises:
+        ValueError: If the snapshot format is unknown, or if vote counts
+                    disagree with the votes and ``repair_counts`` is False.
+                    Nothing is changed in that case.
+    """
+    with zipfile.ZipFile(path) as archive:
+        manifest = json.loads(archive.read('manifest.json'))
+        if manifest.get('version') not in SUPPORTED_VERSIONS:
+            raise ValueError(f"Unsupported snapshot version {manifest.get('version')}.")
+        models = [apps.get_model(table['model']) for table in manifest['tables']]
+        with transaction.atomic():
+            _clear_tables(models)
+            for model, table in zip(models, manifest['tables']):
+                with archive.open(table['file']) as source:
+                    _load_table(model, table['columns'], source)
+            manifest.setdefault('permissions', [])
+            manifest['missing_permissions'] = 0
+            for table in manifest['permissions']:
+                model = apps.get_model(table['model'])
+                owner = table['columns'][0]
+                with archive.open(table['file']) as source:
+                    manifest['missing_permissions'] += _load_permissions(
+                        model, owner, source)
+            with connection.cursor() as cursor:
+                for sql in connection.ops.sequence_reset_sql(no_style(), models):
+                    cursor.execute(sql)
+            drift = find_drift()
+            if drift and not repair_counts:
+                raise ValueError(
+                    f"{len(drift)} choice(s) have a vote_count that does not "
+                    f"match their votes.")
+            manifest['repaired'] = repair_drift() if drift else 0
+    return manifest
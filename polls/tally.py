@@ -0,0 +1,229 @@
+"""
+Tallying of approval and ranked-choice polls.
+
+All ballots of a poll are read in one query into two flat integer arrays:
+``prefs`` holds every ballot's choices in preference order as candidate
+indices, and ``offsets[b]:offsets[b + 1]`` is the slice of ballot ``b``.
+Instant-runoff rounds then run on those arrays in memory instead of
+querying the database once per elimination.
+
+Every ballot sits in the bucket of its highest-ranked candidate still in
+the race.  Eliminating a candidate only moves the ballots in that
+candidate's bucket, so a whole count does work proportional to the total
+number of preferences rather than to ballots times rounds.
+
+Results are cached until the next ballot is cast in the poll.  Cached
+results are keyed by a per-poll generation that every invalidation
+bumps, so a count that read the ballots before a change and is stored
+after it lands under an old generation that nobody reads again.
+"""
+import time
+from array import array
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from polls import bus
+from polls.models import BallotChoice, Choice, Question
+
+CACHE_TIMEOUT = 24 * 60 * 60
+
+
+def load_ballots(question_id, candidates):
+    """
+    Read the ballots of a poll into compact arrays.
+
+    Args:
+        question_id (int): The poll.
+        candidates (list): The choice ids; a choice's position in this list
+                           is its candidate index.
+
+    Returns:
+        tuple: ``(offsets, prefs)`` arrays as described in the module
+               docstring.
+    """
+    index = {choice_id: n for n, choice_id in enumerate(candidates)}
+    offsets = array('l', [0])
+    prefs = array('i')
+    previous_ballot = None
+    rows = BallotChoice.objects.filter(ballot__question_id=question_id).order_by(
+        'ballot_id', 'rank').values_list('ballot_id', 'choice_id')
+    for ballot_id, choice_id in rows.iterator(chunk_size=10000):
+        if ballot_id != previous_ballot and previous_ballot is not None:
+            offsets.append(len(prefs))
+        previous_ballot = ballot_id
+        prefs.append(index[choice_id])
+    if previous_ballot is not None:
+        offsets.append(len(prefs))
+    return offsets, prefs
+
+
+def approval_counts(num_candidates, prefs):
+    """Return the number of ballots approving each candidate."""
+    counts = [0] * num_candidates
+    for candidate in prefs:
+        counts[candidate] += 1
+    return counts
+
+
+def instant_runoff(num_candidates, offsets, prefs):
+    """
+    Count ranked ballots by instant runoff.
+
+    Each round the candidate with the fewest ballots is eliminated and
+    those ballots move to their next preference still in the race, until
+    one candidate holds a majority of the ballots that are not exhausted.
+    Ties for last place eliminate the candidate with fewer first-round
+    ballots, then the one listed later.
+
+    Args:
+        num_candidates (int): The number of candidates.
+        offsets (array): Ballot boundaries in ``prefs``.
+        prefs (array): Candidate indices in preference order.
+
+    Returns:
+        dict: ``rounds`` is a list of per-candidate counts (None once a
+              candidate is eliminated), ``eliminated`` the candidate
+              dropped after each round, and ``winner`` the winning
+              candidate index or None when there are no ballots.
+    """
+    num_ballots = len(offsets) - 1
+    position = array('l', offsets[:-1])
+    buckets = [array('l') for _ in range(num_candidates)]
+    for ballot in range(num_ballots):
+        if offsets[ballot] < offsets[ballot + 1]:
+            buckets[prefs[offsets[ballot]]].append(ballot)
+
+    active = set(range(num_candidates))
+    rounds = []
+    eliminated_order = []
+    first_round = [len(bucket) for bucket in buckets]
+    while True:
+        counts = [len(buckets[c]) if c in active else None
+                  for c in range(num_candidates)]
+        rounds.append(counts)
+        live = sum(count for count in counts if count is not None)
+        if not live:
+            return {'rounds': rounds, 'eliminated': eliminated_order,
+                    'winner': None}
+        leader = max(active, key=lambda c: (counts[c], -c))
+        if counts[leader] * 2 > live or len(active) == 1:
+            return {'rounds': rounds, 'eliminated': eliminated_order,
+                    'winner': leader}
+
+        loser = min(active, key=lambda c: (counts[c], first_round[c], -c))
+        active.discard(loser)
+        eliminated_order.append(loser)
+        for ballot in buckets[loser]:
+            end = offsets[ballot + 1]
+            pos = position[ballot] + 1
+            while pos < end and prefs[pos] not in active:
+                pos += 1
+            position[ballot] = pos
+            if pos < end:
+                buckets[prefs[pos]].append(ballot)
+        buckets[loser] = array('l')
+
+
+def _generation_key(question_id):
+    return f'polls:tally:generation:{question_id}'
+
+
+def _generation(question_id):
+    """Return the current cache generation of a poll's results."""
+    key = _generation_key(question_id)
+    generation = cache.get(key)
+    if generation is None:
+        # Start from the clock, so a generation evicted from the cache
+        # never comes back to the number of an old entry.
+        cache.add(key, time.time_ns(), timeout=None)
+        generation = cache.get(key)
+    return generation
+
+
+def _bump_generation(question_id):
+    try:
+        cache.incr(_generation_key(question_id))
+    except ValueError:
+        cache.add(_generation_key(question_id), time.time_ns(), timeout=None)
+
+
+def _cache_key(question_id):
+    return f'polls:tally:{question_id}:{_generation(question_id)}'
+
+
+def tally_question(question):
+    """
+    Return the cached results of an approval or ranked-choice poll.
+
+    Returns:
+        dict: The results of ``count_tally``.
+    """
+    key = _cache_key(question.id)
+    result = cache.get(key)
+    if result is None:
+        result = count_tally(question)
+        cache.set(key, result, timeout=CACHE_TIMEOUT)
+    return result
+
+
+def count_tally(question):
+    """
+    Count the results of an approval or ranked-choice poll from its ballots.
+
+    Returns:
+        dict: ``choices`` lists the choices in candidate order. Approval
+              polls have ``counts`` and ``rows`` pairing each choice with
+              its count; ranked polls have the ``rounds``,
+              ``eliminated`` and ``winner`` of ``instant_runoff`` with
+              choices in place of candidate indices, and ``rows`` pairing
+              each choice with its count in every round. Both have
+              ``ballots``, the number of ballots counted.
+    """
+    choices = list(question.choice_set.order_by('id'))
+    offsets, prefs = load_ballots(question.id, [choice.id for choice in choices])
+    result = {'choices': choices, 'ballots': len(offsets) - 1}
+    if question.poll_type == Question.PollType.APPROVAL:
+        result['counts'] = approval_counts(len(choices), prefs)
+        result['rows'] = [{'choice': choice, 'count': count}
+                          for choice, count in zip(choices, result['counts'])]
+    else:
+        runoff = instant_runoff(len(choices), offsets, prefs)
+        result['rounds'] = runoff['rounds']
+        result['rows'] = [
+            {'choice': choice,
+             'counts': [counts[n] for counts in runoff['rounds']]}
+            for n, choice in enumerate(choices)
+        ]
+        result['eliminated'] = [choices[c] for c in runoff['eliminated']]
+        result['winner'] = (None if runoff['winner'] is None
+                            else choices[runoff['winner']])
+    return result
+
+
+@bus.on_invalidate
+def invalidate_tally(question_id):
+    """
+    Forget the cached results of a poll.
+
+    The generation is bumped at once and again when the transaction
+    commits: a count made between the two read the ballots as they were
+    before the change.
+    """
+    _bump_generation(question_id)
+    transaction.on_commit(lambda: _bump_generation(question_id))
+
+
+@receiver(post_save, sender=Choice)
+@receiver(post_delete, sender=Choice)
+def forget_tally_of_choice(sender, instance, **kwargs):
+    """Forget the results of a poll whose choices changed."""
+    invalidate_tally(instance.question_id)
+
+
+@receiver(post_save, sender=Question)
+def forget_tally_of_question(sender, instance, **kwargs):
+    """Forget the results of a poll that was edited."""
+    invalidate_tally(instance.id)
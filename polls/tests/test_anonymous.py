@@ -0,0 +1,171 @@
+"""
+Tests for anonymous voting.
+
+This module contains test cases for the Bloom filter, for voting once
+per device in anonymous polls, and for duplicate suppression after a
+worker restart.
+"""
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+from polls import anonymous, metrics
+from polls.anonymous import BloomFilter
+from polls.models import AnonymousVoterFilter, Choice, Question, Vote
+from polls.reconcile import find_drift
+
+
+class BloomFilterTest(TestCase):
+    """Test cases for the Bloom filter."""
+
+    def test_no_false_negatives(self):
+        """Every added key is found."""
+        bloom = BloomFilter.for_capacity(1000, 0.01)
+        keys = [f'voter-{i}' for i in range(1000)]
+        for key in keys:
+            bloom.add(key)
+        self.assertTrue(all(key in bloom for key in keys))
+
+    def test_false_positive_rate(self):
+        """At capacity, about the configured rate of unseen keys match."""
+        bloom = BloomFilter.for_capacity(1000, 0.01)
+        for i in range(1000):
+            bloom.add(f'voter-{i}')
+        false_positives = sum(f'stranger-{i}' in bloom for i in range(20000))
+        self.assertLess(false_positives / 20000, 0.02)
+        # About 10 bits per voter.
+        self.assertLess(len(bloom.bits), 1000 * 10 / 8 * 1.05)
+
+    def test_merge(self):
+        """Merging the bits of another filter adds its keys."""
+        first = BloomFilter.for_capacity(100, 0.01)
+        second = BloomFilter(bytes(first.bits), first.hashes)
+        first.add('a')
+        second.add('b')
+        first.merge(second.bits)
+        self.assertIn('a', first)
+        self.assertIn('b', first)
+
+
+@override_settings(POLLS_ANONYMOUS_FILTER_SYNC_EVERY=1)
+class AnonymousVoteTest(TestCase):
+    """Test cases for voting in anonymous polls."""
+
+    def setUp(self):
+        """Create an anonymous poll and start from a fresh worker."""
+        cache.clear()
+        anonymous.forget_filters()
+        self.addCleanup(anonymous.forget_filters)
+        self.question = Question.objects.create(question_text="Lecture poll",
+                                                anonymous_voting=True)
+        self.choice = Choice.objects.create(question=self.question,
+                                            choice_text="Yes")
+
+    def vote(self, client):
+        """Vote for the choice as ``client`` and return the response."""
+        return client.post(reverse('polls:vote', args=(self.question.id,)),
+                           {'choice': self.choice.id}, follow=True)
+
+    def votes(self):
+        """Return the vote count of the choice."""
+        self.choice.refresh_from_db()
+        return self.choice.vote_count
+
+    def test_vote_without_login(self):
+        """Anyone can vote, and the device token is set as a cookie."""
+        response = self.vote(self.client)
+        self.assertContains(response, "You voted for Yes.")
+        self.assertIn(anonymous.DEVICE_COOKIE, self.client.cookies)
+        vote = Vote.objects.get()
+        self.assertIsNone(vote.user)
+        self.assertEqual(self.votes(), 1)
+        self.assertEqual(find_drift(), [])
+
+    def test_one_vote_per_device(self):
+        """A device's second vote is rejected; other devices can vote."""
+        self.vote(self.client)
+        response = self.vote(self.client)
+        self.assertContains(response, "This device has already voted")
+        self.vote(Client())
+        self.assertEqual(self.votes(), 2)
+
+    def test_new_voters_skip_lookup(self):
+        """Devices the filter has not seen vote without a Vote lookup."""
+        for _ in range(5):
+            self.vote(Client())
+        self.assertEqual(self.votes(), 5)
+        self.assertEqual(metrics.get('anonymous_exact_checks'), 0)
+
+    def test_detail_sets_token(self):
+        """The detail page hands out the device token."""
+        response = self.client.get(reverse('polls:detail',
+                                           args=(self.question.id,)))
+        self.assertContains(response, "This poll is anonymous")
+        token = self.client.cookies[anonymous.DEVICE_COOKIE].value
+        self.vote(self.client)
+        self.assertEqual(self.client.cookies[anonymous.DEVICE_COOKIE].value,
+                         token)
+
+    def test_forged_token(self):
+        """A token without a valid signature gets a new one."""
+        self.client.cookies[anonymous.DEVICE_COOKIE] = 'forged'
+        self.vote(self.client)
+        self.assertNotEqual(self.client.cookies[anonymous.DEVICE_COOKIE].value,
+                            'forged')
+        self.assertEqual(self.votes(), 1)
+
+    def test_login_required_elsewhere(self):
+        """Polls that are not anonymous still require logging in."""
+        self.question.anonymous_voting = False
+        self.question.save()
+        response = self.vote(self.client)
+        self.assertRedirects(response, reverse('login') + '?next=' + reverse(
+            'polls:vote', args=(self.question.id,)))
+        self.assertEqual(self.votes(), 0)
+
+    def test_logged_in_users_vote_by_device(self):
+        """In anonymous polls logged in users vote by device too."""
+        self.client.force_login(User.objects.create_user(username="student"))
+        self.vote(self.client)
+        self.assertIsNone(Vote.objects.get().user)
+
+    def test_restart_loads_saved_filter(self):
+        """A restarted worker loads the filter and rejects repeat voters."""
+        self.vote(self.client)
+        stored = AnonymousVoterFilter.objects.get(question=self.question)
+        self.assertEqual(stored.voters, 1)
+
+        anonymous.forget_filters()
+        self.vote(self.client)
+        self.assertEqual(self.votes(), 1)
+        self.assertEqual(metrics.get('anonymous_exact_checks'), 1)
+        self.assertEqual(metrics.get('anonymous_duplicates'), 1)
+
+    @override_settings(POLLS_ANONYMOUS_FILTER_SYNC_EVERY=100)
+    def test_restart_before_sync(self):
+        """Votes the filter lost in a restart are still rejected."""
+        self.vote(self.client)
+        self.assertFalse(AnonymousVoterFilter.objects.exists())
+
+        anonymous.forget_filters()
+        response = self.vote(self.client)
+        self.assertContains(response, "This device has already voted")
+        self.assertEqual(self.votes(), 1)
+        self.assertEqual(Vote.objects.count(), 1)
+
+    def test_workers_merge_filters(self):
+        """Saving a filter keeps the voters saved by other workers."""
+        self.vote(self.client)
+        stored = AnonymousVoterFilter.objects.get()
+        other_worker = BloomFilter(stored.bits, stored.hashes)
+        other_worker.add('voter-of-another-worker')
+        stored.bits = bytes(other_worker.bits)
+        stored.save()
+
+        self.vote(Client())
+        self.assertIn('voter-of-another-worker',
+                      anonymous.voter_filter(self.question.id)[0])
+        stored.refresh_from_db()
+        saved = BloomFilter(stored.bits, stored.hashes)
+        self.assertIn('voter-of-another-worker', saved)
+        self.assertEqual(stored.voters, 2)
@@ -0,0 +1,142 @@
+"""
+Tests for the cross-worker cache invalidation bus.
+
+This module contains test cases for publishing and delivering
+invalidation messages, and one that runs two worker processes against
+the same database.
+"""
+import multiprocessing
+import time
+import unittest
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection, connections, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from polls import bus, metrics, tally
+from polls.models import Choice, InvalidationEvent, Question
+
+
+def published_ids():
+    """Return the question ids of the messages in the table, oldest first."""
+    return [event.payload['question_id']
+            for event in InvalidationEvent.objects.order_by('id')]
+
+
+@override_settings(POLLS_INVALIDATION_TRANSPORT='table')
+class PublishTest(TestCase):
+    """Test cases for publishing and delivering messages."""
+
+    def setUp(self):
+        """Create a question with a choice, then empty the bus and metrics."""
+        self.question = Question.objects.create(question_text="Tea or coffee?")
+        self.choice = Choice.objects.create(question=self.question,
+                                            choice_text="Tea")
+        InvalidationEvent.objects.all().delete()
+        cache.clear()
+        # The test client's middleware starts a listener.
+        self.addCleanup(bus.stop_listener)
+
+    def test_changes_publish(self):
+        """Saving questions and choices publishes; plurality votes do not."""
+        self.question.save()
+        self.choice.save()
+        user = User.objects.create_user(username="voter")
+        self.client.force_login(user)
+        self.client.post(reverse('polls:vote', args=(self.question.id,)),
+                         {'choice': self.choice.id})
+        self.assertEqual(published_ids(), [self.question.id] * 2)
+        self.assertEqual(metrics.get('bus_published'), 2)
+
+    def test_rollback_publishes_nothing(self):
+        """A message is only sent if the change commits."""
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            self.question.save()
+            raise RuntimeError
+        self.assertEqual(published_ids(), [])
+
+    @override_settings(POLLS_INVALIDATION_TRANSPORT='')
+    def test_bus_off(self):
+        """Without a transport nothing is published."""
+        self.question.save()
+        self.assertEqual(published_ids(), [])
+
+    def test_deliver_evicts(self):
+        """A message from another worker drops the cached entries."""
+        cache.set(tally._cache_key(self.question.id), 'stale')
+        bus.deliver({'question_id': self.question.id, 'origin': 'other:1',
+                     'sent_at': time.time() - 0.25})
+        self.assertIsNone(cache.get(tally._cache_key(self.question.id)))
+        self.assertEqual(metrics.get('bus_delivered'), 1)
+        self.assertGreaterEqual(metrics.get('bus_delivery_lag_ms'), 250)
+
+    def test_own_messages_ignored(self):
+        """A worker does not handle the messages it published."""
+        bus.deliver({'question_id': self.question.id, 'origin': bus.origin(),
+                     'sent_at': time.time()})
+        self.assertEqual(metrics.get('bus_delivered'), 0)
+
+
+def run_worker(question_id, ready, results):
+    """
+    Act as one worker process.
+
+    Cache a stale entry, listen for invalidations and report whether the
+    entry was dropped and how long delivery took.
+    """
+    def cached():
+        return cache.get(tally._cache_key(question_id))
+
+    cache.set(tally._cache_key(question_id), 'stale')
+    listener = bus.start_listener()
+    ready.put(listener.ready.wait(10))
+    deadline = time.monotonic() + 10
+    while cached() is not None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    listener.stop()
+    results.put((cached() is None, metrics.get('bus_delivery_lag_ms')))
+
+
+@unittest.skipIf(connection.vendor == 'sqlite' and connection.is_in_memory_db(),
+                 "Worker processes cannot share an in-memory database.")
+class TwoWorkerTest(TransactionTestCase):
+    """Run two worker processes and invalidate their caches."""
+
+    def invalidate_two_workers(self):
+        """Fork two workers, change a poll and collect their reports."""
+        question = Question.objects.create(question_text="Shared")
+        context = multiprocessing.get_context('fork')
+        ready, results = context.Queue(), context.Queue()
+        # The workers must open their own database connections.
+        connections.close_all()
+        workers = [context.Process(target=run_worker,
+                                   args=(question.id, ready, results))
+                   for _ in range(2)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            self.assertTrue(ready.get(timeout=15))
+        question.question_text = "Changed"
+        question.save()
+        reports = [results.get(timeout=15) for _ in workers]
+        for worker in workers:
+            worker.join(timeout=5)
+        return reports
+
+    @override_settings(POLLS_INVALIDATION_TRANSPORT='table',
+                       POLLS_INVALIDATION_POLL_INTERVAL=0.05)
+    def test_table_transport(self):
+        """Both workers evict the entry within a few poll intervals."""
+        for evicted, lag_ms in self.invalidate_two_workers():
+            self.assertTrue(evicted)
+            self.assertLess(lag_ms, 2000)
+
+    @unittest.skipUnless(connection.vendor == 'postgresql',
+                         "LISTEN/NOTIFY needs PostgreSQL.")
+    @override_settings(POLLS_INVALIDATION_TRANSPORT='postgres',
+                       POLLS_INVALIDATION_POLL_INTERVAL=0.05)
+    def test_postgres_transport(self):
+        """Both workers receive the notification."""
+        for evicted, lag_ms in self.invalidate_two_workers():
+            self.assertTrue(evicted)
+            self.assertLess(lag_ms, 2000)
@@ -0,0 +1,163 @@
+"""
+Tests for the vote event log.
+
+This module contains test cases for recording vote events, replaying
+them with polls.events and compacting them into checkpoints.
+"""
+import datetime
+from io import StringIO
+from unittest import mock
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from polls import events
+from polls.events import compact_events, replay, replay_question
+from polls.models import Choice, Question, Vote, VoteCheckpoint, VoteEvent
+from polls.reconcile import find_drift
+
+
+class VoteEventTest(TestCase):
+    """Test cases for the vote history."""
+
+    def setUp(self):
+        """Create a poll with two choices and two logged in clients."""
+        cache.clear()
+        self.alice = User.objects.create_user(username="alice")
+        self.bob = User.objects.create_user(username="bob")
+        self.question = Question.objects.create(question_text="Tea or coffee?")
+        self.tea = Choice.objects.create(question=self.question,
+                                         choice_text="Tea")
+        self.coffee = Choice.objects.create(question=self.question,
+                                            choice_text="Coffee")
+
+    def vote(self, user, choice):
+        """Vote for ``choice`` as ``user`` through the vote view."""
+        self.client.force_login(user)
+        self.client.post(reverse('polls:vote', args=(self.question.id,)),
+                         {'choice': choice.id})
+
+    def retract(self, user):
+        """Withdraw the vote of ``user`` through the retract view."""
+        self.client.force_login(user)
+        return self.client.post(reverse('polls:retract',
+                                        args=(self.question.id,)), follow=True)
+
+    def history(self):
+        """Return the kind and choice of every event, oldest first."""
+        return list(VoteEvent.objects.order_by('id').values_list(
+            'user__username', 'kind', 'choice__choice_text'))
+
+    def test_events_recorded(self):
+        """Casting, changing and withdrawing a vote each add an event."""
+        self.vote(self.alice, self.tea)
+        self.vote(self.alice, self.coffee)
+        response = self.retract(self.alice)
+        self.assertContains(response, "Your vote was withdrawn.")
+        self.assertEqual(self.history(), [
+            ("alice", "cast", "Tea"),
+            ("alice", "changed", "Coffee"),
+            ("alice", "retracted", "Coffee"),
+        ])
+        self.assertFalse(Vote.objects.exists())
+        self.assertEqual(find_drift(), [])
+
+    def test_retract_without_vote(self):
+        """Withdrawing without a vote changes nothing."""
+        response = self.retract(self.bob)
+        self.assertContains(response, "You have not voted in this poll.")
+        self.assertFalse(VoteEvent.objects.exists())
+
+    def test_replay_rebuilds_votes(self):
+        """Replaying restores deleted and altered votes and counts."""
+        self.vote(self.alice, self.tea)
+        self.vote(self.bob, self.tea)
+        self.vote(self.bob, self.coffee)
+        Vote.objects.filter(user=self.alice).delete()
+        Vote.objects.filter(user=self.bob).update(choice=self.tea)
+        Vote.objects.create(user=User.objects.create_user(username="eve"),
+                            choice=self.tea)
+
+        result = replay_question(self.question.id)
+        self.assertEqual((result['created'], result['changed'],
+                          result['deleted']), (1, 1, 1))
+        self.assertEqual(
+            sorted(Vote.objects.values_list('user__username',
+                                            'choice__choice_text')),
+            [("alice", "Tea"), ("bob", "Coffee")])
+        self.assertEqual(find_drift(), [])
+
+    def test_replay_unchanged(self):
+        """Replaying votes that match their history changes nothing."""
+        self.vote(self.alice, self.tea)
+        vote_id = Vote.objects.get().id
+        totals = replay(chunk_size=1)
+        self.assertEqual(totals['created'] + totals['changed']
+                         + totals['deleted'], 0)
+        self.assertEqual(Vote.objects.get().id, vote_id)
+
+    def test_compaction(self):
+        """Old events become checkpoints and replay gives the same votes."""
+        self.vote(self.alice, self.tea)
+        self.vote(self.alice, self.coffee)
+        self.vote(self.bob, self.tea)
+        self.retract(self.bob)
+        compacted = compact_events(timezone.now() + datetime.timedelta(seconds=1))
+        self.assertEqual(compacted, 4)
+        self.assertFalse(VoteEvent.objects.exists())
+        self.assertEqual(list(VoteCheckpoint.objects.values_list(
+            'user__username', 'choice__choice_text')), [("alice", "Coffee")])
+
+        self.vote(self.bob, self.coffee)
+        Vote.objects.all().delete()
+        replay()
+        self.assertEqual(
+            sorted(Vote.objects.values_list('user__username',
+                                            'choice__choice_text')),
+            [("alice", "Coffee"), ("bob", "Coffee")])
+
+    def test_compaction_keeps_recent_events(self):
+        """Events newer than the cutoff stay in the log."""
+        self.vote(self.alice, self.tea)
+        VoteEvent.objects.update(
+            created_at=timezone.now() - datetime.timedelta(days=60))
+        self.vote(self.alice, self.coffee)
+        out = StringIO()
+        call_command('compact_vote_events', '--days', '30', stdout=out)
+        self.assertIn("Compacted 1 event(s)", out.getvalue())
+        self.assertEqual(self.history(), [("alice", "changed", "Coffee")])
+        self.assertEqual(VoteCheckpoint.objects.get().choice, self.tea)
+
+    def test_compaction_keeps_late_events(self):
+        """An old event that commits during the fold is not lost."""
+        self.vote(self.alice, self.tea)
+        self.vote(self.bob, self.tea)
+        self.vote(self.alice, self.coffee)
+        late = VoteEvent.objects.get(user=self.bob)
+        late.delete()
+
+        def commit_late_event(*args, **kwargs):
+            # Stands in for a transaction that took an id below the cutoff
+            # and commits between the fold and the delete.
+            late.save()
+            return upsert(*args, **kwargs)
+
+        upsert = events.upsert
+        with mock.patch.object(events, 'upsert', commit_late_event):
+            compacted = compact_events(timezone.now() + datetime.timedelta(seconds=1))
+        self.assertEqual(compacted, 2)
+        self.assertEqual(self.history(), [("bob", "cast", "Tea")])
+
+    def test_replay_command(self):
+        """replay_votes --dry-run reports without changing votes."""
+        self.vote(self.alice, self.tea)
+        Vote.objects.all().delete()
+        out = StringIO()
+        call_command('replay_votes', str(self.question.id), '--dry-run',
+                     stdout=out)
+        self.assertIn("1 vote(s) created", out.getvalue())
+        self.assertFalse(Vote.objects.exists())
+        call_command('replay_votes', stdout=out)
+        self.assertTrue(Vote.objects.filter(user=self.alice).exists())
@@ -0,0 +1,157 @@
+"""
+Tests for finalizing closed polls.
+
+This module contains test cases for polls.finalize, the finalize_polls
+management command and the pages that serve frozen results.
+"""
+import datetime
+from io import StringIO
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from polls.finalize import finalize_closed, finalize_question
+from polls.ingest import enqueue_vote
+from polls.models import (Ballot, BallotChoice, Choice, FinalResult,
+                          PendingVote, Question, Vote)
+from polls.tally import tally_question
+
+
+class FinalizeTest(TestCase):
+    """Test cases for freezing the results of closed polls."""
+
+    def setUp(self):
+        """Create a closed poll and an open one, each with votes."""
+        cache.clear()
+        self.users = [User.objects.create_user(username=f"user{n}")
+                      for n in range(3)]
+        now = timezone.now()
+        self.closed = Question.objects.create(
+            question_text="Closed", pub_date=now - datetime.timedelta(days=2),
+            end_date=now - datetime.timedelta(hours=1))
+        self.open = Question.objects.create(
+            question_text="Open", pub_date=now - datetime.timedelta(days=2),
+            end_date=now + datetime.timedelta(days=1))
+        self.yes = Choice.objects.create(question=self.closed, choice_text="Yes")
+        self.no = Choice.objects.create(question=self.closed, choice_text="No")
+        Choice.objects.create(question=self.open, choice_text="Maybe")
+        for user in self.users[:2]:
+            Vote.objects.create(user=user, choice=self.yes)
+        Vote.objects.create(user=self.users[2], choice=self.no)
+
+    def test_finalize_closed(self):
+        """Only closed polls are finalized, with one row per choice."""
+        self.assertEqual(finalize_closed(), 1)
+        self.closed.refresh_from_db()
+        self.open.refresh_from_db()
+        self.assertIsNotNone(self.closed.finalized_at)
+        self.assertIsNone(self.open.finalized_at)
+        self.assertEqual(
+            list(FinalResult.objects.order_by('choice_id').values_list(
+                'choice_text', 'votes', 'winner')),
+            [("Yes", 2, True), ("No", 1, False)])
+
+    def test_finalize_once(self):
+        """A finalized poll is not finalized again."""
+        finalize_closed()
+        self.assertEqual(finalize_closed(), 0)
+        self.assertFalse(finalize_question(self.closed))
+        self.assertEqual(FinalResult.objects.count(), 2)
+
+    def test_queued_votes_counted(self):
+        """Votes still in the ingestion queue are applied and counted."""
+        enqueue_vote(self.users[0], self.closed, self.no)
+        enqueue_vote(self.users[1], self.closed, self.no)
+        PendingVote.objects.update(
+            queued_at=self.closed.end_date - datetime.timedelta(minutes=1))
+        finalize_question(self.closed)
+        self.assertFalse(PendingVote.objects.exists())
+        self.assertEqual(
+            list(FinalResult.objects.order_by('choice_id').values_list(
+                'choice_text', 'votes', 'winner')),
+            [("Yes", 0, False), ("No", 3, True)])
+
+    def test_results_served_from_snapshot(self):
+        """The results page of a finalized poll does not count votes."""
+        finalize_closed()
+        Vote.objects.create(user=self.users[0], choice=self.no)
+        url = reverse('polls:results', args=(self.closed.id,))
+        with self.assertNumQueries(2):
+            # The question and its frozen results.
+            response = self.client.get(url)
+        self.assertContains(response, "<strong>Yes</strong>")
+        self.assertContains(response, "<td>1</td>")
+
+    def test_results_page_finalizes(self):
+        """Viewing the results of a closed poll finalizes it."""
+        self.client.get(reverse('polls:results', args=(self.closed.id,)))
+        self.closed.refresh_from_db()
+        self.assertIsNotNone(self.closed.finalized_at)
+
+    def test_index_shows_winner(self):
+        """The index shows the winner of a finalized poll."""
+        finalize_closed()
+        response = self.client.get(reverse('polls:index'))
+        self.assertContains(response, "Final result: Yes")
+
+    def test_reopen_invalidates_snapshot(self):
+        """Moving the end_date into the future deletes the frozen results."""
+        finalize_closed()
+        self.closed.refresh_from_db()
+        self.closed.end_date = timezone.now() + datetime.timedelta(days=1)
+        self.closed.save()
+        self.closed.refresh_from_db()
+        self.assertIsNone(self.closed.finalized_at)
+        self.assertFalse(FinalResult.objects.exists())
+
+    def test_edit_closed_poll_keeps_snapshot(self):
+        """Editing a poll that stays closed keeps its frozen results."""
+        finalize_closed()
+        self.closed.refresh_from_db()
+        self.closed.question_text = "Still closed"
+        self.closed.save()
+        self.assertEqual(FinalResult.objects.count(), 2)
+
+    def test_ranked_poll(self):
+        """Ranked polls keep every instant-runoff round."""
+        ranked = Question.objects.create(
+            question_text="Ranked", poll_type=Question.PollType.RANKED,
+            pub_date=self.closed.pub_date, end_date=self.closed.end_date)
+        a, b, c = [Choice.objects.create(question=ranked, choice_text=text)
+                   for text in "ABC"]
+        for user, ranking in zip(self.users, [[a, b], [b], [c, b]]):
+            ballot = Ballot.objects.create(question=ranked, user=user)
+            BallotChoice.objects.bulk_create(
+                BallotChoice(ballot=ballot, choice=choice, rank=rank)
+                for rank, choice in enumerate(ranking, start=1))
+        finalize_question(ranked)
+        results = {result.choice_text: result
+                   for result in ranked.final_results.all()}
+        self.assertEqual(results["B"].rounds, [1, 2])
+        self.assertEqual(results["B"].votes, 2)
+        self.assertTrue(results["B"].winner)
+        self.assertEqual(results["C"].rounds, [1, None])
+        self.assertEqual(results["C"].votes, 1)
+
+    def test_cached_tally_not_frozen(self):
+        """The frozen results are counted afresh, not read from the cache."""
+        approval = Question.objects.create(
+            question_text="Approval", poll_type=Question.PollType.APPROVAL,
+            pub_date=self.closed.pub_date, end_date=self.closed.end_date)
+        choice = Choice.objects.create(question=approval, choice_text="A")
+        self.assertEqual(tally_question(approval)['counts'], [0])
+        ballot = Ballot.objects.create(question=approval, user=self.users[0])
+        BallotChoice.objects.create(ballot=ballot, choice=choice, rank=1)
+        finalize_question(approval)
+        self.assertEqual(approval.final_results.get().votes, 1)
+
+    def test_command(self):
+        """The command reports the polls it finalized."""
+        out = StringIO()
+        call_command('finalize_polls', '--dry-run', stdout=out)
+        self.assertIn("1 poll(s) to finalize.", out.getvalue())
+        self.assertFalse(FinalResult.objects.exists())
+        call_command('finalize_polls', stdout=out)
+        self.assertIn("Finalized 1 poll(s).", out.getvalue())
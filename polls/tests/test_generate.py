@@ -0,0 +1,82 @@
+"""
+Tests for the generate_polls management command.
+
+This module contains test cases for the shape and reproducibility of the
+generated load test data.
+"""
+from io import StringIO
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db.models import Count
+from django.test import TestCase
+from django.utils import timezone
+from polls.models import Choice, Question, Vote
+from polls.reconcile import find_drift
+
+
+def generate(*args):
+    """Run generate_polls with a small data set."""
+    call_command('generate_polls', '--users', '40', '--polls', '15',
+                 '--votes', '200', *args, stdout=StringIO())
+
+
+class GeneratePollsTest(TestCase):
+    """Test cases for the generate_polls command."""
+
+    def test_creates_requested_objects(self):
+        """The requested numbers of users and polls are created."""
+        generate()
+        self.assertEqual(User.objects.count(), 40)
+        self.assertEqual(Question.objects.count(), 15)
+        self.assertTrue(Vote.objects.exists())
+
+    def test_one_vote_per_user_per_poll(self):
+        """No user votes twice in the same poll."""
+        generate('--hot-skew', '3')
+        duplicates = Vote.objects.values('user', 'choice__question').annotate(
+            n=Count('id')).filter(n__gt=1)
+        self.assertFalse(duplicates.exists())
+
+    def test_vote_counts_match_votes(self):
+        """Every choice's vote_count equals its number of votes."""
+        generate()
+        self.assertEqual(find_drift(), [])
+        self.assertEqual(sum(Choice.objects.values_list('vote_count', flat=True)),
+                         Vote.objects.count())
+
+    def test_future_polls_get_no_votes(self):
+        """Polls that are not published yet have no votes."""
+        generate('--future-fraction', '0.5')
+        future = Question.objects.filter(pub_date__gt=timezone.now())
+        self.assertTrue(future.exists())
+        self.assertFalse(Vote.objects.filter(choice__question__in=future).exists())
+
+    def test_closed_polls(self):
+        """The closed fraction controls how many polls have ended."""
+        generate('--closed-fraction', '1', '--future-fraction', '0')
+        self.assertFalse(any(q.can_vote() for q in Question.objects.all()))
+
+    def test_shared_password_hash(self):
+        """All generated users share one password hash that works."""
+        generate('--password', 'secret123')
+        self.assertEqual(User.objects.values('password').distinct().count(), 1)
+        self.assertTrue(User.objects.first().check_password('secret123'))
+
+    def test_same_seed_same_data(self):
+        """Two runs with the same seed produce the same votes."""
+        def shape():
+            return list(Choice.objects.order_by('id').values_list('vote_count', flat=True))
+
+        generate('--seed', '7')
+        first = shape()
+        Question.objects.all().delete()
+        User.objects.all().delete()
+        generate('--seed', '7')
+        self.assertEqual(shape(), first)
+
+    def test_existing_prefix_is_refused(self):
+        """The command refuses to reuse a username prefix."""
+        User.objects.create_user(username='loadtest0')
+        with self.assertRaises(CommandError):
+            generate()
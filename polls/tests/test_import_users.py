@@ -0,0 +1,85 @@
+"""
+Tests for the import_users management command.
+
+This module contains test cases for creating users from a CSV roster.
+"""
+import os
+import tempfile
+from io import StringIO
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase, override_settings
+
+FAST_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class ImportUsersTest(TestCase):
+    """Test cases for the import_users command."""
+
+    def write_roster(self, text):
+        """Write a CSV roster to a temporary file and return its path."""
+        handle, path = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(handle, 'w') as roster:
+            roster.write(text)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def import_users(self, text, *args):
+        """Run import_users on a roster and return its output."""
+        out = StringIO()
+        call_command('import_users', self.write_roster(text), *args,
+                     stdout=out, stderr=StringIO())
+        return out.getvalue()
+
+    def test_creates_users(self):
+        """Every row becomes a user with a working password."""
+        self.import_users("username,password,email\n"
+                          "alice,wonderland1,alice@example.com\n"
+                          "bob,builder22,\n", '--workers', '1')
+        alice = User.objects.get(username="alice")
+        self.assertEqual(alice.email, "alice@example.com")
+        self.assertTrue(alice.check_password("wonderland1"))
+        self.assertTrue(User.objects.get(username="bob").check_password("builder22"))
+
+    def test_process_pool(self):
+        """Passwords hashed by worker processes are valid."""
+        rows = "".join(f"student{n},pass{n}\n" for n in range(25))
+        output = self.import_users("username,password\n" + rows,
+                                   '--workers', '2', '--batch-size', '10')
+        self.assertIn("Created 25 user(s)", output)
+        self.assertTrue(User.objects.get(username="student7").check_password("pass7"))
+
+    def test_skips_existing_and_duplicates(self):
+        """Existing usernames and repeated rows are skipped."""
+        User.objects.create_user(username="alice", password="original1")
+        output = self.import_users("username,password\n"
+                                   "alice,changed1\ncarol,x\ncarol,y\n",
+                                   '--workers', '1')
+        self.assertIn("skipped 2 existing", output)
+        self.assertTrue(User.objects.get(username="alice").check_password("original1"))
+        self.assertTrue(User.objects.get(username="carol").check_password("x"))
+
+    def test_duplicates_across_batches(self):
+        """A username repeated in the next batch is skipped on insert."""
+        output = self.import_users("username,password\n"
+                                   "carol,x\ncarol,y\nerin,z\n",
+                                   '--workers', '1', '--batch-size', '1')
+        self.assertIn("Created 2 user(s)", output)
+        self.assertIn("skipped 1 existing", output)
+        self.assertTrue(User.objects.get(username="carol").check_password("x"))
+        self.assertTrue(User.objects.filter(username="erin").exists())
+
+    def test_invalid_rows(self):
+        """Rows with invalid usernames are reported and skipped."""
+        output = self.import_users("username,password\n"
+                                   ",nopass\nbad name,x\ndave,\n",
+                                   '--workers', '1')
+        self.assertIn("2 invalid row(s)", output)
+        self.assertFalse(User.objects.get(username="dave").has_usable_password())
+
+    def test_missing_username_column(self):
+        """A roster without a username column is rejected."""
+        with self.assertRaises(CommandError):
+            self.import_users("name,password\nalice,x\n")
@@ -0,0 +1,147 @@
+"""
+Tests for the vote ingestion queue.
+
+This module contains test cases for queueing votes in vote(), applying
+them with polls.ingest and the ingest_votes management command.
+"""
+import datetime
+from io import StringIO
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from polls import metrics
+from polls.ingest import apply_batch, enqueue_vote, update_queue_depth
+from polls.models import Choice, PendingVote, Question, Vote
+from polls.reconcile import find_drift
+
+
+@override_settings(POLLS_VOTE_QUEUE=True)
+class VoteQueueTest(TestCase):
+    """Test cases for queued votes."""
+
+    def setUp(self):
+        """Create a poll with two choices and three users."""
+        cache.clear()
+        self.users = [User.objects.create_user(username=f"user{n}",
+                                               password="secret123")
+                      for n in range(3)]
+        self.question = Question.objects.create(question_text="Tea or coffee?")
+        self.tea = Choice.objects.create(question=self.question,
+                                         choice_text="Tea")
+        self.coffee = Choice.objects.create(question=self.question,
+                                            choice_text="Coffee")
+
+    def post_vote(self, choice):
+        """Vote for ``choice`` as the logged in user."""
+        return self.client.post(
+            reverse('polls:vote', args=(self.question.id,)),
+            {'choice': choice.id}, follow=True)
+
+    def test_vote_is_queued(self):
+        """A vote is queued instead of applied during the request."""
+        self.client.force_login(self.users[0])
+        response = self.post_vote(self.tea)
+        self.assertContains(response, "You voted for Tea.")
+        self.assertEqual(PendingVote.objects.count(), 1)
+        self.assertFalse(Vote.objects.exists())
+
+    def test_own_vote_shown_before_applied(self):
+        """The user's pages show the queued vote right away."""
+        self.client.force_login(self.users[0])
+        self.post_vote(self.tea)
+        response = self.post_vote(self.coffee)
+        self.assertContains(response, "Your vote was changed to Coffee.")
+        response = self.client.get(reverse('polls:index'))
+        self.assertContains(response, "You chose Coffee")
+        response = self.client.get(reverse('polls:detail',
+                                           args=(self.question.id,)))
+        self.assertEqual(response.context['previous_choice'], self.coffee)
+
+    def test_apply_batch(self):
+        """Applying the queue creates the votes and counts them."""
+        for user in self.users:
+            enqueue_vote(user, self.question, self.tea)
+        self.assertEqual(apply_batch(100), 3)
+        self.assertEqual(apply_batch(100), 0)
+        self.tea.refresh_from_db()
+        self.assertEqual(self.tea.vote_count, 3)
+        self.assertEqual(Vote.objects.filter(choice=self.tea).count(), 3)
+        self.assertFalse(PendingVote.objects.exists())
+        self.assertEqual(find_drift(), [])
+
+    def test_last_write_wins(self):
+        """Only the newest queued vote of a user in a poll is applied."""
+        enqueue_vote(self.users[0], self.question, self.tea)
+        enqueue_vote(self.users[0], self.question, self.coffee)
+        enqueue_vote(self.users[0], self.question, self.tea)
+        apply_batch(100)
+        vote = Vote.objects.get(user=self.users[0])
+        self.assertEqual(vote.choice, self.tea)
+        self.assertEqual(metrics.get('vote_queue_superseded'), 2)
+        self.assertEqual(find_drift(), [])
+
+    def test_last_write_wins_across_batches(self):
+        """A later batch moves a vote applied by an earlier one."""
+        existing = Vote.objects.create(user=self.users[1], choice=self.coffee)
+        Choice.objects.filter(pk=self.coffee.pk).update(vote_count=1)
+        enqueue_vote(self.users[1], self.question, self.tea)
+        enqueue_vote(self.users[2], self.question, self.tea)
+        enqueue_vote(self.users[1], self.question, self.coffee)
+        apply_batch(2)
+        apply_batch(2)
+        existing.refresh_from_db()
+        self.assertEqual(existing.choice, self.coffee)
+        self.assertEqual(Vote.objects.count(), 2)
+        self.assertEqual(find_drift(), [])
+
+    def test_closed_poll(self):
+        """Votes queued before the poll closed count; later ones are dropped."""
+        end_date = timezone.now()
+        early = enqueue_vote(self.users[0], self.question, self.tea)
+        late = enqueue_vote(self.users[1], self.question, self.tea)
+        PendingVote.objects.filter(pk=early.pk).update(
+            queued_at=end_date - datetime.timedelta(minutes=1))
+        PendingVote.objects.filter(pk=late.pk).update(
+            queued_at=end_date + datetime.timedelta(minutes=1))
+        self.question.end_date = end_date
+        self.question.save()
+        self.assertEqual(apply_batch(100), 2)
+        self.assertEqual(list(Vote.objects.values_list('user', flat=True)),
+                         [self.users[0].id])
+        self.assertEqual(metrics.get('vote_queue_rejected'), 1)
+        self.assertEqual(find_drift(), [])
+
+    def test_finalized_poll(self):
+        """Votes queued in a finalized poll are dropped."""
+        enqueue_vote(self.users[0], self.question, self.tea)
+        Question.objects.filter(pk=self.question.pk).update(
+            finalized_at=timezone.now())
+        self.assertEqual(apply_batch(100), 1)
+        self.assertFalse(Vote.objects.exists())
+        self.assertFalse(PendingVote.objects.exists())
+        self.assertEqual(metrics.get('vote_queue_rejected'), 1)
+
+    def test_metrics(self):
+        """Queue depth and apply lag are recorded."""
+        enqueue_vote(self.users[0], self.question, self.tea)
+        enqueue_vote(self.users[1], self.question, self.tea)
+        self.assertEqual(update_queue_depth(), 2)
+        self.assertEqual(metrics.get('vote_queue_enqueued'), 2)
+        apply_batch(1)
+        self.assertEqual(update_queue_depth(), 1)
+        self.assertEqual(metrics.get('vote_queue_depth'), 1)
+        self.assertGreaterEqual(metrics.get('vote_queue_apply_lag_seconds'), 0)
+        self.assertEqual(metrics.get('vote_queue_applied'), 1)
+
+    def test_command_drains_queue(self):
+        """ingest_votes --once applies everything and exits."""
+        for user in self.users:
+            enqueue_vote(user, self.question, self.coffee)
+        out = StringIO()
+        call_command('ingest_votes', '--once', '--batch-size', '2', stdout=out)
+        self.assertIn("Applied 3 queued vote(s).", out.getvalue())
+        self.assertEqual(Vote.objects.count(), 3)
+        self.assertEqual(metrics.get('vote_queue_depth'), 0)
@@ -0,0 +1,126 @@
+"""
+Tests for the "My votes" page.
+
+This module contains test cases for the lists of the current user's votes
+and ballots and their keyset pagination.
+"""
+import datetime
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from polls.models import Ballot, BallotChoice, Choice, Question, Vote
+
+
+class MyVotesViewTest(TestCase):
+    """Test cases for the MyVotesView."""
+
+    def setUp(self):
+        """Create a user who voted in a few polls."""
+        self.user = User.objects.create_user(username="voter")
+        self.votes = []
+        for n in range(3):
+            question = Question.objects.create(question_text=f"Poll {n}")
+            choice = Choice.objects.create(question=question,
+                                           choice_text=f"Choice {n}")
+            self.votes.append(Vote.objects.create(user=self.user, choice=choice))
+        self.url = reverse('polls:my_votes')
+
+    def test_login_required(self):
+        """Anonymous visitors are sent to the login page."""
+        response = self.client.get(self.url)
+        self.assertRedirects(response, f"{reverse('login')}?next={self.url}")
+
+    def test_lists_own_votes_newest_first(self):
+        """The user's votes are listed newest first."""
+        other = User.objects.create_user(username="other")
+        Vote.objects.create(user=other, choice=self.votes[0].choice)
+        self.client.force_login(self.user)
+        response = self.client.get(self.url)
+        self.assertEqual(response.context['vote_list'], self.votes[::-1])
+        self.assertContains(response, "Choice 2")
+        self.assertIsNone(response.context['next_before'])
+
+    def test_closed_status(self):
+        """Each vote shows whether its poll is still open."""
+        question = self.votes[0].choice.question
+        question.end_date = timezone.now() - datetime.timedelta(days=1)
+        question.save()
+        self.client.force_login(self.user)
+        response = self.client.get(self.url)
+        self.assertContains(response, "Closed")
+        self.assertContains(response, "Open", count=2)
+
+    def test_no_votes(self):
+        """A user without votes is told so."""
+        self.client.force_login(User.objects.create_user(username="new"))
+        response = self.client.get(self.url)
+        self.assertContains(response, "You haven't voted in any polls yet.")
+
+    def test_keyset_pagination(self):
+        """Following the `before` links visits every vote once."""
+        for n in range(45):
+            question = Question.objects.create(question_text=f"Extra {n}")
+            choice = Choice.objects.create(question=question, choice_text="Yes")
+            self.votes.append(Vote.objects.create(user=self.user, choice=choice))
+        self.client.force_login(self.user)
+        seen = []
+        params = {}
+        while True:
+            response = self.client.get(self.url, params)
+            seen.extend(response.context['vote_list'])
+            if response.context['next_before'] is None:
+                break
+            params = {'before': response.context['next_before']}
+        self.assertEqual(seen, self.votes[::-1])
+
+    def test_deep_page_query_count(self):
+        """Any page is one query after the session and user are loaded."""
+        self.client.force_login(self.user)
+        with self.assertNumQueries(3):
+            self.client.get(self.url, {'before': self.votes[1].id})
+
+    def test_lists_ballots(self):
+        """Ballots are listed with their choices in preference order."""
+        question = Question.objects.create(question_text="Ranked",
+                                           poll_type=Question.PollType.RANKED)
+        first, second = [Choice.objects.create(question=question, choice_text=text)
+                         for text in ("Python", "Go")]
+        ballot = Ballot.objects.create(question=question, user=self.user)
+        BallotChoice.objects.create(ballot=ballot, choice=second, rank=1)
+        BallotChoice.objects.create(ballot=ballot, choice=first, rank=2)
+        self.client.force_login(self.user)
+        response = self.client.get(self.url)
+        self.assertEqual(response.context['ballot_list'], [ballot])
+        self.assertContains(response, "Go, Python")
+        self.assertEqual(len(response.context['vote_list']), 3)
+
+    def test_only_ballots(self):
+        """A user who only cast ballots is not told they never voted."""
+        user = User.objects.create_user(username="ranker")
+        question = Question.objects.create(question_text="Approval",
+                                           poll_type=Question.PollType.APPROVAL)
+        choice = Choice.objects.create(question=question, choice_text="Yes")
+        ballot = Ballot.objects.create(question=question, user=user)
+        BallotChoice.objects.create(ballot=ballot, choice=choice, rank=1)
+        self.client.force_login(user)
+        response = self.client.get(self.url)
+        self.assertContains(response, "Approval")
+        self.assertNotContains(response, "You haven't voted in any polls yet.")
+
+    def test_ballot_pagination(self):
+        """Following the `ballots_before` links visits every ballot once."""
+        ballots = []
+        for n in range(25):
+            question = Question.objects.create(
+                question_text=f"Ranked {n}", poll_type=Question.PollType.RANKED)
+            ballots.append(Ballot.objects.create(question=question, user=self.user))
+        self.client.force_login(self.user)
+        response = self.client.get(self.url)
+        seen = list(response.context['ballot_list'])
+        response = self.client.get(
+            self.url, {'ballots_before': response.context['next_ballots_before']})
+        seen.extend(response.context['ballot_list'])
+        self.assertEqual(seen, ballots[::-1])
+        self.assertIsNone(response.context['next_ballots_before'])
+        self.assertEqual(response.context['vote_list'], [])
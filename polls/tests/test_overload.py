@@ -0,0 +1,120 @@
+"""
+Tests for the overload protection.
+
+This module contains test cases for OverloadMiddleware admitting,
+queueing and shedding requests by priority.
+"""
+import threading
+import time
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from django.urls import reverse
+from polls import metrics
+from polls.overload import OverloadMiddleware
+
+
+@override_settings(POLLS_MAX_CONCURRENT_REQUESTS=1,
+                   POLLS_OVERLOAD_QUEUE_TIMEOUT=5,
+                   POLLS_OVERLOAD_RETRY_AFTER=7,
+                   POLLS_REQUEST_LIMITS={})
+class OverloadMiddlewareTest(SimpleTestCase):
+    """Test cases for limiting concurrent requests."""
+
+    def setUp(self):
+        """Create a middleware whose views block until released."""
+        cache.clear()
+        self.factory = RequestFactory()
+        self.release = threading.Event()
+        self.started = []
+        self.order = []
+        self.middleware = OverloadMiddleware(self.view)
+        self.threads = []
+
+    def tearDown(self):
+        """Let every blocked request finish."""
+        self.release.set()
+        for thread in self.threads:
+            thread.join()
+
+    def view(self, request):
+        """Block the first request until released; record the others."""
+        self.order.append(request.path)
+        if len(self.order) == 1:
+            self.started.append(request.path)
+            self.release.wait()
+        return HttpResponse("OK")
+
+    def request(self, method, name, responses=None):
+        """Send a request for ``name`` in a new thread."""
+        request = getattr(self.factory, method)(reverse(name, args=(1,)))
+
+        def run():
+            response = self.middleware(request)
+            if responses is not None:
+                responses.append(response)
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        self.threads.append(thread)
+        return thread
+
+    def fill(self):
+        """Start a request that holds the only slot."""
+        self.request('get', 'polls:detail')
+        while not self.started:
+            time.sleep(0.001)
+
+    def test_low_priority_shed(self):
+        """A results reload is shed at once with 503 and Retry-After."""
+        self.fill()
+        request = self.factory.get(reverse('polls:results', args=(1,)))
+        response = self.middleware(request)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '7')
+        self.assertEqual(metrics.get('overload_shed_low'), 1)
+        self.assertEqual(metrics.get('overload_shed:polls:results'), 1)
+
+    def test_high_priority_first(self):
+        """Queued votes are admitted before earlier normal requests."""
+        self.fill()
+        responses = []
+        self.request('get', 'polls:detail', responses)
+        time.sleep(0.05)
+        self.request('post', 'polls:vote', responses)
+        time.sleep(0.05)
+        self.release.set()
+        for thread in self.threads:
+            thread.join()
+        self.assertEqual(self.order, ['/polls/1/', '/polls/1/vote/',
+                                      '/polls/1/'])
+        self.assertEqual([response.status_code for response in responses],
+                         [200, 200])
+        self.assertEqual(metrics.get('overload_queued'), 2)
+        self.assertGreater(metrics.get('overload_queue_wait_ms_total'), 0)
+
+    @override_settings(POLLS_OVERLOAD_QUEUE_TIMEOUT=0.05)
+    def test_deadline(self):
+        """Requests still waiting at the deadline are shed."""
+        self.fill()
+        request = self.factory.post(reverse('polls:vote', args=(1,)))
+        self.assertEqual(self.middleware(request).status_code, 503)
+        self.assertEqual(metrics.get('overload_shed_high'), 1)
+
+    def test_post_never_low(self):
+        """A POST to a low priority URL waits instead of being shed."""
+        self.fill()
+        responses = []
+        self.request('post', 'polls:results', responses)
+        time.sleep(0.05)
+        self.release.set()
+        self.threads[-1].join()
+        self.assertEqual(responses[0].status_code, 200)
+
+    @override_settings(POLLS_MAX_CONCURRENT_REQUESTS=0,
+                       POLLS_REQUEST_LIMITS={'polls:detail': 1})
+    def test_url_name_limit(self):
+        """A URL name limit leaves room for other pages."""
+        self.fill()
+        request = self.factory.get(reverse('polls:index'))
+        self.assertEqual(self.middleware(request).status_code, 200)
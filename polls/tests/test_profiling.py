@@ -0,0 +1,119 @@
+"""
+Tests for the on-demand request profiling.
+
+This module contains test cases for ProfilingMiddleware and the staff
+pages that list and download the stored profiles.
+"""
+import json
+import pstats
+import tempfile
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from polls.models import Question
+from polls.profiling import list_profiles, profile_path
+
+
+class ProfilingTest(TestCase):
+    """Test cases for profiling requests."""
+
+    def setUp(self):
+        """Store profiles in a temporary directory and create users."""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(POLLS_PROFILE_DIR=directory.name,
+                                     POLLS_PROFILE_SAMPLE_RATE=0,
+                                     POLLS_PROFILE_KEEP=3)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.staff = User.objects.create_user(username="staff", is_staff=True)
+        self.student = User.objects.create_user(username="student")
+        Question.objects.create(question_text="Profiled question")
+
+    def test_header_triggers_profile(self):
+        """A staff request with X-Profile is profiled with its SQL."""
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('polls:index'), HTTP_X_PROFILE='1')
+        self.assertContains(response, "Profiled question")
+        [profile] = list_profiles()
+        self.assertEqual(profile['path'], reverse('polls:index'))
+        self.assertEqual(profile['status'], 200)
+        self.assertTrue(any('polls_question' in query['sql']
+                            for query in profile['queries']))
+        stats = pstats.Stats(str(profile_path(profile['id'], '.prof')))
+        self.assertGreater(stats.total_calls, 0)
+
+    def test_params_left_out(self):
+        """By default no parameter values are stored with the SQL."""
+        self.client.force_login(self.student)
+        session_key = self.client.session.session_key
+        with self.settings(POLLS_PROFILE_SAMPLE_RATE=1):
+            self.client.get(reverse('polls:index'))
+        [profile] = list_profiles()
+        self.assertNotIn(session_key, json.dumps(profile))
+        self.assertTrue(all('params' not in query
+                            for query in profile['queries']))
+
+    @override_settings(POLLS_PROFILE_LOG_PARAMS=True)
+    def test_params_logged(self):
+        """POLLS_PROFILE_LOG_PARAMS stores the parameters."""
+        self.client.force_login(self.student)
+        session_key = self.client.session.session_key
+        with self.settings(POLLS_PROFILE_SAMPLE_RATE=1):
+            self.client.get(reverse('polls:index'))
+        [profile] = list_profiles()
+        self.assertIn(session_key, json.dumps(profile))
+
+    def test_query_parameter_triggers_profile(self):
+        """A staff request with ?profile is profiled."""
+        self.client.force_login(self.staff)
+        self.client.get(reverse('polls:index'), {'profile': '1'})
+        self.assertEqual(len(list_profiles()), 1)
+
+    def test_students_cannot_trigger(self):
+        """Non-staff users can't trigger profiling."""
+        self.client.force_login(self.student)
+        self.client.get(reverse('polls:index'), HTTP_X_PROFILE='1')
+        self.assertEqual(list_profiles(), [])
+
+    def test_untriggered_request(self):
+        """Requests without a trigger are not profiled."""
+        self.client.force_login(self.staff)
+        self.client.get(reverse('polls:index'))
+        self.assertEqual(list_profiles(), [])
+
+    def test_sampling(self):
+        """With a sample rate of 1 every request is profiled."""
+        with self.settings(POLLS_PROFILE_SAMPLE_RATE=1):
+            self.client.get(reverse('polls:index'))
+        self.assertEqual(len(list_profiles()), 1)
+
+    def test_ring_buffer(self):
+        """Only the newest POLLS_PROFILE_KEEP profiles are kept."""
+        self.client.force_login(self.staff)
+        for page in range(5):
+            self.client.get(reverse('polls:index'), {'profile': '1', 'n': page},
+                            HTTP_X_PROFILE='1')
+        profiles = list_profiles()
+        self.assertEqual([p['path'][-1] for p in profiles], ['4', '3', '2'])
+        self.assertEqual(len(list(profile_path(0, '').parent.iterdir())), 6)
+
+    def test_profile_pages(self):
+        """Staff can list and download profiles."""
+        self.client.force_login(self.staff)
+        self.client.get(reverse('polls:index'), HTTP_X_PROFILE='1')
+        [profile] = list_profiles()
+        response = self.client.get(reverse('polls:profiles'))
+        self.assertContains(response, reverse('polls:profile_download',
+                                              args=[profile['id']]))
+        response = self.client.get(reverse('polls:profile_sql', args=[profile['id']]))
+        self.assertEqual(json.loads(b''.join(response.streaming_content))['id'],
+                         profile['id'])
+        response = self.client.get(reverse('polls:profile_download', args=[1]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_profile_pages_are_staff_only(self):
+        """Students are sent to the admin login."""
+        self.client.force_login(self.student)
+        response = self.client.get(reverse('polls:profiles'))
+        self.assertEqual(response.status_code, 302)
@@ -0,0 +1,102 @@
+"""
+Tests for the rate limiting of vote submissions.
+
+These tests use the local-memory cache, which is cleared before each test.
+"""
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from polls import metrics
+from polls.models import Choice, Question, Vote
+from polls.ratelimit import take_token
+
+LOCMEM_CACHE = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'ratelimit-tests',
+    }
+}
+
+
+@override_settings(CACHES=LOCMEM_CACHE, POLLS_VOTE_RATE_LIMIT=2,
+                   POLLS_VOTE_IP_RATE_LIMIT=5, POLLS_VOTE_RATE_PERIOD=60)
+class VoteRateLimitTest(TestCase):
+    """Test cases for the per-user and per-IP vote rate limits."""
+
+    def setUp(self):
+        """Create a user, a question with a choice, and an empty cache."""
+        cache.clear()
+        self.user = User.objects.create_user(username="voter")
+        self.question = Question.objects.create(question_text="Limited")
+        self.choice = Choice.objects.create(question=self.question,
+                                            choice_text="Yes")
+        self.vote_url = reverse('polls:vote', args=[self.question.id])
+        self.client.force_login(self.user)
+
+    def post_vote(self, **extra):
+        """Submit a vote for the choice."""
+        return self.client.post(self.vote_url, {'choice': self.choice.id},
+                                **extra)
+
+    def test_take_token(self):
+        """A bucket hands out `limit` tokens per period."""
+        self.assertEqual(take_token('test', 2, 60), 0)
+        self.assertEqual(take_token('test', 2, 60), 0)
+        retry_after = take_token('test', 2, 60)
+        self.assertGreater(retry_after, 0)
+        self.assertLessEqual(retry_after, 60)
+
+    def test_user_limit(self):
+        """Votes over the user's limit are rejected with 429."""
+        self.assertEqual(self.post_vote().status_code, 302)
+        self.assertEqual(self.post_vote().status_code, 302)
+        response = self.post_vote()
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+
+    def test_rejected_vote_is_not_counted(self):
+        """A rejected vote does not change any data."""
+        self.post_vote()
+        self.post_vote()
+        Vote.objects.all().delete()
+        self.post_vote()
+        self.assertFalse(Vote.objects.exists())
+
+    def test_rejected_before_database_work(self):
+        """A rejected vote runs no queries beyond loading the session user."""
+        self.post_vote()
+        self.post_vote()
+        with self.assertNumQueries(2):
+            self.assertEqual(self.post_vote().status_code, 429)
+
+    def test_per_poll_limit(self):
+        """A question can raise the limit for its own votes."""
+        self.question.vote_rate_limit = 4
+        self.question.save()
+        for _ in range(4):
+            self.assertEqual(self.post_vote().status_code, 302)
+        self.assertEqual(self.post_vote().status_code, 429)
+
+    def test_ip_limit(self):
+        """Users sharing an IP address share the IP limit."""
+        for n in range(5):
+            self.client.force_login(User.objects.create_user(username=f"u{n}"))
+            self.assertEqual(self.post_vote(REMOTE_ADDR='10.0.0.1').status_code, 302)
+        self.assertEqual(self.post_vote(REMOTE_ADDR='10.0.0.1').status_code, 429)
+        self.assertEqual(self.post_vote(REMOTE_ADDR='10.0.0.2').status_code, 302)
+
+    def test_user_over_limit_spares_ip_budget(self):
+        """Votes rejected by the user limit don't use the shared IP limit."""
+        for _ in range(6):
+            self.post_vote(REMOTE_ADDR='10.0.0.1')
+        for n in range(3):
+            self.client.force_login(User.objects.create_user(username=f"u{n}"))
+            self.assertEqual(self.post_vote(REMOTE_ADDR='10.0.0.1').status_code, 302)
+
+    def test_rejections_are_counted(self):
+        """Every rejected vote increments the metric."""
+        before = metrics.get('vote_rate_limited')
+        for _ in range(4):
+            self.post_vote()
+        self.assertEqual(metrics.get('vote_rate_limited'), before + 2)
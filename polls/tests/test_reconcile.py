@@ -0,0 +1,138 @@
+"""
+Tests for the vote_count reconciliation.
+
+This module contains test cases for the drift detection and repair in
+polls.reconcile and the reconcile_votes management command.
+"""
+import threading
+import time
+import unittest
+from io import StringIO
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection, connections, transaction
+from django.db.models import F
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+from django.utils import timezone
+from polls.models import Choice, DirtyQuestion, Question, Vote
+from polls.reconcile import find_drift, repair_drift
+
+
+class ReconcileTest(TestCase):
+    """Test cases for finding and repairing drifted vote counts."""
+
+    def setUp(self):
+        """Create two questions with two choices each and a few votes."""
+        self.users = [User.objects.create_user(username=f"user{n}")
+                      for n in range(3)]
+        self.question = Question.objects.create(question_text="First")
+        self.other = Question.objects.create(question_text="Second")
+        self.choice1 = Choice.objects.create(question=self.question,
+                                             choice_text="A")
+        self.choice2 = Choice.objects.create(question=self.question,
+                                             choice_text="B")
+        self.other_choice = Choice.objects.create(question=self.other,
+                                                  choice_text="C")
+        for user in self.users:
+            Vote.objects.create(user=user, choice=self.choice1)
+        Vote.objects.create(user=self.users[0], choice=self.other_choice)
+
+    def test_find_drift(self):
+        """Every choice whose vote_count is wrong is reported."""
+        drift = find_drift()
+        self.assertEqual(drift, [
+            (self.question.id, self.choice1.id, 0, 3),
+            (self.other.id, self.other_choice.id, 0, 1),
+        ])
+
+    def test_repair_drift(self):
+        """Repairing sets vote_count to the number of votes."""
+        Choice.objects.filter(pk=self.choice2.pk).update(vote_count=5)
+        self.assertEqual(repair_drift(), 3)
+        self.choice1.refresh_from_db()
+        self.choice2.refresh_from_db()
+        self.assertEqual(self.choice1.vote_count, 3)
+        self.assertEqual(self.choice2.vote_count, 0)
+        self.assertEqual(find_drift(), [])
+
+    def test_repair_limited_to_questions(self):
+        """Only the choices of the given questions are repaired."""
+        repair_drift(question_ids=[self.other.id])
+        self.other_choice.refresh_from_db()
+        self.choice1.refresh_from_db()
+        self.assertEqual(self.other_choice.vote_count, 1)
+        self.assertEqual(self.choice1.vote_count, 0)
+
+    def test_dry_run_changes_nothing(self):
+        """The dry run reports the drift without fixing it."""
+        out = StringIO()
+        call_command('reconcile_votes', '--dry-run', stdout=out)
+        self.assertIn("2 choice(s) out of sync.", out.getvalue())
+        self.assertEqual(len(find_drift()), 2)
+
+    def test_command_fixes_everything(self):
+        """Without options the command repairs every question."""
+        out = StringIO()
+        call_command('reconcile_votes', stdout=out)
+        self.assertIn("Fixed 2 choice(s).", out.getvalue())
+        self.assertEqual(find_drift(), [])
+
+    def test_dirty_only(self):
+        """With --dirty-only only marked questions are repaired."""
+        DirtyQuestion.objects.create(question=self.other)
+        call_command('reconcile_votes', '--dirty-only', stdout=StringIO())
+        self.assertEqual(find_drift(),
+                         [(self.question.id, self.choice1.id, 0, 3)])
+        self.assertFalse(DirtyQuestion.objects.exists())
+
+    def test_later_marker_survives(self):
+        """A question marked after the run started stays marked."""
+        later = timezone.now() + timezone.timedelta(minutes=1)
+        DirtyQuestion.objects.create(question=self.other, marked_at=later)
+        call_command('reconcile_votes', '--dirty-only', stdout=StringIO())
+        self.assertTrue(DirtyQuestion.objects.filter(
+            question=self.other).exists())
+
+    def test_vote_marks_question_dirty(self):
+        """Voting records a dirty marker for the question."""
+        self.client.force_login(self.users[1])
+        self.client.post(reverse('polls:vote', args=[self.other.id]),
+                         {'choice': self.other_choice.id})
+        self.assertTrue(DirtyQuestion.objects.filter(
+            question=self.other).exists())
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql',
+                     "Needs concurrent transactions with row locks.")
+class ConcurrentRepairTest(TransactionTestCase):
+    """Repair drift while a vote is being cast."""
+
+    def test_vote_in_flight_is_kept(self):
+        """A vote committed during the repair is counted, not overwritten."""
+        user = User.objects.create_user(username="voter")
+        question = Question.objects.create(question_text="Busy")
+        choice = Choice.objects.create(question=question, choice_text="A",
+                                       vote_count=5)
+        counted = threading.Event()
+
+        def vote():
+            try:
+                with transaction.atomic():
+                    Vote.objects.create(user=user, choice=choice)
+                    Choice.objects.filter(pk=choice.pk).update(
+                        vote_count=F('vote_count') + 1)
+                    counted.set()
+                    # Let the repair start while this vote is uncommitted.
+                    time.sleep(0.3)
+            finally:
+                connections.close_all()
+
+        voter = threading.Thread(target=vote)
+        voter.start()
+        counted.wait(5)
+        repair_drift()
+        voter.join()
+        choice.refresh_from_db()
+        self.assertEqual(choice.vote_count, 1)
+        self.assertEqual(find_drift(), [])
@@ -0,0 +1,214 @@
+"""
+Tests for the full-text poll search.
+
+This module contains test cases for the search index maintenance and the
+search box on the index page.
+"""
+import datetime
+from unittest import mock
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.utils import timezone
+from django.urls import reverse
+from polls.models import Question, Choice
+from polls import search
+from polls.search import search_questions
+
+
+def create_question(question_text, days):
+    """
+    Create a question with the given `question_text`.
+
+    It is published with the specified number of `days` offset from now
+    (negative for past dates, positive for future dates).
+    """
+    time = timezone.now() + datetime.timedelta(days=days)
+    return Question.objects.create(question_text=question_text, pub_date=time)
+
+
+class SearchIndexTests(TestCase):
+    """Tests that the search index follows changes to questions and choices."""
+
+    def test_question_text_is_searchable(self):
+        """A new question can be found by the words in its text."""
+        question = create_question("Best pizza topping?", days=-1)
+        results, _ = search_questions("pizza")
+        self.assertEqual(results, [question])
+
+    def test_choice_text_is_searchable(self):
+        """A question can be found by the text of its choices."""
+        question = create_question("Lunch?", days=-1)
+        Choice.objects.create(question=question, choice_text="Pad thai")
+        results, _ = search_questions("thai")
+        self.assertEqual(results, [question])
+
+    def test_edited_question_is_reindexed(self):
+        """Editing a question replaces its old words in the index."""
+        question = create_question("Favourite cat?", days=-1)
+        question.question_text = "Favourite dog?"
+        question.save()
+        self.assertEqual(search_questions("cat")[0], [])
+        self.assertEqual(search_questions("dog")[0], [question])
+
+    def test_deleted_choice_is_removed(self):
+        """A deleted choice no longer matches its question."""
+        question = create_question("Lunch?", days=-1)
+        choice = Choice.objects.create(question=question, choice_text="Sushi")
+        choice.delete()
+        self.assertEqual(search_questions("sushi")[0], [])
+
+    def test_deleted_question_is_removed(self):
+        """Deleting a question with choices removes it from the results."""
+        question = create_question("Best pizza topping?", days=-1)
+        Choice.objects.create(question=question, choice_text="Pineapple")
+        question.delete()
+        self.assertEqual(search_questions("pizza")[0], [])
+
+    def test_votes_do_not_reindex(self):
+        """Casting and changing a vote leaves the search document alone."""
+        question = create_question("Lunch?", days=-1)
+        first = Choice.objects.create(question=question, choice_text="Soup")
+        second = Choice.objects.create(question=question, choice_text="Salad")
+        self.client.force_login(User.objects.create_user(username="voter"))
+        url = reverse('polls:vote', args=(question.id,))
+        with mock.patch('polls.search.refresh_question') as refresh, \
+                mock.patch('polls.bus.publish') as publish:
+            self.client.post(url, {'choice': first.id})
+            self.client.post(url, {'choice': second.id})
+        refresh.assert_not_called()
+        publish.assert_not_called()
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.vote_count, second.vote_count), (0, 1))
+
+    def test_unpublished_question_is_not_found(self):
+        """Questions published in the future are not search results."""
+        create_question("Future pizza poll", days=5)
+        self.assertEqual(search_questions("pizza")[0], [])
+
+    def test_all_words_must_match(self):
+        """Every word of the query must occur in a result."""
+        question = create_question("Best pizza topping?", days=-1)
+        create_question("Best pasta shape?", days=-1)
+        self.assertEqual(search_questions("best pizza")[0], [question])
+
+    def test_punctuation_only_query(self):
+        """A query without any words has no results."""
+        create_question("Best pizza topping?", days=-1)
+        self.assertEqual(search_questions("?!")[0], [])
+
+
+class SearchPaginationTests(TestCase):
+    """Tests for the ranked keyset pagination of search results."""
+
+    def test_results_are_ranked(self):
+        """Questions mentioning the words more often rank higher."""
+        weak = create_question("Pizza or pasta for lunch today?", days=-1)
+        strong = create_question("Pizza pizza pizza", days=-1)
+        self.assertEqual(search_questions("pizza")[0], [strong, weak])
+
+    def test_pages_cover_all_results_once(self):
+        """Following the cursor visits every result exactly once."""
+        questions = {create_question(f"Pizza poll {n}", days=-1)
+                     for n in range(7)}
+        seen = []
+        cursor = None
+        while True:
+            page, cursor = search_questions("pizza", cursor=cursor, limit=3)
+            seen.extend(page)
+            if cursor is None:
+                break
+        self.assertEqual(len(seen), 7)
+        self.assertEqual(set(seen), questions)
+
+    def test_invalid_cursor_starts_over(self):
+        """A malformed cursor is ignored."""
+        question = create_question("Pizza poll", days=-1)
+        results, _ = search_questions("pizza", cursor="garbage")
+        self.assertEqual(results, [question])
+
+
+class FallbackSearchTests(TestCase):
+    """Tests for searching on databases without a full-text index."""
+
+    def setUp(self):
+        """Pretend to run on a database without search support."""
+        patcher = mock.patch.object(search.connection, 'vendor', 'mysql')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_question_text_matched(self):
+        """Published questions containing the text are found, newest first."""
+        older = create_question("Best PIZZA topping?", days=-2)
+        newer = create_question("Pizza or pasta?", days=-1)
+        create_question("Best pasta shape?", days=-1)
+        create_question("Future pizza poll", days=1)
+        results, cursor = search_questions("pizza")
+        self.assertEqual(results, [newer, older])
+        self.assertIsNone(cursor)
+
+    def test_pages_cover_all_results_once(self):
+        """Following the cursor visits every result exactly once."""
+        questions = [create_question(f"Pizza poll {n}", days=-1)
+                     for n in range(7)]
+        seen = []
+        cursor = None
+        while True:
+            page, cursor = search_questions("pizza", cursor=cursor, limit=3)
+            seen.extend(page)
+            if cursor is None:
+                break
+        self.assertEqual(seen, questions[::-1])
+
+    def test_choice_text_matched(self):
+        """Questions are found by the text of their choices too."""
+        question = create_question("Best topping?", days=-1)
+        Choice.objects.create(question=question, choice_text="Pineapple")
+        results, _ = search_questions("pineapple")
+        self.assertEqual(results, [question])
+
+    def test_ordered_by_publication_date(self):
+        """Pages follow the publication date, not the question id."""
+        newer = create_question("Pizza poll", days=-1)
+        older = create_question("Pizza poll", days=-3)
+        same_day = [create_question("Pizza poll", days=-2) for _ in range(2)]
+        same_day[1].pub_date = same_day[0].pub_date
+        same_day[1].save()
+        seen = []
+        cursor = None
+        while True:
+            page, cursor = search_questions("pizza", cursor=cursor, limit=1)
+            seen.extend(page)
+            if cursor is None:
+                break
+        self.assertEqual(seen, [newer, same_day[1], same_day[0], older])
+
+
+class SearchViewTests(TestCase):
+    """Tests for the search box on the index page."""
+
+    def test_search_results_on_index(self):
+        """The index page lists only the matching questions."""
+        question = create_question("Best pizza topping?", days=-1)
+        create_question("Best pasta shape?", days=-1)
+        response = self.client.get(reverse('polls:index'), {'q': 'pizza'})
+        self.assertEqual(list(response.context['question_list']), [question])
+        self.assertContains(response, 'value="pizza"')
+
+    def test_no_matches(self):
+        """A search without results says so."""
+        create_question("Best pasta shape?", days=-1)
+        response = self.client.get(reverse('polls:index'), {'q': 'pizza'})
+        self.assertContains(response, 'No polls match')
+
+    def test_next_page_link(self):
+        """A link to the next page is shown when there are more results."""
+        for n in range(25):
+            create_question(f"Pizza poll {n}", days=-1)
+        response = self.client.get(reverse('polls:index'), {'q': 'pizza'})
+        self.assertEqual(len(response.context['question_list']), 20)
+        self.assertIsNotNone(response.context['next_cursor'])
+        response = self.client.get(reverse('polls:index'), {
+            'q': 'pizza', 'after': response.context['next_cursor']})
+        self.assertEqual(len(response.context['question_list']), 5)
+        self.assertIsNone(response.context['next_cursor'])
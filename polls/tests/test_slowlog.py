@@ -0,0 +1,137 @@
+"""
+Tests for the slow-query log.
+
+This module contains test cases for fingerprinting statements, storing
+slow queries and recording them from requests.
+"""
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from polls import metrics, slowlog
+from polls.models import Question, SlowQuery
+
+
+def slow_query(sql, params=(), ms=300.0, view_name='polls:index'):
+    """Return a queued slow query entry."""
+    return {'alias': 'default', 'sql': sql, 'params': params, 'many': False,
+            'ms': ms, 'view_name': view_name, 'seen_at': timezone.now()}
+
+
+class FingerprintTest(TestCase):
+    """Test cases for normalizing statements."""
+
+    def test_values_ignored(self):
+        """Statements that differ in values share a fingerprint."""
+        first = slowlog.fingerprint(
+            'SELECT * FROM "polls_choice" WHERE "id" IN (%s, %s) AND x = 5')
+        second = slowlog.fingerprint(
+            'SELECT  * FROM "polls_choice"\nWHERE "id" IN (%s) AND x = 12')
+        self.assertEqual(first, second)
+        self.assertEqual(first[1], 'SELECT * FROM "polls_choice" '
+                                   'WHERE "id" IN (...) AND x = ?')
+
+    def test_literals_replaced(self):
+        """String literals become placeholders, identifiers are kept."""
+        _, normalized = slowlog.fingerprint(
+            "SELECT t1.id FROM polls_vote t1 WHERE name = 'it''s'")
+        self.assertEqual(normalized,
+                         'SELECT t1.id FROM polls_vote t1 WHERE name = ?')
+
+    def test_different_statements(self):
+        """Different statements get different fingerprints."""
+        self.assertNotEqual(slowlog.fingerprint('SELECT 1 FROM polls_vote'),
+                            slowlog.fingerprint('SELECT 1 FROM polls_choice'))
+
+
+@override_settings(POLLS_SLOW_QUERY_KEEP=2)
+class StoreTest(TestCase):
+    """Test cases for saving slow queries."""
+
+    def test_aggregated_by_fingerprint(self):
+        """Repeated slow statements update one row."""
+        sql = 'SELECT "id" FROM "polls_question" WHERE "id" = %s'
+        slowlog.save(slow_query(sql, (1,), ms=300))
+        slowlog.save(slow_query(sql, (2,), ms=500, view_name='polls:detail'))
+        entry = SlowQuery.objects.get()
+        self.assertEqual((entry.count, entry.total_ms, entry.max_ms),
+                         (2, 800, 500))
+        self.assertEqual(entry.average_ms(), 400)
+        self.assertEqual(entry.view_name, 'polls:detail')
+        self.assertIn('polls_question', entry.plan.lower() + entry.sql)
+        self.assertNotIn('EXPLAIN failed', entry.plan)
+
+    def test_params_redacted(self):
+        """By default no parameter or literal value is stored."""
+        sql = ('SELECT "id" FROM "auth_user" WHERE "email" = %s '
+               'AND "username" = \'admin\'')
+        slowlog.save(slow_query(sql, ('alice@example.com',)))
+        entry = SlowQuery.objects.get()
+        self.assertEqual(entry.params, '')
+        self.assertEqual(entry.sql, entry.normalized_sql)
+        stored = entry.sql + entry.plan
+        self.assertNotIn('alice@example.com', stored)
+        self.assertNotIn('admin', stored)
+
+    @override_settings(POLLS_SLOW_QUERY_LOG_PARAMS=True)
+    def test_params_logged(self):
+        """POLLS_SLOW_QUERY_LOG_PARAMS stores the statement as executed."""
+        sql = 'SELECT "id" FROM "polls_question" WHERE "id" = %s'
+        slowlog.save(slow_query(sql, (2,)))
+        entry = SlowQuery.objects.get()
+        self.assertEqual((entry.sql, entry.params), (sql, '(2,)'))
+
+    def test_oldest_dropped(self):
+        """Only the most recently seen POLLS_SLOW_QUERY_KEEP are kept."""
+        for table in ('polls_question', 'polls_choice', 'polls_vote'):
+            slowlog.save(slow_query(f'SELECT COUNT(*) FROM "{table}"'))
+        self.assertEqual(
+            sorted(SlowQuery.objects.values_list('normalized_sql', flat=True)),
+            ['SELECT COUNT(*) FROM "polls_choice"',
+             'SELECT COUNT(*) FROM "polls_vote"'])
+
+    def test_unexplainable(self):
+        """Statements other than queries and DML are stored without a plan."""
+        slowlog.save(slow_query('SAVEPOINT "s1"'))
+        self.assertEqual(SlowQuery.objects.get().plan, '')
+
+    def test_admin(self):
+        """Staff can list the slow queries in the admin."""
+        slowlog.save(slow_query('SELECT COUNT(*) FROM "polls_vote"'))
+        admin = User.objects.create_superuser(username="admin")
+        self.client.force_login(admin)
+        response = self.client.get(reverse('admin:polls_slowquery_changelist'))
+        self.assertContains(response, 'SELECT COUNT(*) FROM')
+        self.assertContains(response, 'polls:index')
+
+
+class RecordingTest(TransactionTestCase):
+    """Record the slow queries of real requests."""
+
+    def setUp(self):
+        """Create a question and empty the metrics."""
+        Question.objects.create(question_text="Slow?")
+        cache.clear()
+
+    def test_request_recorded(self):
+        """Every query counts as slow with a tiny threshold."""
+        with self.settings(POLLS_SLOW_QUERY_MS=0.0001):
+            self.assertIn(slowlog.record_slow_query,
+                          connection.execute_wrappers)
+            response = self.client.get(reverse('polls:index'))
+            slowlog.flush()
+        self.assertContains(response, "Slow?")
+        entries = SlowQuery.objects.filter(
+            normalized_sql__contains='"polls_question"', view_name='polls:index')
+        self.assertTrue(entries)
+        self.assertTrue(all(entry.plan for entry in entries))
+        self.assertEqual(metrics.get('slow_queries'),
+                         sum(SlowQuery.objects.values_list('count', flat=True)))
+
+    def test_off_by_default(self):
+        """With a threshold of 0 nothing is recorded."""
+        self.client.get(reverse('polls:index'))
+        slowlog.flush()
+        self.assertFalse(SlowQuery.objects.exists())
@@ -0,0 +1,140 @@
+"""
+Tests for the snapshot and restore management commands.
+
+This module contains test cases for writing a snapshot, restoring it and
+the vote count integrity check that runs after a restore.
+"""
+import os
+import tempfile
+from io import StringIO
+from django.contrib.auth.models import Group, Permission, User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from django.utils import timezone
+from polls.models import Choice, Question, Vote
+from polls.search import search_questions
+
+
+class SnapshotRestoreTest(TestCase):
+    """Test cases for round-tripping the database through a snapshot."""
+
+    def setUp(self):
+        """Create users, a question with choices and consistent votes."""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'snapshot.zip')
+
+        self.users = [User.objects.create_user(username=f"user{n}",
+                                               password="hackme11",
+                                               email="")
+                      for n in range(3)]
+        self.question = Question.objects.create(
+            question_text="Pizza or pasta?",
+            end_date=timezone.now() + timezone.timedelta(days=1))
+        self.pizza = Choice.objects.create(question=self.question,
+                                           choice_text="Pizza", vote_count=2)
+        self.pasta = Choice.objects.create(question=self.question,
+                                           choice_text="Pasta", vote_count=1)
+        Vote.objects.create(user=self.users[0], choice=self.pizza)
+        Vote.objects.create(user=self.users[1], choice=self.pizza)
+        Vote.objects.create(user=self.users[2], choice=self.pasta)
+
+    def snapshot(self):
+        """Write a snapshot of the current data."""
+        call_command('snapshot', self.path, stdout=StringIO())
+
+    def restore(self, *args):
+        """Restore the snapshot."""
+        call_command('restore', self.path, *args, stdout=StringIO())
+
+    def test_round_trip(self):
+        """Restoring a snapshot brings back the data as it was."""
+        self.snapshot()
+        Vote.objects.all().delete()
+        self.question.delete()
+        User.objects.filter(username="user0").delete()
+        Question.objects.create(question_text="Added after the snapshot")
+
+        self.restore()
+        question = Question.objects.get()
+        self.assertEqual(question.question_text, "Pizza or pasta?")
+        self.assertEqual(question.end_date, self.question.end_date)
+        self.assertEqual(question.vote_rate_limit, None)
+        self.assertEqual(
+            list(Choice.objects.order_by('id').values_list('choice_text', 'vote_count')),
+            [("Pizza", 2), ("Pasta", 1)])
+        self.assertEqual(Vote.objects.count(), 3)
+        self.assertTrue(User.objects.get(username="user0").check_password("hackme11"))
+        self.assertEqual(User.objects.get(username="user1").email, "")
+
+    def test_permissions_restored(self):
+        """User and group permissions survive a restore."""
+        add_question = Permission.objects.get(codename='add_question')
+        change_choice = Permission.objects.get(codename='change_choice')
+        group = Group.objects.create(name="Teachers")
+        group.permissions.add(add_question)
+        self.users[0].groups.add(group)
+        self.users[1].user_permissions.add(change_choice)
+        self.snapshot()
+        group.permissions.clear()
+        self.users[1].user_permissions.clear()
+        self.users[2].user_permissions.add(add_question)
+
+        self.restore()
+        self.assertEqual(list(Group.objects.get().permissions.all()),
+                         [add_question])
+        self.assertEqual(list(User.objects.get(username="user1")
+                              .user_permissions.all()), [change_choice])
+        self.assertFalse(User.objects.get(username="user2")
+                         .user_permissions.exists())
+        self.assertTrue(User.objects.get(username="user0")
+                        .has_perm('polls.add_question'))
+
+    def test_unknown_permission_skipped(self):
+        """Permissions this database does not have are skipped."""
+        permission = Permission.objects.get(codename='add_question')
+        self.users[0].user_permissions.add(permission)
+        self.snapshot()
+        Permission.objects.filter(pk=permission.pk).update(codename='renamed')
+        out = StringIO()
+        call_command('restore', self.path, stdout=out)
+        self.assertIn("Skipped 1 permission(s)", out.getvalue())
+        self.assertFalse(User.user_permissions.through.objects.exists())
+
+    def test_search_index_restored(self):
+        """Restored questions can be searched."""
+        self.snapshot()
+        self.restore()
+        self.assertEqual([q.id for q in search_questions("pasta")[0]],
+                         [self.question.id])
+
+    def test_sequences_reset(self):
+        """New rows get ids after the restored ones."""
+        self.snapshot()
+        restored_id = self.question.id
+        self.question.delete()
+        self.restore()
+        question = Question.objects.create(question_text="New")
+        self.assertGreater(question.id, restored_id)
+
+    def test_drifted_snapshot_is_rejected(self):
+        """A snapshot whose vote counts disagree with its votes is not restored."""
+        Choice.objects.filter(pk=self.pasta.pk).update(vote_count=7)
+        self.snapshot()
+        Question.objects.create(question_text="Kept")
+        with self.assertRaises(CommandError):
+            self.restore()
+        self.assertTrue(Question.objects.filter(question_text="Kept").exists())
+
+    def test_drifted_snapshot_is_repaired(self):
+        """With --repair-counts drifted vote counts are fixed."""
+        Choice.objects.filter(pk=self.pasta.pk).update(vote_count=7)
+        self.snapshot()
+        self.restore('--repair-counts')
+        self.assertEqual(Choice.objects.get(pk=self.pasta.pk).vote_count, 1)
+
+    def test_missing_file(self):
+        """Restoring a file that doesn't exist fails cleanly."""
+        with self.assertRaises(CommandError):
+            self.restore()
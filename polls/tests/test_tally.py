@@ -0,0 +1,228 @@
+"""
+Tests for approval and ranked-choice polls.
+
+This module contains test cases for the tally engine in polls.tally and
+for casting ballots through the vote view.
+"""
+import random
+from array import array
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from unittest import mock
+from django.test import TestCase
+from django.urls import reverse
+from polls import tally
+from polls.models import Ballot, BallotChoice, Choice, Question
+from polls.tally import approval_counts, instant_runoff, tally_question
+
+
+def make_ballots(ballots):
+    """Return the offsets and prefs arrays of a list of rankings."""
+    offsets = array('l', [0])
+    prefs = array('i')
+    for ranking in ballots:
+        prefs.extend(ranking)
+        offsets.append(len(prefs))
+    return offsets, prefs
+
+
+def naive_runoff(num_candidates, ballots):
+    """Recount every ballot each round, the slow and obvious way."""
+    active = set(range(num_candidates))
+    first_round = None
+    while True:
+        counts = [0] * num_candidates
+        for ranking in ballots:
+            top = next((c for c in ranking if c in active), None)
+            if top is not None:
+                counts[top] += 1
+        if first_round is None:
+            first_round = counts
+        live = sum(counts[c] for c in active)
+        if not live:
+            return None
+        leader = max(active, key=lambda c: (counts[c], -c))
+        if counts[leader] * 2 > live or len(active) == 1:
+            return leader
+        active.discard(min(active, key=lambda c: (counts[c], first_round[c], -c)))
+
+
+class InstantRunoffTest(TestCase):
+    """Test cases for counting ranked ballots."""
+
+    def test_majority_in_first_round(self):
+        """A candidate with a first-round majority wins at once."""
+        result = instant_runoff(3, *make_ballots(
+            [[0], [0, 1], [0], [1], [2, 0]]))
+        self.assertEqual(result['rounds'], [[3, 1, 1]])
+        self.assertEqual(result['winner'], 0)
+
+    def test_transfers(self):
+        """Ballots of eliminated candidates move to their next preference."""
+        ballots = [[0, 1]] * 4 + [[1, 0]] * 3 + [[2, 1]] * 2
+        result = instant_runoff(3, *make_ballots(ballots))
+        self.assertEqual(result['rounds'], [[4, 3, 2], [4, 5, None]])
+        self.assertEqual(result['eliminated'], [2])
+        self.assertEqual(result['winner'], 1)
+
+    def test_skips_eliminated_preferences(self):
+        """A transfer passes over candidates that are already out."""
+        ballots = [[0]] * 5 + [[1]] * 4 + [[2, 3, 1]] * 2 + [[3, 2, 1]]
+        result = instant_runoff(4, *make_ballots(ballots))
+        self.assertEqual(result['eliminated'], [3, 2])
+        self.assertEqual(result['rounds'][-1], [5, 7, None, None])
+        self.assertEqual(result['winner'], 1)
+
+    def test_exhausted_ballots(self):
+        """Ballots with no preference left stop counting toward a majority."""
+        ballots = [[0]] * 3 + [[1]] * 2 + [[2]] * 2
+        result = instant_runoff(3, *make_ballots(ballots))
+        self.assertEqual(result['rounds'], [[3, 2, 2], [3, 2, None]])
+        self.assertEqual(result['winner'], 0)
+
+    def test_tie_broken_by_first_round(self):
+        """A tie for last place eliminates the weaker first-round candidate."""
+        ballots = [[0]] * 3 + [[1]] * 2 + [[2, 1]] * 2 + [[3, 2]]
+        result = instant_runoff(4, *make_ballots(ballots))
+        self.assertEqual(result['eliminated'][:2], [3, 1])
+
+    def test_no_ballots(self):
+        """Without ballots there is no winner."""
+        result = instant_runoff(2, *make_ballots([]))
+        self.assertEqual(result['rounds'], [[0, 0]])
+        self.assertIsNone(result['winner'])
+
+    def test_matches_naive_count(self):
+        """Random elections give the same winner as recounting every round."""
+        rng = random.Random(7)
+        for _ in range(50):
+            candidates = rng.randint(2, 7)
+            ballots = [rng.sample(range(candidates), rng.randint(0, candidates))
+                       for _ in range(rng.randint(1, 60))]
+            result = instant_runoff(candidates, *make_ballots(ballots))
+            self.assertEqual(result['winner'], naive_runoff(candidates, ballots))
+
+    def test_large_election(self):
+        """A hundred thousand ballots are counted in memory."""
+        rng = random.Random(1)
+        candidates = 10
+        ballots = [rng.sample(range(candidates), rng.randint(1, candidates))
+                   for _ in range(100000)]
+        result = instant_runoff(candidates, *make_ballots(ballots))
+        self.assertEqual(sum(result['rounds'][0]), 100000)
+        self.assertEqual(result['winner'], naive_runoff(candidates, ballots))
+
+
+class ApprovalCountTest(TestCase):
+    """Test cases for counting approval ballots."""
+
+    def test_counts(self):
+        """Each candidate gets one count per ballot approving it."""
+        offsets, prefs = make_ballots([[0, 2], [2], [1, 2]])
+        self.assertEqual(approval_counts(3, prefs), [1, 1, 3])
+
+
+class BallotViewTest(TestCase):
+    """Test cases for casting ballots and viewing their results."""
+
+    def setUp(self):
+        """Create a ranked poll with three choices and log a user in."""
+        cache.clear()
+        self.user = User.objects.create_user(username="voter",
+                                             password="secret123")
+        self.client.force_login(self.user)
+        self.question = Question.objects.create(
+            question_text="Best language?",
+            poll_type=Question.PollType.RANKED)
+        self.choices = [Choice.objects.create(question=self.question,
+                                              choice_text=text)
+                        for text in ("Python", "Go", "Rust")]
+
+    def rank(self, ranks):
+        """Cast a ranked ballot giving each choice id its rank."""
+        return self.client.post(
+            reverse('polls:vote', args=(self.question.id,)),
+            {f'rank_{choice.id}': rank for choice, rank in ranks.items()})
+
+    def test_cast_ranked_ballot(self):
+        """A ranked ballot is stored in preference order."""
+        response = self.rank({self.choices[2]: 1, self.choices[0]: 2})
+        self.assertRedirects(response, reverse('polls:results',
+                                               args=(self.question.id,)))
+        ballot = Ballot.objects.get(question=self.question, user=self.user)
+        self.assertEqual(
+            list(ballot.selections.order_by('rank').values_list('choice', 'rank')),
+            [(self.choices[2].id, 1), (self.choices[0].id, 2)])
+
+    def test_recast_replaces_ballot(self):
+        """Voting again replaces the previous ballot."""
+        self.rank({self.choices[0]: 1, self.choices[1]: 2})
+        self.rank({self.choices[1]: 1})
+        self.assertEqual(Ballot.objects.count(), 1)
+        self.assertEqual(list(BallotChoice.objects.values_list('choice', 'rank')),
+                         [(self.choices[1].id, 1)])
+
+    def test_duplicate_ranks_rejected(self):
+        """Two choices with the same rank make the ballot invalid."""
+        response = self.rank({self.choices[0]: 1, self.choices[1]: 1})
+        self.assertContains(response, "each with a different number")
+        self.assertFalse(Ballot.objects.exists())
+
+    def test_empty_ballot_rejected(self):
+        """A ballot that ranks nothing is not stored."""
+        response = self.rank({})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Ballot.objects.exists())
+
+    def test_detail_shows_previous_ranks(self):
+        """The detail page fills in the ranks of the user's ballot."""
+        self.rank({self.choices[1]: 1})
+        response = self.client.get(reverse('polls:detail',
+                                           args=(self.question.id,)))
+        self.assertContains(response, f'name="rank_{self.choices[1].id}"')
+        self.assertContains(response, 'value="1"')
+
+    def test_results_refresh_after_new_ballot(self):
+        """The cached tally is replaced when a ballot is cast."""
+        self.assertIsNone(tally_question(self.question)['winner'])
+        self.rank({self.choices[0]: 1})
+        tally = tally_question(self.question)
+        self.assertEqual(tally['ballots'], 1)
+        self.assertEqual(tally['winner'], self.choices[0])
+        response = self.client.get(reverse('polls:results',
+                                           args=(self.question.id,)))
+        self.assertContains(response, "Winner: <strong>Python</strong>")
+
+    def test_stale_count_not_served(self):
+        """A count that read the ballots before a new one is not cached."""
+        load_ballots = tally.load_ballots
+
+        def load_then_vote(question_id, candidates):
+            loaded = load_ballots(question_id, candidates)
+            self.rank({self.choices[1]: 1})
+            return loaded
+
+        with mock.patch('polls.tally.load_ballots', load_then_vote):
+            self.assertEqual(tally_question(self.question)['ballots'], 0)
+        self.assertEqual(tally_question(self.question)['ballots'], 1)
+
+    def test_approval_ballot(self):
+        """An approval ballot counts once for every selected choice."""
+        self.question.poll_type = Question.PollType.APPROVAL
+        self.question.save()
+        self.client.post(reverse('polls:vote', args=(self.question.id,)),
+                         {'choice': [self.choices[0].id, self.choices[2].id]})
+        tally = tally_question(self.question)
+        self.assertEqual(tally['counts'], [1, 0, 1])
+
+    def test_approval_rejects_foreign_choice(self):
+        """Choices of other polls cannot be approved."""
+        self.question.poll_type = Question.PollType.APPROVAL
+        self.question.save()
+        other = Question.objects.create(question_text="Other")
+        foreign = Choice.objects.create(question=other, choice_text="X")
+        response = self.client.post(
+            reverse('polls:vote', args=(self.question.id,)),
+            {'choice': [foreign.id]})
+        self.assertContains(response, "You didn&#x27;t select a choice.")
+        self.assertFalse(Ballot.objects.exists())
@@ -7,7 +7,8 @@ import datetime
 from django.test import TestCase
 from django.utils import timezone
 from django.urls import reverse
-from polls.models import Question
+from django.contrib.auth.models import User
+from polls.models import Ballot, BallotChoice, Choice, Question, Vote
 
 
 def create_question(question_text, days):
@@ -76,6 +77,76 @@ class QuestionIndexViewTests(TestCase):
         )
 
 
+class QuestionIndexVotedBadgeTests(TestCase):
+    """Tests for the voted badges on the index page."""
+
+    def setUp(self):
+        """Create a voter and a few questions with one choice each."""
+        self.user = User.objects.create_user(username="voter")
+        self.questions = [create_question(f"Question {n}", days=-n - 1)
+                          for n in range(3)]
+        self.choices = [Choice.objects.create(question=q, choice_text=f"Pick {q.id}")
+                        for q in self.questions]
+
+    def test_voted_badges(self):
+        """Questions the user voted on show the chosen option."""
+        Vote.objects.create(user=self.user, choice=self.choices[1])
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('polls:index'))
+        voted = {q.id: q.voted_choice for q in response.context['question_list']}
+        self.assertEqual(voted, {
+            self.questions[0].id: None,
+            self.questions[1].id: self.choices[1].choice_text,
+            self.questions[2].id: None,
+        })
+        self.assertContains(response, f"You chose {self.choices[1].choice_text}")
+        self.assertContains(response, "Not voted", count=2)
+
+    def test_ballot_badges(self):
+        """Questions the user cast a ballot in show the ballot's choices."""
+        question = self.questions[2]
+        question.poll_type = Question.PollType.RANKED
+        question.save()
+        second = Choice.objects.create(question=question, choice_text="Second")
+        ballot = Ballot.objects.create(question=question, user=self.user)
+        BallotChoice.objects.create(ballot=ballot, choice=second, rank=2)
+        BallotChoice.objects.create(ballot=ballot, choice=self.choices[2], rank=1)
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('polls:index'))
+        self.assertContains(response, f"You chose {self.choices[2].choice_text}, Second")
+        self.assertContains(response, "Not voted", count=2)
+
+    def test_other_users_votes_are_ignored(self):
+        """Votes of other users don't produce badges."""
+        other = User.objects.create_user(username="other")
+        Vote.objects.create(user=other, choice=self.choices[0])
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('polls:index'))
+        self.assertNotContains(response, "You chose")
+
+    def test_anonymous_has_no_badges(self):
+        """Anonymous visitors see no badges."""
+        response = self.client.get(reverse('polls:index'))
+        self.assertNotContains(response, "Not voted")
+
+    def test_query_count_is_fixed(self):
+        """
+        A page costs the same number of queries however many polls and votes exist.
+
+        The queries are the session, the user, the page count, the page of
+        questions and the user's votes and ballots on that page.
+        """
+        for n in range(30):
+            question = create_question(f"Extra {n}", days=-1)
+            choice = Choice.objects.create(question=question, choice_text="Yes")
+            Vote.objects.create(user=self.user, choice=choice)
+        self.client.force_login(self.user)
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse('polls:index'))
+        self.assertEqual(len(response.context['question_list']), 20)
+        self.assertTrue(response.context['is_paginated'])
+
+
 class QuestionDetailViewTests(TestCase):
     """Tests for the DetailView, which displays the details of a question."""
 
@@ -109,6 +180,51 @@ class QuestionDetailViewTests(TestCase):
         self.assertRedirects(response, reverse('polls:index'))
 
 
+class QuestionDetailQueryTests(TestCase):
+    """Tests for the number of queries the detail page costs."""
+
+    def setUp(self):
+        """Create a question with several choices and a logged in voter."""
+        self.question = create_question("Query count question", days=-1)
+        self.choices = [
+            Choice.objects.create(question=self.question, choice_text=f"Choice {n}")
+            for n in range(5)
+        ]
+        self.user = User.objects.create_user(username="voter")
+        self.url = reverse('polls:detail', args=(self.question.id,))
+
+    def test_anonymous_query_count(self):
+        """An anonymous visitor costs one query for the question and one for its choices."""
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url)
+        self.assertIsNone(response.context['previous_choice'])
+
+    def test_voter_query_count(self):
+        """
+        A logged in voter adds only the session and user queries.
+
+        The previous choice comes with the question, not in a query of its own.
+        """
+        Vote.objects.create(user=self.user, choice=self.choices[3])
+        self.client.force_login(self.user)
+        with self.assertNumQueries(4):
+            response = self.client.get(self.url)
+        self.assertEqual(response.context['previous_choice'], self.choices[3])
+
+    def test_query_count_independent_of_choices(self):
+        """Adding choices does not add queries."""
+        for n in range(20):
+            Choice.objects.create(question=self.question, choice_text=f"Extra {n}")
+        self.client.force_login(self.user)
+        with self.assertNumQueries(4):
+            self.client.get(self.url)
+
+    def test_choices_are_ordered(self):
+        """Choices are listed in the order they were added."""
+        response = self.client.get(self.url)
+        self.assertEqual(list(response.context['question'].choice_set.all()), self.choices)
+
+
 class QuestionResultsViewTests(TestCase):
     """Test suite for the ResultsView, which displays the results of a question."""
 
@@ -8,5 +8,12 @@ urlpatterns = [
     path('<int:pk>/', views.DetailView.as_view(), name='detail'),
     path('<int:pk>/results/', views.ResultsView.as_view(), name='results'),
     path('<int:question_id>/vote/', views.vote, name='vote'),
+    path('<int:question_id>/retract/', views.retract, name='retract'),
     path('signup/', views.signup_view, name='signup'),
+    path('my-votes/', views.MyVotesView.as_view(), name='my_votes'),
+    path('profiles/', views.profile_list, name='profiles'),
+    path('profiles/<int:profile_id>.prof', views.profile_download,
+         {'suffix': '.prof'}, name='profile_download'),
+    path('profiles/<int:profile_id>.json', views.profile_download,
+         {'suffix': '.json'}, name='profile_sql'),
 ]
@@ -0,0 +1,37 @@
+"""
+Helpers shared by the polls app.
+
+This module contains small utilities used by several commands and
+modules of the polls app.
+"""
+import itertools
+
+from django.db import connection
+
+
+def batched(iterable, size):
+    """Yield lists of at most ``size`` items from ``iterable``."""
+    iterator = iter(iterable)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
+
+
+def upsert(model, objs, unique_fields, update_fields):
+    """
+    Insert ``objs``, updating ``update_fields`` of the rows that exist.
+
+    MySQL and MariaDB cannot name the columns of the conflict and update on
+    a clash with any unique key instead; ``unique_fields`` must therefore
+    be the only unique key of ``model`` that new rows can clash with.
+
+    Args:
+        model (type): The model of ``objs``.
+        objs (list): The unsaved instances.
+        unique_fields (list): The fields identifying an existing row.
+        update_fields (list): The fields to overwrite in existing rows.
+    """
+    if not connection.features.supports_update_conflicts_with_target:
+        unique_fields = None
+    model.objects.bulk_create(objs, update_conflicts=True,
+                              unique_fields=unique_fields,
+                              update_fields=update_fields)
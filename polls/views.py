@@ -4,20 +4,36 @@ Views for the polls application.
 This module contains view classes and functions to handle requests for
 the polls app.
 """
+from django.conf import settings
 from django.shortcuts import get_object_or_404, render, redirect
-from django.http import HttpResponseRedirect, Http404
+from django.http import FileResponse, HttpResponseRedirect, Http404
 from django.urls import reverse
 from django.views import generic
 from django.utils import timezone
 from django.contrib import messages
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
+from django.contrib.auth.views import redirect_to_login
+from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.forms import UserCreationForm
-from django.db.models import F
+from django.db.models import (F, OuterRef, Prefetch, Subquery, Value,
+                              prefetch_related_objects)
 from django.contrib.auth.signals import user_logged_in, user_logged_out, user_login_failed
+from django.db import transaction
 from django.dispatch import receiver
 
 import logging
-from polls.models import Choice, Question, Vote
+from polls import anonymous, bus
+from polls.events import record_event
+from polls.finalize import finalize_question
+from polls.ingest import enqueue_vote, pending_choices
+from polls.models import (Ballot, BallotChoice, Choice, FinalResult,
+                          PendingVote, Question, Vote, VoteEvent)
+from polls.profiling import list_profiles, profile_path
+from polls.ratelimit import vote_rate_limited
+from polls.reconcile import mark_dirty
+from polls.search import search_questions
+from polls.tally import invalidate_tally, tally_question
 
 
 class IndexView(generic.ListView):
@@ -32,17 +48,83 @@ class IndexView(generic.ListView):
 
     template_name = 'polls/index.html'
     context_object_name = 'question_list'
+    paginate_by = 20
 
     def get_queryset(self):
         """
         Return the published questions.
 
-        Not including those set to be published in the future.
+        Not including those set to be published in the future. When the
+        ``q`` parameter is given, return the matching questions ranked by
+        relevance instead.
         """
+        self.query = self.request.GET.get('q', '').strip()
+        self.next_cursor = None
+        if self.query:
+            questions, self.next_cursor = search_questions(
+                self.query, cursor=self.request.GET.get('after'))
+            return questions
         return Question.objects.filter(
             pub_date__lte=timezone.now()
         ).order_by('-pub_date')
 
+    def get_paginate_by(self, queryset):
+        """Search results are paginated by their own cursor."""
+        return None if self.query else self.paginate_by
+
+    def get_context_data(self, **kwargs):
+        """
+        Add the search state and the user's votes to the context data.
+
+        Each question on the page gets a ``voted_choice`` attribute holding
+        the text of the choice the user voted for, the texts of the
+        choices on their ballot in approval and ranked-choice polls, or
+        None. The votes and ballots of the whole page are fetched in one
+        query. Finalized questions also
+        get ``winners``, the texts of their winning choices, read from
+        their frozen results in one more query.
+        """
+        context = super().get_context_data(**kwargs)
+        context['query'] = self.query
+        context['next_cursor'] = self.next_cursor
+
+        questions = context['question_list']
+        voted = {}
+        if self.request.user.is_authenticated:
+            question_ids = [question.id for question in questions]
+            votes = Vote.objects.filter(
+                user=self.request.user, choice__question_id__in=question_ids,
+            ).annotate(rank=Value(0)).values_list(
+                'choice__question_id', 'choice__choice_text', 'rank')
+            selections = BallotChoice.objects.filter(
+                ballot__user=self.request.user,
+                ballot__question_id__in=question_ids,
+            ).values_list('ballot__question_id', 'choice__choice_text', 'rank')
+            picked = {}
+            for question_id, choice_text, rank in sorted(
+                    votes.union(selections, all=True), key=lambda row: row[2]):
+                picked.setdefault(question_id, []).append(choice_text)
+            voted = {question_id: ', '.join(texts)
+                     for question_id, texts in picked.items()}
+        winners = {}
+        finalized = [question.id for question in questions
+                     if question.finalized_at is not None]
+        if finalized:
+            for question_id, choice_text in FinalResult.objects.filter(
+                    question_id__in=finalized, winner=True,
+            ).order_by('choice_id').values_list('question_id', 'choice_text'):
+                winners.setdefault(question_id, []).append(choice_text)
+        if settings.POLLS_VOTE_QUEUE and self.request.user.is_authenticated:
+            # Votes still in the queue replace the applied ones.
+            voted.update({question_id: choice_text
+                          for question_id, (_, choice_text) in pending_choices(
+                              self.request.user,
+                              [question.id for question in questions]).items()})
+        for question in questions:
+            question.voted_choice = voted.get(question.id)
+            question.winners = winners.get(question.id, [])
+        return context
+
 
 class DetailView(generic.DetailView):
     """
@@ -74,7 +156,8 @@ class DetailView(generic.DetailView):
             HttpResponse: Renders the results page.
         """
         try:
-            self.object = get_object_or_404(Question, pk=kwargs["pk"])
+            self.object = get_object_or_404(self.get_voter_queryset(),
+                                            pk=kwargs["pk"])
         except Http404:
             messages.error(request,
                            f"Poll number {kwargs['pk']} does not exist.")
@@ -85,24 +168,54 @@ class DetailView(generic.DetailView):
             messages.error(request, "This poll is closed.")
             return redirect('polls:index')
 
-        return self.render_to_response(self.get_context_data(
-                                       object=self.object))
+        prefetch_related_objects([self.object], Prefetch(
+            'choice_set', queryset=Choice.objects.order_by('id')))
+        response = self.render_to_response(self.get_context_data(
+                                           object=self.object))
+        if self.object.is_anonymous():
+            # Hand out the device token before the vote is submitted.
+            token, new = anonymous.device_token(request)
+            if new:
+                anonymous.set_device_cookie(response, token)
+        return response
+
+    def get_voter_queryset(self):
+        """
+        Return the questions annotated with the user's previous choice.
+
+        The id of the choice the current user voted for is fetched in the
+        same query as the question, as ``previous_choice_id``.
+        """
+        questions = Question.objects.all()
+        this_user = self.request.user
+        if this_user.is_authenticated:
+            previous_vote = Vote.objects.filter(
+                user=this_user, choice__question=OuterRef('pk'))
+            questions = questions.annotate(previous_choice_id=Subquery(
+                previous_vote.values('choice_id')[:1]))
+        return questions
 
     def get_context_data(self, **kwargs):
         """Add the previous choice of the user to the context data."""
         context = super().get_context_data(**kwargs)
         question = self.object
-        this_user = self.request.user
-
-        if this_user.is_authenticated:
-            try:
-                previous_vote = Vote.objects.get(user=this_user,
-                                                 choice__question=question)
-                context['previous_choice'] = previous_vote.choice
-            except Vote.DoesNotExist:
-                context['previous_choice'] = None
-        else:
-            context['previous_choice'] = None
+        previous_choice_id = getattr(question, 'previous_choice_id', None)
+        if question.is_anonymous():
+            previous_choice_id = None
+        elif settings.POLLS_VOTE_QUEUE and self.request.user.is_authenticated:
+            pending = pending_choices(self.request.user, [question.id])
+            if question.id in pending:
+                previous_choice_id = pending[question.id][0]
+        context['previous_choice'] = next(
+            (choice for choice in question.choice_set.all()
+             if choice.id == previous_choice_id), None)
+        if (question.poll_type != Question.PollType.PLURALITY
+                and self.request.user.is_authenticated):
+            ranks = dict(BallotChoice.objects.filter(
+                ballot__question=question, ballot__user=self.request.user,
+            ).values_list('choice_id', 'rank'))
+            for choice in question.choice_set.all():
+                choice.previous_rank = ranks.get(choice.id)
         return context
 
 
@@ -142,14 +255,91 @@ class ResultsView(generic.DetailView):
             messages.error(request,
                            f"Poll number {kwargs['pk']} does not exist.")
             return redirect("polls:index")
-        return render(request, self.template_name, {"question": self.object})
+        # Closed polls are counted once and served from the frozen rows.
+        if self.object.finalized_at is None and self.object.is_closed():
+            finalize_question(self.object)
+        context = {"question": self.object}
+        if self.object.finalized_at is not None:
+            context["final_results"] = list(
+                self.object.final_results.order_by('choice_id'))
+        elif self.object.poll_type != Question.PollType.PLURALITY:
+            context["tally"] = tally_question(self.object)
+        return render(request, self.template_name, context)
+
+
+class MyVotesView(LoginRequiredMixin, generic.ListView):
+    """
+    Displays the votes and ballots of the current user, newest first.
 
+    The votes are keyset-paginated on the vote id: the ``before`` parameter
+    holds the id of the last vote on the previous page, so every page is a
+    range scan of the (user, id) index however deep it is.  Ballots in
+    approval and ranked-choice polls are listed in their own table, paged
+    the same way on the ballot id by ``ballots_before``; each table is only
+    shown while paging through the other one is not.
 
-@login_required
+    Attributes:
+        template_name (str): The path to the template that renders the view.
+        context_object_name (str): The name of the context object
+                                   used in the template.
+        page_size (int): The number of votes on a page.
+    """
+
+    template_name = 'polls/my_votes.html'
+    context_object_name = 'vote_list'
+    page_size = 20
+
+    def get_page(self, queryset, parameter):
+        """
+        Return one page of ``queryset`` after the id in ``parameter``.
+
+        Returns:
+            tuple: The objects on the page and the id to continue from on
+                   the next page, or None on the last page.
+        """
+        queryset = queryset.filter(user=self.request.user).order_by('-id')
+        try:
+            queryset = queryset.filter(id__lt=int(self.request.GET[parameter]))
+        except (KeyError, ValueError):
+            pass
+        objects = list(queryset[:self.page_size + 1])
+        if len(objects) > self.page_size:
+            objects = objects[:self.page_size]
+            return objects, objects[-1].id
+        return objects, None
+
+    def get_queryset(self):
+        """Return one page of the user's votes with their choice and question."""
+        self.next_before = None
+        if 'ballots_before' in self.request.GET:
+            return []
+        votes, self.next_before = self.get_page(
+            Vote.objects.select_related('choice__question'), 'before')
+        return votes
+
+    def get_context_data(self, **kwargs):
+        """Add a page of the user's ballots and the ids to continue from."""
+        context = super().get_context_data(**kwargs)
+        ballots, next_ballots_before = [], None
+        if 'before' not in self.request.GET:
+            selections = BallotChoice.objects.select_related('choice').order_by('rank')
+            ballots, next_ballots_before = self.get_page(
+                Ballot.objects.select_related('question').prefetch_related(
+                    Prefetch('selections', queryset=selections)),
+                'ballots_before')
+        context['next_before'] = self.next_before
+        context['ballot_list'] = ballots
+        context['next_ballots_before'] = next_ballots_before
+        return context
+
+
+@vote_rate_limited
 def vote(request, question_id):
     """
     Handle voting for a specific question.
 
+    Logging in is required unless the question is anonymous.
+
     Args:
         request: The HTTP request object.
         question_id (int): The ID of the question being voted on.
@@ -162,6 +352,8 @@ def vote(request, question_id):
     """
     question = get_object_or_404(Question, pk=question_id)
     this_user = request.user
+    if not (this_user.is_authenticated or question.is_anonymous()):
+        return redirect_to_login(request.get_full_path())
 
     logger = logging.getLogger('polls')
     ip_address = get_client_ip(request)
@@ -172,6 +364,9 @@ def vote(request, question_id):
                        f"unavailable poll ({question_id}) from {ip_address}")
         return redirect("polls:index")
 
+    if question.poll_type != Question.PollType.PLURALITY:
+        return cast_ballot(request, question)
+
     try:
         selected_choice = question.choice_set.get(pk=request.POST['choice'])
     except (KeyError, Choice.DoesNotExist):
@@ -183,33 +378,214 @@ def vote(request, question_id):
             'error_message': "You didn't select a choice.",
         })
 
-    try:
-        # Find the existing vote by this user
-        _vote = Vote.objects.get(user=this_user, choice__question=question)
-
-        # Decrement the vote count for the old choice
-        _vote.choice.vote_count = F('vote_count') - 1
-        _vote.choice.save()
-        # Change the vote to the new choice
-        _vote.choice = selected_choice
-        _vote.save()
+    if question.is_anonymous():
+        return anonymous_vote(request, question, selected_choice)
+
+    if settings.POLLS_VOTE_QUEUE:
+        return queue_vote(request, question, selected_choice)
+
+    with transaction.atomic():
+        try:
+            # Find the existing vote by this user
+            _vote = Vote.objects.get(user=this_user, choice__question=question)
+
+            # Decrement the vote count for the old choice.  Counts are
+            # updated in place: saving the choice would reindex its question.
+            Choice.objects.filter(pk=_vote.choice_id).update(
+                vote_count=F('vote_count') - 1)
+            # Change the vote to the new choice
+            _vote.choice = selected_choice
+            _vote.save()
+            kind = VoteEvent.Kind.CHANGED
+            messages.success(request, f"Your vote was changed "
+                             f"to {selected_choice.choice_text}.")
+            logger.info(f"{this_user.username} changed vote to "
+                        f"{selected_choice.choice_text} ({selected_choice.id}) "
+                        f"in poll {question.id}")
+        except Vote.DoesNotExist:
+            # Create a new vote if the user hasn't voted yet
+            _vote = Vote.objects.create(user=this_user, choice=selected_choice)
+            kind = VoteEvent.Kind.CAST
+            messages.success(request, f"You voted for "
+                             f"{selected_choice.choice_text}.")
+            logger.info(f"{this_user.username} voted for "
+                        f"{selected_choice.choice_text} ({selected_choice.id}) "
+                        f"in poll {question.id}")
+
+        # Increment the vote count for the new choice
+        Choice.objects.filter(pk=selected_choice.pk).update(
+            vote_count=F('vote_count') + 1)
+        record_event(kind, this_user.id, question.id, selected_choice.id)
+        mark_dirty(question.id)
+    return HttpResponseRedirect(reverse('polls:results', args=(question.id,)))
+
+
+@login_required
+@vote_rate_limited
+def retract(request, question_id):
+    """
+    Withdraw the user's vote in an open poll.
+
+    Returns:
+        HttpResponseRedirect: A redirect to the results page, or to the
+                              index if the poll is unavailable.
+    """
+    question = get_object_or_404(Question, pk=question_id)
+    this_user = request.user
+    logger = logging.getLogger('polls')
+
+    if request.method != 'POST' or not question.can_vote():
+        messages.error(request, "This poll is unavailable.")
+        return redirect("polls:index")
+
+    with transaction.atomic():
+        queued = PendingVote.objects.filter(user=this_user,
+                                            question=question).delete()[0]
+        _vote = Vote.objects.filter(user=this_user, choice__question=question
+                                    ).select_related('choice').first()
+        if _vote is not None:
+            _vote.delete()
+            Choice.objects.filter(pk=_vote.choice_id).update(
+                vote_count=F('vote_count') - 1)
+            record_event(VoteEvent.Kind.RETRACTED, this_user.id, question.id,
+                         _vote.choice_id)
+            mark_dirty(question.id)
+            bus.publish(question.id)
+
+    if _vote is None and not queued:
+        messages.error(request, "You have not voted in this poll.")
+    else:
+        messages.success(request, "Your vote was withdrawn.")
+        logger.info(f"{this_user.username} withdrew their vote "
+                    f"in poll {question.id}")
+    return HttpResponseRedirect(reverse('polls:results', args=(question.id,)))
+
+
+def anonymous_vote(request, question, selected_choice):
+    """
+    Cast a vote in an anonymous question, once per device.
+
+    Returns:
+        HttpResponseRedirect: A redirect to the results page, which also
+                              sets the device cookie of a new device.
+    """
+    logger = logging.getLogger('polls')
+    token, new = anonymous.device_token(request)
+    key = anonymous.voter_key(question.id, token)
+    if anonymous.cast_anonymous_vote(question, selected_choice, key):
+        messages.success(request, f"You voted for "
+                         f"{selected_choice.choice_text}.")
+        logger.info(f"Anonymous vote for {selected_choice.choice_text} "
+                    f"({selected_choice.id}) in poll {question.id}")
+    else:
+        messages.error(request, "This device has already voted in this poll.")
+    response = HttpResponseRedirect(reverse('polls:results',
+                                            args=(question.id,)))
+    if new:
+        anonymous.set_device_cookie(response, token)
+    return response
+
+
+def queue_vote(request, question, selected_choice):
+    """
+    Queue a validated vote for the ingest_votes worker.
+
+    Returns:
+        HttpResponseRedirect: A redirect to the results page.
+    """
+    this_user = request.user
+    logger = logging.getLogger('polls')
+    changed = (
+        PendingVote.objects.filter(user=this_user, question=question).exists()
+        or Vote.objects.filter(user=this_user,
+                               choice__question=question).exists())
+    enqueue_vote(this_user, question, selected_choice)
+    if changed:
         messages.success(request, f"Your vote was changed "
                          f"to {selected_choice.choice_text}.")
-        logger.info(f"{this_user.username} changed vote to "
-                    f"{selected_choice.choice_text} ({selected_choice.id}) "
-                    f"in poll {question.id}")
-    except Vote.DoesNotExist:
-        # Create a new vote if the user hasn't voted yet
-        _vote = Vote.objects.create(user=this_user, choice=selected_choice)
+    else:
         messages.success(request, f"You voted for "
                          f"{selected_choice.choice_text}.")
-        logger.info(f"{this_user.username} voted for "
-                    f"{selected_choice.choice_text} ({selected_choice.id}) "
-                    f"in poll {question.id}")
+    logger.info(f"{this_user.username} queued a vote for "
+                f"{selected_choice.choice_text} ({selected_choice.id}) "
+                f"in poll {question.id}")
+    return HttpResponseRedirect(reverse('polls:results', args=(question.id,)))
 
-    # Increment the vote count for the new choice
-    selected_choice.vote_count = F('vote_count') + 1
-    selected_choice.save()
+
+def read_ballot(question, data):
+    """
+    Read the choices of an approval or ranked-choice ballot from a form.
+
+    Approval ballots send the selected choice ids as ``choice``; ranked
+    ballots send a ``rank_<choice id>`` number for each ranked choice.
+
+    Returns:
+        list: The selected choice ids in preference order, or None if the
+              ballot is empty or invalid.
+    """
+    choice_ids = set(question.choice_set.values_list('id', flat=True))
+    try:
+        if question.poll_type == Question.PollType.APPROVAL:
+            selected = {int(value) for value in data.getlist('choice')}
+            if not selected or not selected <= choice_ids:
+                return None
+            return sorted(selected)
+        ranks = {choice_id: int(data[f'rank_{choice_id}'])
+                 for choice_id in choice_ids
+                 if data.get(f'rank_{choice_id}', '').strip()}
+    except ValueError:
+        return None
+    if (not ranks or min(ranks.values()) < 1
+            or len(set(ranks.values())) != len(ranks)):
+        return None
+    return sorted(ranks, key=ranks.get)
+
+
+def cast_ballot(request, question):
+    """
+    Record the user's ballot in an approval or ranked-choice poll.
+
+    A new ballot replaces the user's previous one.
+
+    Returns:
+        HttpResponseRedirect: A redirect to the results page
+                              if the ballot is valid.
+        HttpResponse: A render of the detail page with an
+                      error message otherwise.
+    """
+    this_user = request.user
+    logger = logging.getLogger('polls')
+    selected = read_ballot(question, request.POST)
+    if selected is None:
+        logger.error(f"Invalid ballot by {this_user.username} "
+                     f"for poll {question.id}")
+        if question.poll_type == Question.PollType.APPROVAL:
+            error_message = "You didn't select a choice."
+        else:
+            error_message = "Rank at least one choice, each with a different number."
+        return render(request, 'polls/detail.html', {
+            'question': question,
+            'error_message': error_message,
+        })
+
+    with transaction.atomic():
+        ballot, created = Ballot.objects.update_or_create(
+            question=question, user=this_user,
+            defaults={'cast_at': timezone.now()})
+        ballot.selections.all().delete()
+        BallotChoice.objects.bulk_create([
+            BallotChoice(ballot=ballot, choice_id=choice_id, rank=rank)
+            for rank, choice_id in enumerate(selected, start=1)
+        ])
+        bus.publish(question.id)
+    invalidate_tally(question.id)
+
+    if created:
+        messages.success(request, "Your ballot was recorded.")
+    else:
+        messages.success(request, "Your ballot was changed.")
+    logger.info(f"{this_user.username} cast a ballot for {selected} "
+                f"in poll {question.id}")
     return HttpResponseRedirect(reverse('polls:results', args=(question.id,)))
 
 
@@ -248,6 +624,38 @@ def user_login_failed(sender, credentials, request, **kwargs):
                    f"{credentials.get('username')} from {ip}")
 
 
+@staff_member_required
+def profile_list(request):
+    """
+    List the stored request profiles.
+
+    Returns:
+        HttpResponse: The rendered list of profiles, newest first.
+    """
+    return render(request, 'polls/profiles.html',
+                  {'profiles': list_profiles()})
+
+
+@staff_member_required
+def profile_download(request, profile_id, suffix):
+    """
+    Download one file of a stored profile.
+
+    Args:
+        request: The HTTP request object.
+        profile_id (int): The id of the profile.
+        suffix (str): '.prof' for the pstats data, '.json' for the SQL.
+
+    Returns:
+        FileResponse: The file as an attachment.
+    """
+    path = profile_path(profile_id, suffix)
+    if not path.is_file():
+        raise Http404(f"Profile {profile_id} does not exist.")
+    return FileResponse(path.open('rb'), as_attachment=True,
+                        filename=path.name)
+
+
 def signup_view(request):
     """
     Handle the user signup process.